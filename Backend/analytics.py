@@ -0,0 +1,227 @@
+# 全班學習分析的預先彙總（question_bank_db，Redis DB2）
+#
+# 「甲班哪些子單元最弱」、「前 10 名」這類問題原本要掃描所有 user:* 並解析每個人的 progress json。
+# 這裡在每次評分後（database.add_response_to_question）以 Lua 腳本遞增更新彙總，讀取時只需一次
+# ZREVRANGE / ZRANGE / HGETALL（O(log n + k)）。
+#
+# 每個彙總都有兩個範圍（scope）：all（全校）與 class:{班級}，Key 為 analytics:{scope}:...
+#   - analytics:{scope}:score（zset）: 學號，score 為累計得分（排行榜）
+#   - analytics:{scope}:hist:{子單元}（hash）: 分數 0~10（四捨五入）-> 作答次數
+#   - analytics:{scope}:topic_stats（hash）: {子單元}:sum / {子單元}:count
+#   - analytics:{scope}:topic_avg（zset）: 子單元，score 為平均分數（由低到高即弱點）
+#   - analytics:{scope}:qa_type（hash）: {題型}:count / {題型}:sum，各 QuestionType 的作答次數與總分
+#
+# 既有資料的一次性回填：python analytics.py backfill [--dry-run]
+# 從 question:{qid}:responses（與尚未搬移的舊 responses 欄位）重新計算所有彙總；
+# 回填會覆寫既有彙總，請在沒有學生作答時執行。
+
+import sys
+import json
+import argparse
+import redis
+
+BACKFILL_BATCH_SIZE = 500
+ALL_SCOPE = "all"
+
+analytics_db = redis.Redis(host='localhost', port=6379, db=2)
+student_db = redis.Redis(host='localhost', port=6379, db=0)
+
+# KEYS: score, hist:{子單元}, topic_stats, topic_avg, qa_type
+# ARGV: 學號, 子單元, 分數, 題型(可為空字串)
+RECORD_ANSWER_LUA = """
+local score = tonumber(ARGV[3]) or 0
+redis.call('ZINCRBY', KEYS[1], score, ARGV[1])
+redis.call('HINCRBY', KEYS[2], tostring(math.max(0, math.min(10, math.floor(score + 0.5)))), 1)
+local sum = tonumber(redis.call('HINCRBYFLOAT', KEYS[3], ARGV[2] .. ':sum', score))
+local count = redis.call('HINCRBY', KEYS[3], ARGV[2] .. ':count', 1)
+redis.call('ZADD', KEYS[4], sum / count, ARGV[2])
+if ARGV[4] ~= '' then
+  redis.call('HINCRBY', KEYS[5], ARGV[4] .. ':count', 1)
+  redis.call('HINCRBYFLOAT', KEYS[5], ARGV[4] .. ':sum', score)
+end
+return count
+"""
+
+_scripts = {}
+
+
+def scope_of(student_class=None):
+    return f"class:{student_class}" if student_class else ALL_SCOPE
+
+def _key(scope, name):
+    return f"analytics:{scope}:{name}"
+
+def _record_script():
+    if "record" not in _scripts:
+        _scripts["record"] = analytics_db.register_script(RECORD_ANSWER_LUA)
+    return _scripts["record"]
+
+def score_bucket(score):
+    return max(0, min(10, int((score or 0) + 0.5)))
+
+def _scopes(student_class):
+    return [ALL_SCOPE] + ([scope_of(student_class)] if student_class else [])
+
+# 記錄一次已評分的作答（全校與該班各一次，一個 pipeline 送出）
+def record_answer(student_id, student_class, topic, qa_type, score):
+    script = _record_script()
+    pipe = analytics_db.pipeline(transaction=False)
+    for scope in _scopes(student_class):
+        script(keys=[_key(scope, "score"), _key(scope, f"hist:{topic}"), _key(scope, "topic_stats"),
+                     _key(scope, "topic_avg"), _key(scope, "qa_type")],
+               args=[student_id, topic, score or 0, qa_type or ""], client=pipe)
+    pipe.execute()
+
+def _decode(value):
+    return value.decode("utf-8") if isinstance(value, bytes) else value
+
+# 排行榜：累計得分最高的 top 位學生
+def leaderboard(student_class=None, top=10):
+    rows = analytics_db.zrevrange(_key(scope_of(student_class), "score"), 0, top - 1, withscores=True)
+    return [{"rank": i + 1, "student_id": _decode(sid), "score": round(score, 2)} for i, (sid, score) in enumerate(rows)]
+
+# 單一學生的名次與累計得分（名次從 1 開始，沒有作答紀錄時為 None）
+def student_rank(student_id, student_class=None):
+    key = _key(scope_of(student_class), "score")
+    pipe = analytics_db.pipeline(transaction=False)
+    pipe.zrevrank(key, student_id)
+    pipe.zscore(key, student_id)
+    pipe.zcard(key)
+    rank, score, total = pipe.execute()
+    return {
+        "student_id": student_id,
+        "rank": None if rank is None else rank + 1,
+        "score": round(score or 0, 2),
+        "students": total
+    }
+
+# 平均分數最低的 top 個子單元（弱點）
+def weak_topics(student_class=None, top=10):
+    scope = scope_of(student_class)
+    rows = analytics_db.zrange(_key(scope, "topic_avg"), 0, top - 1, withscores=True)
+    if not rows:
+        return []
+    counts = analytics_db.hmget(_key(scope, "topic_stats"), [f"{_decode(topic)}:count" for topic, _ in rows])
+    return [{"topic": _decode(topic), "avg": round(avg, 2), "answers": int(count or 0)}
+            for (topic, avg), count in zip(rows, counts)]
+
+# 子單元的分數分布（0~10 分各幾次）
+def topic_histogram(topic, student_class=None):
+    raw = analytics_db.hgetall(_key(scope_of(student_class), f"hist:{topic}"))
+    hist = {str(b): 0 for b in range(11)}
+    hist.update({_decode(k): int(v) for k, v in raw.items()})
+    return {"topic": topic, "histogram": hist, "answers": sum(hist.values())}
+
+# 各題型的作答次數與平均分數
+def question_type_stats(student_class=None):
+    raw = {_decode(k): float(v) for k, v in analytics_db.hgetall(_key(scope_of(student_class), "qa_type")).items()}
+    stats = {}
+    for field, value in raw.items():
+        qa_type, _, name = field.rpartition(":")
+        stats.setdefault(qa_type, {"count": 0, "sum": 0.0})[name] = value
+    return {qa_type: {"count": int(s["count"]), "avg": round(s["sum"] / s["count"], 2) if s["count"] else 0.0}
+            for qa_type, s in stats.items()}
+
+
+# 從題庫的作答紀錄重新計算所有彙總（覆寫既有的 analytics:* key）
+def backfill_analytics(dry_run=False, batch_size=BACKFILL_BATCH_SIZE):
+    # {scope: {"score": {學號: 總分}, "hist": {子單元: {分數: 次數}}, "topics": {子單元: [總分, 次數]}, "types": {題型: [總分, 次數]}}}
+    totals = {}
+    stats = {"questions": 0, "responses": 0, "students": 0}
+    class_of = {}
+
+    def scope_totals(scope):
+        return totals.setdefault(scope, {"score": {}, "hist": {}, "topics": {}, "types": {}})
+
+    def add(student_class, student_id, topic, qa_type, score):
+        for scope in _scopes(student_class):
+            t = scope_totals(scope)
+            t["score"][student_id] = t["score"].get(student_id, 0.0) + score
+            hist = t["hist"].setdefault(topic, {})
+            hist[score_bucket(score)] = hist.get(score_bucket(score), 0) + 1
+            topic_total = t["topics"].setdefault(topic, [0.0, 0])
+            topic_total[0] += score
+            topic_total[1] += 1
+            if qa_type:
+                type_total = t["types"].setdefault(qa_type, [0.0, 0])
+                type_total[0] += score
+                type_total[1] += 1
+
+    def process(keys):
+        pipe = analytics_db.pipeline(transaction=False)
+        for key in keys:
+            pipe.hmget(key, "topic", "qaType", "responses")
+            pipe.lrange(f"{_decode(key)}:responses", 0, -1)
+        results = pipe.execute()
+
+        answers = []  # (學號, 子單元, 題型, 分數)
+        for i in range(len(keys)):
+            (topic, qa_type, legacy), records = results[2 * i], results[2 * i + 1]
+            if topic is None:
+                continue
+            stats["questions"] += 1
+            records = json.loads(legacy) if legacy is not None else [json.loads(r) for r in records]
+            for record in records:
+                if record.get("student_id"):
+                    answers.append((str(record["student_id"]), _decode(topic), _decode(qa_type), float(record.get("score") or 0)))
+
+        missing = list({sid for sid, _, _, _ in answers if sid not in class_of})
+        if missing:
+            pipe = student_db.pipeline(transaction=False)
+            for sid in missing:
+                pipe.hget(f"user:{sid}", "class")
+            class_of.update({sid: _decode(c) or None for sid, c in zip(missing, pipe.execute())})
+        for sid, topic, qa_type, score in answers:
+            add(class_of.get(sid), sid, topic, qa_type, score)
+        stats["responses"] += len(answers)
+
+    keys = []
+    for key in analytics_db.scan_iter(match="question:*", count=1000, _type="HASH"):
+        keys.append(key)
+        if len(keys) >= batch_size:
+            process(keys)
+            keys = []
+    if keys:
+        process(keys)
+    stats["students"] = len(totals.get(ALL_SCOPE, {}).get("score", {}))
+    stats["scopes"] = sorted(totals)
+    if dry_run:
+        return stats
+
+    pipe = analytics_db.pipeline(transaction=True)  # 舊彙總的刪除與重新寫入以 MULTI 一次套用
+    old_keys = list(analytics_db.scan_iter(match="analytics:*", count=1000))
+    for start in range(0, len(old_keys), batch_size):
+        pipe.delete(*old_keys[start:start + batch_size])
+    for scope, t in totals.items():
+        if t["score"]:
+            pipe.zadd(_key(scope, "score"), t["score"])
+        for topic, hist in t["hist"].items():
+            pipe.hset(_key(scope, f"hist:{topic}"), mapping={str(b): n for b, n in hist.items()})
+        if t["topics"]:
+            pipe.hset(_key(scope, "topic_stats"), mapping={
+                f"{topic}:{name}": value
+                for topic, (total, count) in t["topics"].items() for name, value in (("sum", total), ("count", count))})
+            pipe.zadd(_key(scope, "topic_avg"), {topic: total / count for topic, (total, count) in t["topics"].items()})
+        if t["types"]:
+            pipe.hset(_key(scope, "qa_type"), mapping={
+                f"{qa_type}:{name}": value
+                for qa_type, (total, count) in t["types"].items() for name, value in (("sum", total), ("count", count))})
+    pipe.execute()
+    return stats
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="全班學習分析彙總")
+    sub = parser.add_subparsers(dest="command", required=True)
+    p = sub.add_parser("backfill", help="從題庫的作答紀錄重新計算所有彙總")
+    p.add_argument("--dry-run", action="store_true", help="只統計不寫入")
+
+    args = parser.parse_args(argv)
+    if args.command == "backfill":
+        stats = backfill_analytics(dry_run=args.dry_run)
+        print(f"✅ 掃描 {stats['questions']} 題、{stats['responses']} 筆作答、{stats['students']} 位學生，"
+              f"範圍：{'、'.join(stats['scopes']) or '無'}{'（dry-run 未寫入）' if args.dry_run else ''}")
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,351 @@
+# 效能量測腳本（需要本機 Redis）
+#
+# 用法：
+#   python benchmarks.py roundtrips [--answers 200]
+#       比較一次作答在舊版 add_response_to_question 與 progress_store.record_response 的
+#       Redis 往返次數與平均延遲。使用 BENCH_REDIS_DB（預設 12）起算的三個獨立 DB，結束後會清空這三個 DB。
+#   python benchmarks.py prompts
+#       以 tiktoken 比較新舊提示詞模板的 token 數，以及新模板中可被 OpenAI prefix caching 命中的固定開頭長度（不需要 Redis）。
+#   python benchmarks.py mastery [--students 30000] [--topics 60]
+#       以隨機產生的 progress 量測 mastery.py 批次掌握度估計與推薦各階段的耗時（不需要執行中的 Redis 伺服器；mastery.py 在 import 時建立的 Redis client 不會連線，但仍需安裝 redis 套件）。
+
+import os
+import sys
+import json
+import time
+import argparse
+import numpy as np
+import redis
+
+import progress_store
+import prompts
+import mastery
+
+BENCH_REDIS_DB = int(os.getenv("BENCH_REDIS_DB", "12"))
+
+
+# 計算 client 發出的往返次數：一般指令每次一趟，pipeline 每次 execute() 一趟
+class RoundTripCounter:
+    def __init__(self, *clients):
+        self.count = 0
+        for client in clients:
+            self._wrap(client)
+
+    def _wrap(self, client):
+        execute_command = client.execute_command
+        pipeline = client.pipeline
+
+        def counted_execute_command(*args, **kwargs):
+            self.count += 1
+            return execute_command(*args, **kwargs)
+
+        def counted_pipeline(*args, **kwargs):
+            pipe = pipeline(*args, **kwargs)
+            execute = pipe.execute
+
+            def counted_execute(*a, **kw):
+                self.count += 1
+                return execute(*a, **kw)
+
+            pipe.execute = counted_execute
+            return pipe
+
+        client.execute_command = counted_execute_command
+        client.pipeline = counted_pipeline
+
+
+# 舊版 add_response_to_question 的 Redis 存取順序（僅供比較）
+def legacy_add_response(question_db, subtopic_db, student_db, unit_topic_list, qid, student_id, answer, score):
+    qkey = f"question:{qid}"
+    question_data = question_db.hgetall(qkey)
+    topic = question_data[b"topic"].decode("utf-8")
+    unit = question_data[b"unit"].decode("utf-8")
+
+    responses = json.loads(question_data.get(b"responses", b"[]").decode("utf-8"))
+    responses.append({"student_id": student_id, "answer": answer, "score": score})
+    question_db.hset(qkey, "responses", json.dumps(responses))
+    question_db.hincrby(qkey, "answered_count", 1)
+    current_avg = float(question_data.get(b"accuracy", b"0.0").decode("utf-8"))
+    count = int(question_db.hget(qkey, "answered_count"))
+    question_db.hset(qkey, "accuracy", round((current_avg * (count - 1) + score * 10) / count, 2))
+
+    skey = f"subtopic:{topic}"
+    subtopic_db.hincrby(skey, "answered_count", 1)
+    topic_count = int(subtopic_db.hget(skey, "answered_count"))
+    prev_accuracy = float(subtopic_db.hget(skey, "accuracy") or 0.0)
+    subtopic_db.hset(skey, "accuracy", round((prev_accuracy * (topic_count - 1) + score * 10) / topic_count, 2))
+
+    ukey = f"user:{student_id}"
+    progress = json.loads(student_db.hget(ukey, "progress") or "{}")
+    topic_progress = progress.get(topic, [0, 0.0])
+    topic_progress[0] += 1
+    topic_progress[1] = round((topic_progress[1] * (topic_progress[0] - 1) + score) / topic_progress[0], 2)
+    progress[topic] = topic_progress
+    student_db.hset(ukey, "progress", json.dumps(progress))
+
+    completed_topics = json.loads(student_db.hget(ukey, "completed_topics") or "[]")
+    if topic_progress[0] >= 3 and topic_progress[1] >= 7 and topic not in completed_topics:
+        completed_topics.append(topic)
+        student_db.hset(ukey, "completed_topics", json.dumps(completed_topics))
+
+    unit_progress = json.loads(student_db.hget(ukey, "unit_progress") or "{}")
+    unit_topics = unit_topic_list[unit]
+    done = sum(1 for t in unit_topics if t in completed_topics)
+    unit_progress[unit] = round(done / len(unit_topics) * 100, 2)
+    student_db.hset(ukey, "unit_progress", json.dumps(unit_progress))
+
+    completed_units = json.loads(student_db.hget(ukey, "completed_units") or "[]")
+    if unit_progress[unit] == 100.0 and unit not in completed_units:
+        completed_units.append(unit)
+        student_db.hset(ukey, "completed_units", json.dumps(completed_units))
+
+
+def _bench_clients():
+    return [redis.Redis(host='localhost', port=6379, db=BENCH_REDIS_DB + i) for i in range(3)]
+
+def _seed(student_db, subtopic_db, question_db, unit, topics):
+    for db in (student_db, subtopic_db, question_db):
+        db.flushdb()
+    for i, topic in enumerate(topics):
+        subtopic_db.hset(f"subtopic:{topic}", mapping={"unit": unit, "answered_count": 0, "accuracy": 0.0})
+        subtopic_db.zadd(f"index:unit:{unit}", {topic: i})
+    question_db.hset("question:Qbench", mapping={"question": "bench", "unit": unit, "topic": topics[0],
+                                                  "answered_count": 0, "accuracy": 0.0})
+    student_db.hset("user:bench", mapping={"progress": "{}", "completed_topics": "[]",
+                                           "unit_progress": "{}", "completed_units": "[]"})
+
+def bench_roundtrips(answers):
+    student_db, subtopic_db, question_db = _bench_clients()
+    unit, topics = "bench-unit", ["bench-topic-1", "bench-topic-2", "bench-topic-3"]
+    counter = RoundTripCounter(student_db, subtopic_db, question_db)
+    results = {}
+
+    try:
+        _seed(student_db, subtopic_db, question_db, unit, topics)
+        counter.count = 0
+        start = time.perf_counter()
+        for i in range(answers):
+            legacy_add_response(question_db, subtopic_db, student_db, {unit: topics},
+                                "Qbench", "bench", f"answer {i}", 8)
+        results["legacy"] = (counter.count / answers, (time.perf_counter() - start) / answers * 1000)
+
+        _seed(student_db, subtopic_db, question_db, unit, topics)
+        progress_store.record_response(question_db, subtopic_db, student_db, "Qbench", "bench", "{}", True, 8)  # 先載入腳本
+        counter.count = 0
+        start = time.perf_counter()
+        for i in range(answers):
+            record = json.dumps({"student_id": "bench", "answer": f"answer {i}", "score": 8})
+            progress_store.record_response(question_db, subtopic_db, student_db, "Qbench", "bench", record, True, 8)
+        results["atomic"] = (counter.count / answers, (time.perf_counter() - start) / answers * 1000)
+    finally:
+        for db in (student_db, subtopic_db, question_db):
+            db.flushdb()
+
+    print(f"作答次數: {answers}")
+    print(f"{'版本':<10}{'往返次數/次':>14}{'延遲 ms/次':>14}")
+    for name, (trips, ms) in results.items():
+        print(f"{name:<10}{trips:>14.1f}{ms:>14.3f}")
+    return results
+
+
+# 舊版提示詞模板（僅供比較 token 數）：變動內容夾在固定說明中間
+LEGACY_GRADING_RUBRIC = """### 評分標準
+1. '若[使用者的回答] 與 [問題] 不相關，文不對題'總分零分。
+2. '若 [問題] 要求舉例，而沒有舉例'總分零分。
+3. '若 [問題] 要求解釋或理由，而未說明原因'總分零分。
+4. '若 [問題] 要求寫出優缺點，而未寫出優缺點，或少其中一個'總分零分。
+5. '若 [使用者的回答] 缺少答案關鍵詞'扣一分。
+6. ' [使用者的回答] 若字數少於20字，代表答案過短'扣三分，回答很多不扣分。
+7. '若 [使用者的回答] 不正確'最高分五分，若超過一個錯，再依錯誤數量，每發現一個錯誤就再扣一分，直到分數為零。
+8. '總分不能超過十分'超過以仍十分統計。
+9. '總分不能低於零分，也就是總分不能出現負數'低於零分以零分統計。
+10. 扣分與加分必定是'整數'。
+11. '評分時，若[使用者的回答]有錯誤，並在[扣分原因]依序點出錯誤的地方，給予正確的答案'**內容有錯誤，就一定會被扣分，不可能滿分十分**。"""
+
+def legacy_generate_messages(course_info, num_questions):
+    prompt = f"""你是一位資料結構課程的出題老師，請根據以下課程內容，**隨機生成{num_questions} 題觀念性問題**。這些問題需符合指定的出題類型與條件。
+   ---
+
+    ## 🧠【課程內容】：
+    {course_info}
+
+    ---
+
+    ## 🧾【出題規範與限制】：
+
+    1. 問題必須與上述課程內容有明確關聯，**不能出現任何程式碼問題**。
+    2. 問題類型須從以下7種類型中產生，並隨機選擇：
+    - 1. 選擇題（需附上解釋理由）
+    - 2. 定義題（要求寫出概念定義並舉例）
+    - 3. 計算題（計算時間複雜度、樹高、碰撞機率等）
+    - 4. 簡答題（回答概念並輔以說明或比較）
+    - 5. 情境題（假設特定情境，問學生會發生什麼，並說明原因）
+    - 6. 開放式問題（學生可自由提出想法，不只一種答案）
+    - 7. 綜合思考題（需結合兩個以上概念回答）
+
+    3. 題目需為**非是非題**，並且**問題文字不超過兩句話**。
+    4. 每題應強調**理解、解釋、比較、舉例、或推理計算**。
+    5. 題目中**不提供提示或範例**，不附解答。
+    6. 題目**不能只是知識回憶**，應引導學生思考其應用與理解。
+
+    ---
+
+    ## ✅【範例參考】：
+    - 如何判定 min-max heap 任一節點 [x] 是在 min 或 max 層？
+    - DEAP 和 min-max heap 的想法有何共通點？
+    - 建立 binomial heap 的時間複雜度如何決定？
+    - pairing heap 和 Fibonacci heap 有何異同？
+    - 給定 m 種相異鍵值，如何推算 2-3 樹高的上限？
+    - 以線性探索搜尋雜湊表不存在值的效率如何評估？請舉例解說。
+    - 令 m = 雜湊表大小、n = 資料筆數，請從 m 和 n 推導發生碰撞的機率。
+    - AVL 樹刪除葉節點後的檢查可否改從樹根開始由上而下？有何優缺點？
+
+    ---
+
+    請根據以上規則，只生成 {num_questions} 題問題。每題為繁體中文獨立問題，*不用編號*直接換行列出。
+
+    ---
+    ## 【輸出格式】：
+    【問題類型(7種類型之一)】每題問題獨立一行，**不需要任何其他文字或說明**。
+    【問題類型(7種類型之一)】每題問題獨立一行，**不需要任何其他文字或說明**。
+    【問題類型(7種類型之一)】每題問題獨立一行，**不需要任何其他文字或說明**。
+
+    """
+    return [
+        {"role": "system", "content": "你是一位專業的課程助理，能根據課程內容生成三個相關問題。請用中文詢問，遇到專有名詞後面括號英文名稱，如:Heap（堆積）。"},
+        {"role": "user", "content": prompt}
+    ]
+
+def legacy_evaluate_messages(question, user_answer):
+    prompt = f"""
+你是一位專業的電腦科學助理，請根據以下標準評分使用者的回答：
+
+{LEGACY_GRADING_RUBRIC}
+
+### 問題
+{question}
+
+### 使用者的回答
+{user_answer}
+
+請根據**評分標準**對[使用者的回答]打 1~10 分，1分是最低分、10分是最高分。
+並且使用繁體中文，提供簡短(2、3句)的評語，剩下只需說明扣分原因(沒扣分，也就是回答滿分十分則寫'扣分原因:無')。
+若學生的回答有錯或說明不足的部分，請在[扣分原因]後寫上'錯誤地方與正確的答案'或'針對說明不足的部分提供改善建議'，並在評語給予整體回答評價。
+
+### 輸出格式為:
+分數: (獲得分數)/10 分  
+評語: (評語)  
+扣分原因: (列點扣分原因，沒有扣分寫'無')
+"""
+    return [
+        {"role": "system", "content": "你是一位 資料結構 評審，負責評分使用者的答案。"},
+        {"role": "user", "content": prompt}
+    ]
+
+_SAMPLE_COURSE_INFO = "Heap（堆積）：min-max heap、DEAP、binomial heap、Fibonacci heap 與 pairing heap 的結構、操作與時間複雜度。"
+_SAMPLE_QUESTION = "【簡答題】pairing heap 和 Fibonacci heap 在 decrease-key 操作上有何異同？請說明原因。"
+_SAMPLE_ANSWER = "兩者都用 lazy 的方式處理，Fibonacci heap 用 cascading cut 保證 amortized O(1)，pairing heap 直接切下子樹再合併，實務上較快但理論界限較弱。"
+
+def _count_tokens(encoder, messages):
+    return sum(len(encoder.encode(m["content"])) + 4 for m in messages) + 3
+
+# 開頭有多少 token 在不同請求之間完全相同（prefix caching 可命中的部分）
+def _shared_prefix_tokens(encoder, a, b):
+    tokens_a = encoder.encode("".join(m["role"] + m["content"] for m in a))
+    tokens_b = encoder.encode("".join(m["role"] + m["content"] for m in b))
+    shared = 0
+    for x, y in zip(tokens_a, tokens_b):
+        if x != y:
+            break
+        shared += 1
+    return shared
+
+def bench_prompts():
+    import tiktoken
+    encoder = tiktoken.encoding_for_model("gpt-4o-mini")
+    other_answer = "Fibonacci heap 會標記失去子節點的節點。"
+
+    cases = [
+        ("generate", legacy_generate_messages, prompts.generate_messages,
+         (_SAMPLE_COURSE_INFO, 3), ("AVL 樹的旋轉", 3)),
+        ("evaluate", legacy_evaluate_messages, prompts.evaluate_messages,
+         (_SAMPLE_QUESTION, _SAMPLE_ANSWER), (_SAMPLE_QUESTION, other_answer)),
+    ]
+    results = {}
+    print(f"{'模板':<10}{'版本':<8}{'prompt tokens':>15}{'共同開頭 tokens':>18}")
+    for name, legacy, current, args, other_args in cases:
+        for version, build in (("legacy", legacy), ("new", current)):
+            messages = build(*args)
+            total = _count_tokens(encoder, messages)
+            prefix = _shared_prefix_tokens(encoder, messages, build(*other_args))
+            results[(name, version)] = (total, prefix)
+            print(f"{name:<10}{version:<8}{total:>15}{prefix:>18}")
+    print("OpenAI 只有在共同開頭達 1024 tokens 以上時才會啟用 prefix caching。")
+    return results
+
+
+# 隨機產生 students 位學生的 progress json：每人依課程順序作答過前面若干個子單元
+def _synthetic_progress(students, topics, rng):
+    reached = rng.integers(0, len(topics) + 1, size=students)
+    raw = []
+    for n in reached:
+        attempts = rng.integers(1, 6, size=n)
+        avgs = np.round(rng.uniform(0, 10, size=n), 2)
+        raw.append(json.dumps({topics[j]: [int(attempts[j]), float(avgs[j])] for j in range(n)}, ensure_ascii=False))
+    return raw
+
+def bench_mastery(students, num_topics):
+    rng = np.random.default_rng(0)
+    topics = [f"topic-{j}" for j in range(num_topics)]
+    # 每 5 個子單元共用一個主題方向，模擬同一主單元內的子單元彼此相關
+    centers = rng.normal(size=(num_topics // 5 + 1, 384))
+    embeddings = mastery.vector_store.normalize_rows(centers[np.arange(num_topics) // 5] + 0.6 * rng.normal(size=(num_topics, 384)))
+    raw = _synthetic_progress(students, topics, rng)
+
+    timings = {}
+    start = time.perf_counter()
+    attempts, points = mastery.matrices_from_progress(raw, {t: j for j, t in enumerate(topics)})
+    timings["解析 progress"] = time.perf_counter() - start
+
+    start = time.perf_counter()
+    weights = mastery.similarity_weights(topics, topics, embeddings)
+    timings["相似度權重"] = time.perf_counter() - start
+
+    start = time.perf_counter()
+    estimate, evidence = mastery.estimate_mastery(attempts, points, weights)
+    chosen, review = mastery.recommend(estimate, evidence)
+    mastery.weak_topics(estimate, attempts)
+    timings["掌握度與推薦"] = time.perf_counter() - start
+
+    total = sum(timings.values())
+    print(f"學生數: {students}，子單元數: {num_topics}，相似子單元配對: {int((weights > 0).sum()) // 2}")
+    for name, seconds in timings.items():
+        print(f"   - {name}: {seconds * 1000:.1f} ms")
+    print(f"合計 {total:.3f}s（{students / total:.0f} 位/秒），推薦下一個 {int((~review).sum())}、複習 {int(review.sum())}")
+    return timings
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="ds-dc-bot 後端效能量測")
+    sub = parser.add_subparsers(dest="command", required=True)
+
+    p = sub.add_parser("roundtrips", help="比較作答紀錄更新的 Redis 往返次數")
+    p.add_argument("--answers", type=int, default=200)
+
+    sub.add_parser("prompts", help="比較新舊提示詞模板的 token 數")
+
+    p = sub.add_parser("mastery", help="量測全體學生掌握度估計與推薦的耗時")
+    p.add_argument("--students", type=int, default=30000)
+    p.add_argument("--topics", type=int, default=60)
+
+    args = parser.parse_args(argv)
+    if args.command == "roundtrips":
+        bench_roundtrips(args.answers)
+    elif args.command == "prompts":
+        bench_prompts()
+    elif args.command == "mastery":
+        bench_mastery(args.students, args.topics)
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,57 @@
+# 課程樹（主單元 -> 依順序排列的子單元）與 ETag
+#
+# bot 每次點選單都要分別呼叫 /units/menu、/topics、/topics/menu，後端每次都重新讀 DB1 組出答案，
+# 但課程樹（cleaned_course_tree_unit1to3.json）一學期大概只改一次。
+# 這裡把整棵樹組成一份 JSON，依內容計算 ETag：內容不變時 ETag 不變，客戶端帶 If-None-Match 即回 304，
+# 可無限期快取，點選單不必再呼叫後端。
+#
+# id 由名稱的 sha1 產生（u- 開頭為主單元、t- 開頭為子單元），不會因為順序調整而改變，取代原本的清單索引。
+
+import json
+import hashlib
+import threading
+
+_cache = {"key": None, "tree": None, "body": None, "etag": None, "units": {}, "topics": {}}
+_lock = threading.Lock()
+
+
+def unit_id(unit):
+    return "u-" + hashlib.sha1(unit.encode("utf-8")).hexdigest()[:10]
+
+def topic_id(topic):
+    return "t-" + hashlib.sha1(topic.encode("utf-8")).hexdigest()[:10]
+
+def build_tree(unit_order, unit_topic_list):
+    units = []
+    for i, unit in enumerate(unit_order, start=1):
+        topics = [{"id": topic_id(t), "name": t, "order": j} for j, t in enumerate(unit_topic_list.get(unit, []), start=1)]
+        units.append({"id": unit_id(unit), "name": unit, "order": i, "topics": topics})
+    return {"units": units}
+
+# 取得課程樹，回傳 (tree, JSON 內容 bytes, ETag)；課程內容不變時直接回傳快取
+def get_course_tree(unit_order, unit_topic_list):
+    key = tuple((unit, tuple(unit_topic_list.get(unit, []))) for unit in unit_order)
+    with _lock:
+        if key != _cache["key"]:
+            tree = build_tree(unit_order, unit_topic_list)
+            body = json.dumps(tree, ensure_ascii=False, separators=(",", ":"), sort_keys=True).encode("utf-8")
+            tree["version"] = hashlib.sha256(body).hexdigest()[:16]
+            body = json.dumps(tree, ensure_ascii=False, separators=(",", ":"), sort_keys=True).encode("utf-8")
+            _cache.update({
+                "key": key,
+                "tree": tree,
+                "body": body,
+                "etag": tree["version"],
+                "units": {u["id"]: u for u in tree["units"]},
+                "topics": {t["id"]: (u["name"], t["name"]) for u in tree["units"] for t in u["topics"]}
+            })
+        return _cache["tree"], _cache["body"], _cache["etag"]
+
+# 由 id 找主單元名稱（需先呼叫過 get_course_tree）
+def unit_name(uid):
+    unit = _cache["units"].get(uid)
+    return unit["name"] if unit else None
+
+# 由 id 找 (主單元名稱, 子單元名稱)
+def topic_by_id(tid):
+    return _cache["topics"].get(tid)
@@ -6,13 +6,21 @@
 
 import redis
 import json
-from sentence_transformers import SentenceTransformer
-import numpy as np
+import hashlib
+import itertools
+import time
 from pymongo import MongoClient
 import os
 from flask import Flask, request, jsonify
-import bcrypt
 from dotenv import load_dotenv
+import vector_store
+import progress_store
+import models
+import startup
+import tracing
+import quiz_session
+import login_guard
+import analytics
 load_dotenv()
 """
 問題類型須從以下7種類型中產生，並隨機選擇：
@@ -36,12 +44,14 @@ class QuestionType(Enum):
 
 # 初始化 Flask 應用程式
 app = Flask(__name__)
+tracing.init_app(app)  # 請求計時、Redis/OpenAI/embedding/bcrypt 區段耗時與 /metrics
 
 # 連接 MongoDB
 # MongoDB 初始化
 # print("✅ MONGODB_URI =", os.getenv("MONGODB_URI"))
-mongo_client = MongoClient(os.getenv("MONGODB_URI"))
-mongo_db = mongo_client['DAL_Discord']
+with startup.step("建立 MongoDB 連線"):
+    mongo_client = MongoClient(os.getenv("MONGODB_URI"))
+    mongo_db = mongo_client['DAL_Discord']
 
 student_list = mongo_db['student_list']
 
@@ -51,68 +61,176 @@ unit_vector_db = redis.Redis(host='localhost', port=6379, db=1)
 question_bank_db = redis.Redis(host='localhost', port=6379, db=2)
 active_users_db = redis.Redis(host='localhost', port=6379, db=3)
 
-with open("/home/dc-qa-bot/discord_model/cleaned_course_tree_unit1to3.json", "r", encoding="utf-8") as f:
-    _course_data = json.load(f)
+# 課程結構 JSON（整個行程只讀一次，重建 DB1 時沿用）
+COURSE_TREE_PATH = os.getenv("COURSE_TREE_PATH", "/home/dc-qa-bot/discord_model/cleaned_course_tree_unit1to3.json")
+_course_cache = {"data": None}
+
+def load_course_data(refresh=False):
+    if refresh or _course_cache["data"] is None:
+        with startup.step("讀取課程 JSON"):
+            with open(COURSE_TREE_PATH, "r", encoding="utf-8") as f:
+                _course_cache["data"] = json.load(f)
+    return _course_cache["data"]
+
+_course_data = load_course_data()
 unit_order = [unit['name'] for unit in _course_data]
 
-model = SentenceTransformer('paraphrase-MiniLM-L6-v2')
+# 子單元向量模型改由 models.py 在第一次 encode 時才載入（見 models.UNIT_MODEL_NAME）
 
 topic_unit_map = {}
 unit_topic_list = {}
 subtopics = []
 default_progress = {}
 
+# 學生索引（student_db，Redis DB0）
+# Key: index:students（set）: 所有學號，取代 KEYS user:* 掃描
+STUDENT_INDEX = "index:students"
+
+def course_units_from(course_data):
+    return [(unit['name'], [child['name'] for child in unit['children']]) for unit in course_data]
+
 def ensure_unit_data_loaded():
     global topic_unit_map, unit_topic_list, subtopics, default_progress, unit_order
 
-    # Redis DB1 初始化狀態檢查
-    existing_keys = unit_vector_db.keys("subtopic:*")
-    if not existing_keys:
+    # Redis DB1 初始化狀態檢查（讀 index:subtopics，不再 KEYS subtopic:*）
+    subtopic_count = vector_store.subtopic_count()
+    if subtopic_count:
+        print(f"✅ Redis DB1 已載入 {subtopic_count} 個子單元，略過初始化")
+    elif next(unit_vector_db.scan_iter("subtopic:*", count=100), None) is not None:
+        print("🔄 Redis DB1 缺少子單元索引，依課程結構補建索引...")
+        vector_store.rebuild_course_index(course_units_from(_course_data))
+    else:
         print("🔄 Redis DB1 尚未初始化，執行 rebuild_unit_vector_db()...")
         rebuild_unit_vector_db()
-    else:
-        print(f"✅ Redis DB1 已載入 {len(existing_keys)} 個子單元，略過初始化")
 
     sync_mongo_to_redis() # 初始化 MongoDB 資料到 Redis
 
-    # 初始化記憶中結構
-    topic_unit_map = {}
-    unit_topic_list = {}
-
-    for key in unit_vector_db.keys("subtopic:*"):
-        topic = key.decode().split("subtopic:")[1]
-        unit = unit_vector_db.hget(key, "unit").decode("utf-8")
-        topic_unit_map[topic] = unit
-        if unit not in unit_topic_list:
-            unit_topic_list[unit] = []
-        unit_topic_list[unit].append(topic)
+    # 初始化記憶中結構（一次往返讀出課程索引）
+    unit_order, unit_topic_list, topic_unit_map = vector_store.read_course_index()
+    subtopics = [topic for unit in unit_order for topic in unit_topic_list[unit]]
+
+# MongoDB -> Redis 學生資料同步只會寫入身分欄位；學習狀態（progress、completed_topics、score、
+# compressive_memory 等）只在學生第一次建立時初始化，之後重新同步也不會被清空
+STUDENT_IDENTITY_FIELDS = {  # Redis 欄位 -> MongoDB 欄位
+    "name": "name",
+    "email": "email",
+    "class": "class",
+    "hash_password": "hashed_password"
+}
+STUDENT_SYNC_BATCH_SIZE = int(os.getenv("STUDENT_SYNC_BATCH_SIZE", "1000"))
+
+def _new_student_state():
+    return {
+        "completed_units": json.dumps([]),
+        "unit_progress": json.dumps({}),
+        "completed_topics": json.dumps([]),
+        "progress": json.dumps({}),
+        # 初始化壓縮記憶一開始放入"還未做過測驗"，作答後會被更新
+        "compressive_memory": json.dumps(["第一單元還未做過測驗", "第二單元還未做過測驗", "第三單元還未做過測驗"]),
+        "discord_id": "00000000",  # 新增 discord_id 欄位，初始化"00000000"
+        "score": 0,
+        "accuracy": 0.0
+    }
 
-    unit_order = sorted(unit_topic_list.keys())
-    subtopics = list(topic_unit_map.keys())
-
-def sync_mongo_to_redis(): # 將 MongoDB 學生資料同步到 Redis，學期初建立學生資料庫時使用
-    ensure_unit_data_loaded()  # 確保單元資料已載入
-
-    for student in student_list.find():
-        student_id = str(student["student_id"])
-        student_db.hset(f"user:{student_id}", mapping={
-            "name": student["name"],
-            "email": student["email"],
-            "class": student["class"],
-            "hash_password": student["hashed_password"],
-            "completed_units": json.dumps([]),
-            "unit_progress": json.dumps({}),
-            "completed_topics": json.dumps([]),
-            "progress": json.dumps({}),
-            # 初始化壓縮記憶一開始放入"還未做過測驗"，作答後會被更新
-            "compressive_memory": json.dumps(["第一單元還未做過測驗", "第二單元還未做過測驗", "第三單元還未做過測驗"]),
-            # active_users: 學生登入狀態 (bool) [True or False]
-            "active_users": int(False),  # 寫入 0 表示未登入，登入時改為 1
-            "discord_id": "00000000",  # 新增 discord_id 欄位，初始化"00000000"
-            "score": 0,
-            "accuracy": 0.0
-        })
-    print("✅ 已將 MongoDB 學生資料寫入 Redis")
+# MongoDB 欄位值轉成寫入 Redis 的值：bcrypt.hashpw 回傳的 bytes（Binary）解碼成字串，缺欄位寫入空字串，其餘照原樣
+def _identity_value(value):
+    if value is None:
+        return ""
+    if isinstance(value, bytes):
+        return value.decode("utf-8")
+    return value
+
+# 身分欄位的內容雜湊，存在 identity_hash 欄位，內容沒變的學生不必重寫
+def student_identity_hash(identity):
+    raw = json.dumps([identity[field] for field in STUDENT_IDENTITY_FIELDS], ensure_ascii=False, default=str)
+    return hashlib.sha1(raw.encode("utf-8")).hexdigest()[:16]
+
+def _mapping_bytes(mapping):
+    return sum(len(str(k).encode("utf-8")) + len(str(v).encode("utf-8")) for k, v in mapping.items())
+
+# 將 MongoDB 學生資料同步到 Redis，學期初建立學生資料庫或匯入新名單時使用
+#   - 以 projection 只讀身分欄位，cursor 每 batch_size 筆一批
+#   - 每批一次 pipeline 讀出既有的 identity_hash，再一次 pipeline 寫入：
+#     新學生寫入身分欄位與初始學習狀態；身分欄位有變的學生只改身分欄位；沒變的略過
+# 回傳 {"students", "created", "updated", "unchanged", "bytes_written", "seconds"}
+def sync_mongo_to_redis(batch_size=STUDENT_SYNC_BATCH_SIZE):
+    started = time.time()
+    stats = {"students": 0, "created": 0, "updated": 0, "unchanged": 0, "bytes_written": 0}
+    projection = {"_id": 0, "student_id": 1, **{mongo_field: 1 for mongo_field in STUDENT_IDENTITY_FIELDS.values()}}
+    cursor = student_list.find({}, projection, batch_size=batch_size)
+
+    while True:
+        batch = list(itertools.islice(cursor, batch_size))
+        if not batch:
+            break
+        students = []
+        for student in batch:
+            identity = {field: _identity_value(student.get(mongo_field)) for field, mongo_field in STUDENT_IDENTITY_FIELDS.items()}
+            students.append((str(student["student_id"]), identity, student_identity_hash(identity)))
+
+        pipe = student_db.pipeline(transaction=False)
+        for student_id, _, _ in students:
+            pipe.exists(f"user:{student_id}")
+            pipe.hget(f"user:{student_id}", "identity_hash")
+        existing = pipe.execute()
+
+        pipe = student_db.pipeline(transaction=False)
+        for i, (student_id, identity, identity_hash) in enumerate(students):
+            exists, old_hash = existing[2 * i], existing[2 * i + 1]
+            if exists and old_hash is not None and old_hash.decode("utf-8") == identity_hash:
+                stats["unchanged"] += 1
+                continue
+            mapping = {**identity, "identity_hash": identity_hash}
+            if exists:
+                stats["updated"] += 1
+            else:
+                mapping.update(_new_student_state())
+                stats["created"] += 1
+            pipe.hset(f"user:{student_id}", mapping=mapping)
+            stats["bytes_written"] += _mapping_bytes(mapping)
+        pipe.sadd(STUDENT_INDEX, *[student_id for student_id, _, _ in students])
+        pipe.execute()
+        stats["students"] += len(students)
+
+    stats["seconds"] = round(time.time() - started, 3)
+    rate = stats["students"] / stats["seconds"] if stats["seconds"] else float(stats["students"])
+    print(f"✅ 已將 MongoDB 學生資料同步到 Redis：{stats['students']} 位學生"
+          f"（新增 {stats['created']}、更新 {stats['updated']}、未變 {stats['unchanged']}），"
+          f"寫入 {stats['bytes_written']} bytes，耗時 {stats['seconds']:.2f}s（{rate:.0f} 位/秒）")
+    return stats
+
+# 多 worker 部署時，各 worker 的 topic_unit_map / unit_topic_list / unit_order 以 DB1 版本號保持一致：
+# 每個請求前最多每 UNIT_DATA_CHECK_INTERVAL 秒比對一次版本號，DB1 重建後自動重新讀取課程索引
+UNIT_DATA_CHECK_INTERVAL = float(os.getenv("UNIT_DATA_CHECK_INTERVAL", "5"))
+_unit_data_state = {"version": None, "checked_at": 0.0}
+
+def refresh_unit_data_if_stale(force=False):
+    global topic_unit_map, unit_topic_list, subtopics, unit_order
+    now = time.time()
+    if not force and now - _unit_data_state["checked_at"] < UNIT_DATA_CHECK_INTERVAL:
+        return False
+    _unit_data_state["checked_at"] = now
+
+    version = vector_store.current_version()
+    if not force and version == _unit_data_state["version"] and topic_unit_map:
+        return False
+    new_order, new_topic_list, new_topic_map = vector_store.read_course_index()
+    if not new_topic_map:  # DB1 尚未建立索引，沿用課程 JSON 的順序
+        return False
+    unit_order, unit_topic_list, topic_unit_map = new_order, new_topic_list, new_topic_map
+    subtopics = [topic for unit in unit_order for topic in unit_topic_list[unit]]
+    _unit_data_state["version"] = version
+    return True
+
+@app.before_request
+def _refresh_unit_data():
+    refresh_unit_data_if_stale()
+
+def get_unit_order():
+    return unit_order
+
+def get_unit_topic_list():
+    return unit_topic_list
 
 # 學期末刪除redis學生資料庫資料
 def clear_student_data():
@@ -124,13 +242,13 @@ def clear_student_data():
 # Key: subtopic:{子單元名稱}
 # 欄位:
 #   - unit: 主單元名稱（str）
-#   - embedding: 該子單元的向量（list[float]，經 json.dumps）
+#   - embedding: 該子單元的向量（float32 binary，舊資料為 list[float] 經 json.dumps，見 vector_store.py）
 #   - answered_count: 被學生作答次數（int）
 #   - accuracy: 學生作答正確率（float，百分比）
+# 清空後全部重建（會清除子單元的作答統計）；課程小幅修改請用 sync_unit_vector_db()
 def rebuild_unit_vector_db():
     unit_vector_db.flushdb()
-    with open("/home/dc-qa-bot/discord_model/cleaned_course_tree_unit1to3.json", "r", encoding="utf-8") as f:
-        course_data = json.load(f)
+    course_data = load_course_data()
 
     global topic_unit_map, unit_topic_list, subtopics, default_progress, unit_order
     topic_unit_map = {}
@@ -149,15 +267,115 @@ def rebuild_unit_vector_db():
             topic_unit_map[name] = unit_name
             subtopics.append(name)
 
-    embeddings = model.encode(subtopics)
+    embeddings = models.encode(subtopics, models.UNIT_MODEL_NAME)
+    pipe = unit_vector_db.pipeline(transaction=True)  # 子單元與索引以 MULTI 一次寫入
     for i, topic in enumerate(subtopics):
         key = f"subtopic:{topic}"
-        unit_vector_db.hset(key, mapping={
+        pipe.hset(key, mapping={
             "unit": topic_unit_map[topic],
-            "embedding": json.dumps(embeddings[i].tolist()),
+            "embedding": vector_store.encode_embedding(embeddings[i]),
+            "content_hash": subtopic_content_hash(topic, models.resolve_model_name(models.UNIT_MODEL_NAME)),
             "answered_count": 0,
             "accuracy": 0.0
         })
+    vector_store.write_course_index(pipe, [(unit, unit_topic_list[unit]) for unit in unit_order])
+    pipe.set(vector_store.MODEL_KEY, models.resolve_model_name(models.UNIT_MODEL_NAME))  # 查詢時須用同一個模型編碼
+    pipe.execute()
+    version = vector_store.new_version()
+    vector_store.write_snapshot_for_version(version)  # 選用：先寫出 .npy 快照供各 worker mmap 共用
+    vector_store.bump_version(version)  # 再通知各 worker 重新載入子單元向量矩陣
+
+# 子單元向量的內容雜湊：子單元文字 + 模型名稱，任一改變都需要重新編碼
+def subtopic_content_hash(topic, model_name):
+    return hashlib.sha1(f"{model_name}\n{topic}".encode("utf-8")).hexdigest()[:16]
+
+SYNC_BATCH_SIZE = 256
+
+# 增量更新 unit_vector_db（取代 flushdb 全部重建）：
+#   - 新增的子單元：編碼並寫入，answered_count / accuracy 從 0 開始
+#   - 文字或模型改變的子單元（content_hash 不同）：重新編碼，保留 answered_count / accuracy
+#   - 只換了主單元的子單元：只更新 unit 欄位
+#   - 課程中已移除的子單元：刪除
+# 所有寫入以 SYNC_BATCH_SIZE 筆為一批的 pipeline 送出，最後以 MULTI 一次更新課程索引與模型名稱。
+# dry_run=True 時只回傳並印出變更報告，不寫入。
+# 回傳 {"added", "changed", "moved", "removed", "unchanged"}（子單元名稱清單）
+def sync_unit_vector_db(dry_run=False):
+    global topic_unit_map, unit_topic_list, subtopics, default_progress, unit_order
+    course_data = load_course_data(refresh=True)
+    course_units = course_units_from(course_data)
+    desired = {topic: unit for unit, topics in course_units for topic in topics}
+    model_name = models.resolve_model_name(models.UNIT_MODEL_NAME)
+
+    existing_topics = [key.decode("utf-8")[len("subtopic:"):] for key in unit_vector_db.scan_iter("subtopic:*", count=1000)]
+    pipe = unit_vector_db.pipeline(transaction=False)
+    for topic in existing_topics:
+        pipe.hmget(f"subtopic:{topic}", "unit", "content_hash")
+    existing = {topic: (unit.decode("utf-8") if unit else None, h.decode("utf-8") if h else None)
+                for topic, (unit, h) in zip(existing_topics, pipe.execute())}
+
+    report = {"added": [], "changed": [], "moved": [], "removed": [], "unchanged": []}
+    for topic, unit in desired.items():
+        if topic not in existing:
+            report["added"].append(topic)
+        elif existing[topic][1] != subtopic_content_hash(topic, model_name):
+            report["changed"].append(topic)
+        elif existing[topic][0] != unit:
+            report["moved"].append(topic)
+        else:
+            report["unchanged"].append(topic)
+    report["removed"] = [topic for topic in existing if topic not in desired]
+
+    print(f"{'🔍 [dry-run] ' if dry_run else '🔄 '}子單元向量增量更新（模型 {model_name}）："
+          f"新增 {len(report['added'])}、重新編碼 {len(report['changed'])}、換主單元 {len(report['moved'])}、"
+          f"刪除 {len(report['removed'])}、不變 {len(report['unchanged'])}")
+    for kind in ("added", "changed", "moved", "removed"):
+        for topic in report[kind]:
+            print(f"   {kind:<8} {topic}")
+    if dry_run:
+        return report
+
+    to_encode = report["added"] + report["changed"]
+    new_topics = set(report["added"])
+    for start in range(0, len(to_encode), SYNC_BATCH_SIZE):
+        batch = to_encode[start:start + SYNC_BATCH_SIZE]
+        embeddings = models.encode(batch, models.UNIT_MODEL_NAME)
+        pipe = unit_vector_db.pipeline(transaction=False)
+        for topic, embedding in zip(batch, embeddings):
+            mapping = {
+                "unit": desired[topic],
+                "embedding": vector_store.encode_embedding(embedding),
+                "content_hash": subtopic_content_hash(topic, model_name)
+            }
+            if topic in new_topics:
+                mapping.update({"answered_count": 0, "accuracy": 0.0})
+            pipe.hset(f"subtopic:{topic}", mapping=mapping)
+        pipe.execute()
+
+    for start in range(0, len(report["moved"]), SYNC_BATCH_SIZE):
+        pipe = unit_vector_db.pipeline(transaction=False)
+        for topic in report["moved"][start:start + SYNC_BATCH_SIZE]:
+            pipe.hset(f"subtopic:{topic}", "unit", desired[topic])
+        pipe.execute()
+
+    old_units = [u.decode("utf-8") for u in unit_vector_db.zrange(vector_store.INDEX_UNITS, 0, -1)]
+    pipe = unit_vector_db.pipeline(transaction=True)  # 課程索引、模型名稱與刪除的子單元以 MULTI 一次更新
+    for start in range(0, len(report["removed"]), SYNC_BATCH_SIZE):
+        pipe.delete(*[f"subtopic:{topic}" for topic in report["removed"][start:start + SYNC_BATCH_SIZE]])
+    vector_store.write_course_index(pipe, course_units, old_units)
+    pipe.set(vector_store.MODEL_KEY, model_name)
+    pipe.execute()
+
+    unit_order = [unit for unit, _ in course_units]
+    unit_topic_list = {unit: topics for unit, topics in course_units}
+    topic_unit_map = dict(desired)
+    subtopics = [topic for _, topics in course_units for topic in topics]
+    default_progress = {unit: topics[0] for unit, topics in course_units if topics}
+
+    if to_encode or report["moved"] or report["removed"] or old_units != unit_order:
+        version = vector_store.new_version()
+        vector_store.write_snapshot_for_version(version)
+        vector_store.bump_version(version)  # 通知各 worker 重新載入子單元向量矩陣與課程索引
+    return report
 
 def reset_student_db():
     student_db.flushdb()
@@ -169,6 +387,7 @@ def reset_question_bank_db():
 def clear_unit_vector_db():
     ensure_unit_data_loaded()  # 確保單元資料已載入
     unit_vector_db.flushdb()
+    vector_store.bump_version()
     print("✅ 已清除 Redis 主單元與子單元資料庫資料")
 
 
@@ -182,7 +401,7 @@ def clear_unit_vector_db():
 #   - score: 學生總得分（int）
 #   - accuracy: 全部題目的平均準確率（float）
 #   - name: 學生姓名（str）
-#   - active_users: 學生登入狀態 0 或 1（int，0 表示未登入，1 表示登入中）
+#   - active_users: 舊版的學生登入狀態 0 或 1（int），已不再使用，登入狀態改由 DB3 的 login:student:{學號} 判斷
 #   - email: 學生電子郵件（str）
 #   - class: 學生班級（str）[甲 or 乙]
 #   - hash_password: 學生密碼雜湊值（str）
@@ -191,6 +410,7 @@ def clear_unit_vector_db():
 #                          特別關注學生擅長/不擅長的題目類型、哪些子單元的準確率/錯誤率高
 
 def init_student(student_id):
+    student_db.sadd(STUDENT_INDEX, student_id)
     if not student_db.exists(f"user:{student_id}"):
         student_db.hset(f"user:{student_id}", mapping={
             "completed_units": json.dumps([]),
@@ -225,7 +445,10 @@ def init_student(student_id):
 #   - topic: 所屬子單元名稱（str）
 #   - answered_count: 被作答次數（int）
 #   - accuracy: 作答平均準確率（float）
-#   - responses: 學生回應清單（list[dict]），包含：
+#   - responses: （舊格式）學生回應清單（list[dict]，經 json.dumps），已改存於下方的 question:{qid}:responses
+#
+# Key: question:{qid}:responses（list，只追加）
+#   每筆為一則學生回應（json，緊湊格式），包含：
 #       - student_id: 學號
 #       - answer: 學生答案（str）
 #       - qaType: 類型 (來自enum QuestionType)
@@ -234,22 +457,92 @@ def init_student(student_id):
 #       - copy: 是否可疑複製（bool）
 #       - wrong: 評語/錯誤資訊（str 或 None）
 #       - score: 分數（int）
-def add_question(qid, question, source, student_id, unit, topic):
-    question_bank_db.hset(f"question:{qid}", mapping={
+#       - ts: 作答時間戳記（float）
+#   讀取請用 get_question_responses() 分頁；舊的 responses 欄位可用 migrate_response_blobs() 搬移
+#   - qaType: 問題類型（str，QuestionType 的值），出題時可由【】前綴直接標記
+def add_question(qid, question, source, student_id, unit, topic, qa_type=None):
+    mapping = {
         "question": question,
         "source": source,
         "generated_by": student_id or "",  # None or str
         "unit": unit,
         "topic": topic,
         "answered_count": 0,
-        "accuracy": 0.0,
-        "responses": json.dumps([])
-    })
+        "accuracy": 0.0
+    }
+    if isinstance(qa_type, QuestionType):
+        mapping["qaType"] = qa_type.value
+    question_bank_db.hset(f"question:{qid}", mapping=mapping)
+
+# 從題目的【問題類型】前綴取出 QuestionType，無法辨識時回傳 None
+# 例如：【選擇題】請問堆積的定義是什麼？ -> QuestionType.CHOICE
+def parse_question_type(question):
+    if not question or "】" not in question:
+        return None
+    label = question.split("】")[0].replace("【", "").strip()
+    for qa_type in QuestionType:
+        if qa_type.value == label:
+            return qa_type
+    return None
+
+def responses_key(qid):
+    return f"question:{qid}:responses"
+
+def _encode_response(record):
+    return json.dumps(record, ensure_ascii=False, separators=(",", ":"))
+
+# 分頁讀取某題的學生回應（依作答先後），回傳 (回應列表, 總筆數)
+def get_question_responses(qid, offset=0, limit=50):
+    pipe = question_bank_db.pipeline(transaction=False)
+    pipe.lrange(responses_key(qid), offset, offset + limit - 1)
+    pipe.llen(responses_key(qid))
+    pipe.hget(f"question:{qid}", "responses")
+    records, total, legacy = pipe.execute()
+    if legacy is None:
+        return [json.loads(r) for r in records], total
+
+    # 尚未搬移的舊格式：舊陣列在前（搬移時會放到清單最前面），之後新增的回應在清單中，兩者合併後再分頁
+    legacy_records = json.loads(legacy)
+    page = legacy_records[offset:offset + limit]
+    if len(page) < limit:
+        start = max(0, offset - len(legacy_records))
+        page += [json.loads(r) for r in question_bank_db.lrange(responses_key(qid), start, start + limit - len(page) - 1)]
+    return page, len(legacy_records) + total
+
+# 將單一題目的舊 responses 陣列搬到 question:{qid}:responses 清單（WATCH 確保不會與同時作答互相覆蓋）
+def migrate_response_blob(qid):
+    qkey = f"question:{qid}"
+    with question_bank_db.pipeline(transaction=True) as pipe:
+        while True:
+            try:
+                pipe.watch(qkey)
+                legacy = pipe.hget(qkey, "responses")
+                if legacy is None:
+                    pipe.unwatch()
+                    return 0
+                records = json.loads(legacy)
+                pipe.multi()
+                if records:
+                    pipe.lpush(responses_key(qid), *[_encode_response(r) for r in reversed(records)])
+                pipe.hdel(qkey, "responses")
+                pipe.execute()
+                return len(records)
+            except redis.WatchError:
+                continue
+
+# 一次搬移題庫中所有舊格式的 responses 陣列，回傳搬移的回應筆數
+def migrate_response_blobs():
+    moved = 0
+    for key in question_bank_db.scan_iter(match="question:*", count=500, _type="HASH"):
+        qid = key.decode("utf-8").split("question:", 1)[1]
+        moved += migrate_response_blob(qid)
+    print(f"✅ 已將 {moved} 筆舊格式作答紀錄搬移到 question:{{qid}}:responses")
+    return moved
 
 # 新增學生作答記錄並更新三大資料庫（題庫、子單元、學生）欄位：
 #
 # 1️⃣ 更新題庫資料庫（question_bank_db）
-#   - 將學生答題加入 responses 陣列
+#   - 將學生答題追加到 question:{qid}:responses 清單
 #   - 更新 answered_count 與 accuracy（正確率）
 #   
 #
@@ -258,65 +551,33 @@ def add_question(qid, question, source, student_id, unit, topic):
 #
 # 3️⃣ 更新學生資料庫（student_db）
 #   - 更新 progress[topic] = [次數, 平均分數]
-#   - 若符合條件（3 次以上，且平均 >= 70 分） -> 加入 completed_topics
+#   - 若符合條件（3 次以上，且平均 >= 70 分） -> 加入 completed_topics，並自動把同一主單元的下一個子單元加入 progress
 #   - 根據 completed_topics 計算 unit_progress 百分比
 #   - 若主單元所有子題都完成 -> 加入 completed_units
 #   - 根據學生的作答優劣與常錯誤題，更新壓縮記憶（compressive_memory），包含參考未更新的壓縮記憶
+#
+# 三個資料庫各以一支 Lua 腳本原子更新（見 progress_store.py），每個資料庫只需一次往返，
+# 同一學生同時從兩個裝置作答也不會互相覆蓋；推進到下一個子單元的規則只在 RECORD_STUDENT_LUA 中實作。
+#
+# 4️⃣ 更新全班分析彙總（analytics.py，DB2）：排行榜、子單元分數分布與題型統計
 def add_response_to_question(qid, student_id, answer, total_time, char_len, is_copy, correct, score, feedback):
-    qkey = f"question:{qid}"
-    question_data = question_bank_db.hgetall(qkey)
-    topic = question_data[b"topic"].decode("utf-8")
-    unit = question_data[b"unit"].decode("utf-8")
-
-    responses = json.loads(question_data.get(b"responses", b"[]").decode("utf-8"))
-    responses.append({
+    record = _encode_response({
         "student_id": student_id,
         "answer": answer,
         "chars_num": char_len,
         "total_time": total_time,
         "copy": is_copy,
         "wrong": feedback if not correct else None,
-        "score": score
+        "score": score,
+        "ts": time.time()
     })
-
-    question_bank_db.hset(qkey, "responses", json.dumps(responses))
-    question_bank_db.hincrby(qkey, "answered_count", 1)
-    if correct and score is not None:
-        current_avg = float(question_data.get(b"accuracy", b"0.0").decode("utf-8"))
-        count = int(question_bank_db.hget(qkey, "answered_count"))
-        new_accuracy = round((current_avg * (count - 1) + (score / 10) * 100) / count, 2)
-        question_bank_db.hset(qkey, "accuracy", new_accuracy)
-
-    skey = f"subtopic:{topic}"
-    unit_vector_db.hincrby(skey, "answered_count", 1)
-    topic_count = int(unit_vector_db.hget(skey, "answered_count"))
-    prev_accuracy = float(unit_vector_db.hget(skey, "accuracy") or 0.0)
-    updated_accuracy = round((prev_accuracy * (topic_count - 1) + (score or 0) / 10 * 100) / topic_count, 2)
-    unit_vector_db.hset(skey, "accuracy", updated_accuracy)
-
-    ukey = f"user:{student_id}"
-    progress = json.loads(student_db.hget(ukey, "progress") or "{}")
-    topic_progress = progress.get(topic, [0, 0.0])
-    topic_progress[0] += 1
-    topic_progress[1] = round((topic_progress[1] * (topic_progress[0] - 1) + score) / topic_progress[0], 2)
-    progress[topic] = topic_progress
-    student_db.hset(ukey, "progress", json.dumps(progress))
-
-    completed_topics = json.loads(student_db.hget(ukey, "completed_topics") or "[]")
-    if topic_progress[0] >= 3 and topic_progress[1] >= 7 and topic not in completed_topics:
-        completed_topics.append(topic)
-        student_db.hset(ukey, "completed_topics", json.dumps(completed_topics))
-
-    unit_progress = json.loads(student_db.hget(ukey, "unit_progress") or "{}")
-    unit_topics = unit_topic_list[unit]
-    done = sum(1 for t in unit_topics if t in completed_topics)
-    unit_progress[unit] = round(done / len(unit_topics) * 100, 2)
-    student_db.hset(ukey, "unit_progress", json.dumps(unit_progress))
-
-    completed_units = json.loads(student_db.hget(ukey, "completed_units") or "[]")
-    if unit_progress[unit] == 100.0 and unit not in completed_units:
-        completed_units.append(unit)
-        student_db.hset(ukey, "completed_units", json.dumps(completed_units))
+    result = progress_store.record_response(
+        question_bank_db, unit_vector_db, student_db, qid, student_id, record, correct, score)
+    if result["legacy_responses"]:  # 舊格式的 responses 陣列搬到清單最前面（保持作答先後順序）
+        migrate_response_blob(qid)
+    # 全班分析彙總（排行榜、子單元分數分布、題型統計）的遞增更新
+    analytics.record_answer(student_id, result["class"], result["topic"], result["qa_type"], score)
+    return result
 
 # 放入問題種類(QuestionType)到題庫資料庫
 def add_question_type(qid, qa_type):
@@ -331,39 +592,91 @@ def add_question_type(qid, qa_type):
     question_bank_db.hset(qkey, "qaType", qa_type.value)
     return True, "問題類型已更新"
 
-# 根據學生子單元表現自動推進至下一子單元（若符合條件）：
-#
-# 條件：
-#   - 該 topic 答題次數 >= 3
-#   - 平均成績 >= 70 分
-#   - 尚未完成該主單元下所有子單元
-#
-# 結果：
-#   - 自動將下一個子單元加入 progress，初始化為 [0, 0.0]
-def advance_if_ready(student_id, topic):
-    ukey = f"user:{student_id}"
-    progress = json.loads(student_db.hget(ukey, "progress") or "{}")
-    unit = topic_unit_map.get(topic)
-    if not unit:
-        return
-
-    if topic not in progress:
-        return
-    attempts, avg_score = progress[topic]
-    if attempts < 3 or avg_score < 7:
-        return
-
-    unit_topics = unit_topic_list[unit]
-    try:
-        next_index = unit_topics.index(topic) + 1
-        next_topic = unit_topics[next_index]
-    except IndexError:
-        return  # 已是最後一個子單元
+# 登入狀態（active_users_db，Redis DB3）：登入 session 設有 TTL，不需要在後端啟動時重設
+#   - {discord_id}（hash，TTL）: std_id 為登入中的學號
+#   - login:student:{學號}（str，TTL）: 登入中的 discord_id，用來判斷帳號是否已在其他 Discord 帳號登入
+# 每次 get_active_student_id() 都會把兩個 key 的 TTL 重設為 LOGIN_SESSION_TTL（滑動過期），
+# 超過 LOGIN_SESSION_TTL 秒沒有操作就自動登出。登入、登出、延長各是一支 Lua 腳本，在 Redis 端原子執行：
+# 先讀出 {discord_id} 目前的學號，再把會動到的 key 全部以 KEYS 傳入腳本；腳本內確認學號沒有被其他請求改掉，
+# 被改掉時回傳 LOGIN_RETRY，由 _run_login_script() 重新讀取後再執行（key 格式只由 login_student_key() 決定）
+LOGIN_SESSION_TTL = int(os.getenv("LOGIN_SESSION_TTL", str(60 * 60 * 12)))
+LOGIN_RETRY = -1
+LOGIN_SCRIPT_ATTEMPTS = 3
+
+def login_student_key(student_id):
+    return f"login:student:{student_id}"
+
+# KEYS: {discord_id}, login:student:{學號}, login:student:{原本登入的學號}（沒有時同 KEYS[2]）
+# ARGV: 學號, discord_id, TTL, 原本登入的學號（沒有時為空字串）
+LOGIN_LUA = """
+if (redis.call('HGET', KEYS[1], 'std_id') or '') ~= ARGV[4] then
+  return -1
+end
+if redis.call('EXISTS', KEYS[2]) == 1 then
+  return 0
+end
+if ARGV[4] ~= '' and ARGV[4] ~= ARGV[1] and redis.call('GET', KEYS[3]) == ARGV[2] then
+  redis.call('DEL', KEYS[3])
+end
+redis.call('DEL', KEYS[1])
+redis.call('HSET', KEYS[1], 'std_id', ARGV[1])
+redis.call('EXPIRE', KEYS[1], ARGV[3])
+redis.call('SET', KEYS[2], ARGV[2], 'EX', ARGV[3])
+return 1
+"""
+
+# KEYS: {discord_id}, login:student:{登入中的學號}
+# ARGV: discord_id, 登入中的學號
+LOGOUT_LUA = """
+if redis.call('HGET', KEYS[1], 'std_id') ~= ARGV[2] then
+  return -1
+end
+redis.call('DEL', KEYS[1])
+if redis.call('GET', KEYS[2]) == ARGV[1] then
+  redis.call('DEL', KEYS[2])
+end
+return 1
+"""
 
-    if next_topic not in progress:
-        progress[next_topic] = [0, 0.0]
-        student_db.hset(ukey, "progress", json.dumps(progress))
+# KEYS: {discord_id}, login:student:{登入中的學號}
+# ARGV: discord_id, TTL, 登入中的學號
+# 舊版沒有 TTL 的登入資料也會在這裡補上 TTL 與學號反查 key
+TOUCH_LOGIN_LUA = """
+if redis.call('HGET', KEYS[1], 'std_id') ~= ARGV[3] then
+  return -1
+end
+redis.call('EXPIRE', KEYS[1], ARGV[2])
+local owner = redis.call('GET', KEYS[2])
+if not owner then
+  redis.call('SET', KEYS[2], ARGV[1], 'EX', ARGV[2])
+elseif owner == ARGV[1] then
+  redis.call('EXPIRE', KEYS[2], ARGV[2])
+end
+return 1
+"""
 
+_login_scripts = {}
+
+def _login_script(name, source):
+    if name not in _login_scripts:
+        _login_scripts[name] = active_users_db.register_script(source)
+    return _login_scripts[name]
+
+# 讀出 {discord_id} 目前登入的學號（沒有時為 None），以 build(學號) 組出 KEYS / ARGV 執行腳本，回傳 (腳本結果, 學號)；
+# require_login 時未登入直接回傳 (None, None)。執行前學號被其他請求改掉時重新讀取，
+# 重試 LOGIN_SCRIPT_ATTEMPTS 次仍衝突則回傳 (LOGIN_RETRY, 學號)
+def _run_login_script(name, source, discord_id, build, require_login=True):
+    script = _login_script(name, source)
+    for _ in range(LOGIN_SCRIPT_ATTEMPTS):
+        current = active_users_db.hget(discord_id, "std_id")
+        current = current.decode("utf-8") if current is not None else None
+        if current is None and require_login:
+            return None, None
+        keys, args = build(current)
+        result = script(keys=keys, args=args)
+        if result != LOGIN_RETRY:
+            return result, current
+    return LOGIN_RETRY, current
 
 # 登入 API
 # @app.route("/api/login", methods=["POST"])
@@ -410,8 +723,7 @@ def is_logged_in(student_id):
     if not student_db.exists(key):
         return jsonify({"success": False, "message": "帳號不存在"}), 404
 
-    active_users = int(student_db.hget(key, "active_users") or 0)
-    return jsonify({"success": True, "is_logged_in": bool(active_users)})
+    return jsonify({"success": True, "is_logged_in": bool(active_users_db.exists(login_student_key(student_id)))})
 
 # 登出功能（清除 active_users 資料）
 # @app.route("/api/logout", methods=["POST"])
@@ -438,80 +750,74 @@ def logout_logic(discord_id):
     # 確認 discord_id 是否存在於 active_users_db
     if not discord_id:
         return False, "缺少 discord_id 資料"
-    
-    key = discord_id  # 使用 discord_id 作為 key
-    if not active_users_db.exists(key):
+
+    # 刪除登入 session 與學號反查 key（一支 Lua 腳本，原子執行）
+    result, _ = _run_login_script("logout", LOGOUT_LUA, discord_id, lambda sid: (
+        [discord_id, login_student_key(sid)], [discord_id, sid]))
+    if result is None:
         return False, "沒有登入過(discord_id未在 active_users_db 中找到)"
-    
-    std = active_users_db.hget(key, "std_id")
-    # 確認學生已在active_users_db中，將該學生資料(key與欄位)從 active_users_db 中刪除    
-    active_users_db.delete(key)
-    
-    student_db.hset(std, "active_users", 0)# 將學生 active_users 欄位設為 0，表示已登出
+    if result == LOGIN_RETRY:
+        return False, "登入狀態變更中，請稍後再試"
+
+    quiz_session.clear_session(discord_id)  # 登出時一併清除作答 session
     return True, "登出成功"
 
 def login_logic(student_id, password,discord_id):
     if not student_id or not password:
         return False, "缺少學號或密碼", None
 
+    throttled = login_guard.throttle(student_id, discord_id)  # 每個學號 / discord_id 的登入嘗試次數限制
+    if throttled:
+        return False, throttled, None
+
     key = f"user:{student_id}"
-    if not student_db.exists(key):
+    hash_pw, name, email, student_class = student_db.hmget(key, "hash_password", "name", "email", "class")
+    if hash_pw is None:
         return False, "帳號不存在", None
 
-    hash_pw = student_db.hget(key, "hash_password").decode("utf-8")
-    if not bcrypt.checkpw(password.encode("utf-8"), hash_pw.encode("utf-8")):
+    # bcrypt 在行程池中比對，不佔用請求執行緒的 GIL；同一個 discord_id 短時間內重複登入會沿用驗證結果
+    password_ok = login_guard.verify_password(student_id, discord_id, password, hash_pw)
+    if password_ok is None:
+        return False, "目前登入人數過多，請稍後再試", None
+    if not password_ok:
         return False, "密碼錯誤", None
-    
-    # 確認是否帳號已登入中
-    active_users = int(student_db.hget(key, "active_users") or 0)
-    if active_users:
-        return False, "帳號已登入中，請先登出", None
 
-    # student_db 的 active_users 欄位設為 1，表示已登入
-    student_db.hset(key, "active_users", 1)
+    # 確認帳號未登入中並建立登入 session（一支 Lua 腳本，原子執行，兩個裝置同時登入只有一個會成功）
+    claimed, _ = _run_login_script("login", LOGIN_LUA, discord_id, lambda previous: (
+        [discord_id, login_student_key(student_id), login_student_key(previous or student_id)],
+        [student_id, discord_id, LOGIN_SESSION_TTL, previous or ""]), require_login=False)
+    if claimed == LOGIN_RETRY:
+        return False, "登入狀態變更中，請稍後再試", None
+    if not claimed:
+        return False, "帳號已登入中，請先登出", None
+    login_guard.reset_attempts(student_id, discord_id)
 
     get_discord_id(student_id,discord_id) # 登入時更新學生的 discord_id
 
     student_info = {
         "student_id": student_id,
-        "name": student_db.hget(key, "name").decode("utf-8"),
-        "email": student_db.hget(key, "email").decode("utf-8"),
-        "class": student_db.hget(key, "class").decode("utf-8")
+        "name": (name or b"").decode("utf-8"),
+        "email": (email or b"").decode("utf-8"),
+        "class": (student_class or b"").decode("utf-8")
     }
-    # active_users的key為discord_id
-    # 欄位:
-    #   - std_id: 學生學號（str）
-
-    # 登入時新增登入學生discord_id，並將學生學號寫入active_users_db
-    active_users_db.hset(discord_id, "std_id", student_id)
     return True, "登入成功", student_info
 
-# 從active_users_db中取得登入學生的學號
+# 從active_users_db中取得登入學生的學號，並延長登入 session 的 TTL（滑動過期）
 
 def get_active_student_id(discord_id):
     if not discord_id:
         return None, "缺少 discord_id"
 
-    if not active_users_db.exists(discord_id):
+    result, student_id = _run_login_script("touch", TOUCH_LOGIN_LUA, discord_id, lambda sid: (
+        [discord_id, login_student_key(sid)], [discord_id, LOGIN_SESSION_TTL, sid]))
+    if result != 1:
         return None, "該 discord_id 未登入"
 
-    student_id = active_users_db.hget(discord_id, "std_id")
-    if not student_id:
-        return None, "未找到學生學號"
-
-    # 將學生學號轉換為字串並返回
-    return student_id.decode("utf-8"), None
+    return student_id, None
 
 # 清空題庫資料庫
 # clear_unit_vector_db()
 
-# 程式碼如果被刷新，則會清空 active_users_db 資料庫
-active_users_db.flushdb()  # 清空 active_users_db 資料庫
-# 程式碼如果被刷新，則會將所有 student_db 的 active_users 設為 0
-for key in student_db.keys("user:*"):
-    student_db.hset(key, "active_users", 0)  # 將所有學生的 active_users 設為 0
-
-
 
 # 註冊 API
 if __name__ == "__main__":
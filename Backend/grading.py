@@ -0,0 +1,260 @@
+# 作答評分流程：本機預先篩選（prescreen.py）-> 語意評分快取 -> GPT 評分
+#
+# 許多學生對同一題會送出幾乎相同的答案，evaluate_answer_gpt4o 每次都要完整呼叫一次 LLM。
+# 這裡以「題目 + 正規化後答案的向量」做快取：新答案與同一題已評分答案的 cosine 相似度
+# 超過 GRADE_CACHE_THRESHOLD 時，直接沿用當時的分數與評語。
+#
+# 語意評分快取（question_bank_db，Redis DB2）：
+#   - grade_cache:{題目key}（hash）: entry_id -> {"score", "feedback", "answer"}（json）
+#   - grade_cache:{題目key}:vec（hash）: entry_id -> 答案向量（float32 binary，見 vector_store）
+#   - grade_cache:{題目key}:lru（zset）: entry_id，score 為最後使用時間，每題最多保留 GRADE_CACHE_MAX_PER_QUESTION 筆
+#   - grade_cache:stats（hash）: hits / misses / stores 次數
+#   題目key 為題庫 qid，沒有 qid 時使用題目文字的 sha1
+#
+# 稽核時可設定 GRADE_CACHE_ENABLED=0，或呼叫 set_grade_cache_enabled(False) 關閉快取
+#
+# 微批次評分：全班同時交卷時，每則答案各自呼叫一次 LLM 會重複送出約 1 KB 的評分標準。
+# 設定 GRADE_BATCH_WINDOW_MS > 0 後，快取未命中的答案會先排隊，在時間窗內（或湊滿
+# GRADE_BATCH_MAX_ITEMS 則）合併成一次多題評分請求，各題結果再交回原本等待的請求；
+# 批次結果缺漏或失敗的題目會退回單題評分。/answer 的回應格式不變。
+#
+# 評分結果格式錯誤或等待逾時時重試 GRADE_RETRIES 次，仍失敗則給 0 分與「無評語」（與原本的行為相同），
+# 這類結果不寫入快取。
+
+import os
+import re
+import json
+import time
+import uuid
+import hashlib
+import queue
+import threading
+import traceback
+import unicodedata
+from concurrent.futures import Future, ThreadPoolExecutor, TimeoutError as FutureTimeoutError
+import numpy as np
+import redis
+
+import vector_store
+import models
+import token_usage
+import prescreen
+from question_gpt4o import evaluate_answer_gpt4o, evaluate_answers_batch_gpt4o
+
+GRADE_CACHE_THRESHOLD = float(os.getenv("GRADE_CACHE_THRESHOLD", "0.95"))
+GRADE_CACHE_MAX_PER_QUESTION = int(os.getenv("GRADE_CACHE_MAX_PER_QUESTION", "50"))
+GRADE_CACHE_TTL = int(os.getenv("GRADE_CACHE_TTL", str(60 * 60 * 24 * 30)))
+GRADE_CACHE_STATS_KEY = "grade_cache:stats"
+GRADE_BATCH_WINDOW_MS = float(os.getenv("GRADE_BATCH_WINDOW_MS", "0"))  # 0 表示不批次
+GRADE_BATCH_MAX_ITEMS = int(os.getenv("GRADE_BATCH_MAX_ITEMS", "8"))
+GRADE_BATCH_WORKERS = int(os.getenv("GRADE_BATCH_WORKERS", "4"))
+GRADE_BATCH_TIMEOUT = 120  # 等待批次結果的最長秒數
+GRADE_RETRIES = 1
+GRADE_FALLBACK = (0, "無評語")
+
+question_bank_db = redis.Redis(host='localhost', port=6379, db=2)
+
+_settings = {"cache_enabled": os.getenv("GRADE_CACHE_ENABLED", "1") != "0"}
+
+
+def set_grade_cache_enabled(enabled):
+    _settings["cache_enabled"] = bool(enabled)
+
+def grade_cache_enabled():
+    return _settings["cache_enabled"]
+
+def question_cache_key(question, qid=None):
+    if qid:
+        return qid
+    return "h" + hashlib.sha1((question or "").strip().encode("utf-8")).hexdigest()[:16]
+
+# 答案正規化：去頭尾空白、轉小寫、移除標點符號、合併連續空白
+def normalize_answer(answer):
+    text = unicodedata.normalize("NFKC", answer or "").lower()
+    text = "".join(" " if unicodedata.category(ch).startswith("P") else ch for ch in text)
+    return re.sub(r"\s+", " ", text).strip()
+
+def _embed_answer(normalized):
+    vec = models.encode([normalized], models.QUERY_MODEL_NAME, convert_to_numpy=True)
+    return vector_store.normalize_rows(vec).reshape(-1)
+
+# 結構化評分結果 {"score", "comment", "deductions"} 轉成 (分數 0~10, 評語)
+def grade_to_feedback(result):
+    score = max(0, min(result["score"], 10))
+    feedback = f"評語: {result['comment']}" if result["comment"] else "無評語"
+    deductions = result.get("deductions", "").strip()
+    if deductions and deductions != "無":
+        feedback += f"\n扣分原因: {deductions}"
+    return score, feedback
+
+# 在快取中找出與答案向量最相似的已評分答案，超過門檻時回傳 (score, feedback)
+def lookup_grade(cache_key, answer_vec):
+    vecs = question_bank_db.hgetall(f"grade_cache:{cache_key}:vec")
+    if not vecs:
+        return None
+
+    entry_ids = list(vecs.keys())
+    matrix = np.vstack([vector_store.decode_embedding(vecs[e]) for e in entry_ids])
+    if matrix.shape[1] != answer_vec.shape[0]:
+        return None
+    scores = matrix @ answer_vec
+    best = int(np.argmax(scores))
+    if scores[best] < GRADE_CACHE_THRESHOLD:
+        return None
+
+    entry_id = entry_ids[best]
+    pipe = question_bank_db.pipeline(transaction=False)
+    pipe.hget(f"grade_cache:{cache_key}", entry_id)
+    pipe.zadd(f"grade_cache:{cache_key}:lru", {entry_id: time.time()})
+    entry = pipe.execute()[0]
+    if not entry:
+        return None
+    entry = json.loads(entry)
+    return entry["score"], entry["feedback"]
+
+# 寫入一筆已評分答案，超過每題上限時淘汰最久未使用的項目（LRU）
+def store_grade(cache_key, answer_vec, answer, score, feedback):
+    entry_id = uuid.uuid4().hex[:12]
+    entries_key = f"grade_cache:{cache_key}"
+    vec_key = f"grade_cache:{cache_key}:vec"
+    lru_key = f"grade_cache:{cache_key}:lru"
+
+    pipe = question_bank_db.pipeline(transaction=True)
+    pipe.hset(entries_key, entry_id, json.dumps({"score": score, "feedback": feedback, "answer": answer}, ensure_ascii=False))
+    pipe.hset(vec_key, entry_id, vector_store.encode_embedding(answer_vec, "binary"))
+    pipe.zadd(lru_key, {entry_id: time.time()})
+    for key in (entries_key, vec_key, lru_key):
+        pipe.expire(key, GRADE_CACHE_TTL)
+    pipe.zrange(lru_key, 0, -(GRADE_CACHE_MAX_PER_QUESTION + 1))
+    evicted = pipe.execute()[-1]
+
+    if evicted:
+        pipe = question_bank_db.pipeline(transaction=True)
+        pipe.hdel(entries_key, *evicted)
+        pipe.hdel(vec_key, *evicted)
+        pipe.zrem(lru_key, *evicted)
+        pipe.execute()
+
+def _count(field):
+    question_bank_db.hincrby(GRADE_CACHE_STATS_KEY, field, 1)
+
+def grade_cache_stats():
+    stats = {k.decode("utf-8"): int(v) for k, v in question_bank_db.hgetall(GRADE_CACHE_STATS_KEY).items()}
+    hits, misses = stats.get("hits", 0), stats.get("misses", 0)
+    stats["hit_rate"] = round(hits / (hits + misses), 4) if hits + misses else 0.0
+    stats["enabled"] = grade_cache_enabled()
+    return stats
+
+_batch_queue = queue.Queue()
+_batch_state = {"thread": None}
+_batch_lock = threading.Lock()
+_batch_executor = ThreadPoolExecutor(max_workers=GRADE_BATCH_WORKERS, thread_name_prefix="grade-batch")
+
+def _evaluate_single(question, answer):
+    result = evaluate_answer_gpt4o(question, answer)
+    if result is None:
+        raise ValueError("評分結果格式錯誤")
+    return grade_to_feedback(result)
+
+# items: [(問題, 答案, token 歸屬, Future), ...]
+def _grade_batch(items):
+    try:
+        if len(items) == 1:
+            results = [None]
+        else:
+            with token_usage.attributed_to([o for _, _, owners, _ in items for o in owners or []]):
+                results = evaluate_answers_batch_gpt4o([(q, a) for q, a, _, _ in items])
+    except Exception:
+        traceback.print_exc()
+        results = [None] * len(items)
+
+    for (question, answer, owners, future), result in zip(items, results):
+        try:
+            if result is None:  # 批次中缺漏的題目退回單題評分
+                with token_usage.attributed_to(owners or []):
+                    future.set_result(_evaluate_single(question, answer))
+            else:
+                future.set_result(grade_to_feedback(result))
+        except Exception as e:
+            future.set_exception(e)
+
+# 收集排隊中的答案：第一則到達後等待 GRADE_BATCH_WINDOW_MS 或湊滿 GRADE_BATCH_MAX_ITEMS 則就送出
+def _batch_loop():
+    window = GRADE_BATCH_WINDOW_MS / 1000
+    while True:
+        items = [_batch_queue.get()]
+        deadline = time.time() + window
+        while len(items) < GRADE_BATCH_MAX_ITEMS:
+            remaining = deadline - time.time()
+            if remaining <= 0:
+                break
+            try:
+                items.append(_batch_queue.get(timeout=remaining))
+            except queue.Empty:
+                break
+        _batch_executor.submit(_grade_batch, items)
+
+def _ensure_batch_thread():
+    with _batch_lock:
+        if _batch_state["thread"] is None or not _batch_state["thread"].is_alive():
+            t = threading.Thread(target=_batch_loop, name="grade-batcher", daemon=True)
+            t.start()
+            _batch_state["thread"] = t
+
+# 呼叫 LLM 評分，回傳 (分數, 評語)；啟用微批次時會與同時間的其他答案合併評分
+def evaluate(question, answer):
+    if GRADE_BATCH_WINDOW_MS <= 0:
+        return _evaluate_single(question, answer)
+    _ensure_batch_thread()
+    future = Future()
+    _batch_queue.put((question, answer, token_usage.current_owners(), future))  # 批次執行緒中保留 token 歸屬
+    return future.result(timeout=GRADE_BATCH_TIMEOUT)
+
+# 評分失敗（結果格式錯誤、批次逾時）時重試，仍失敗回傳 None
+def _evaluate_with_retry(question, answer):
+    for _ in range(GRADE_RETRIES + 1):
+        try:
+            return evaluate(question, answer)
+        except (ValueError, TimeoutError, FutureTimeoutError):
+            traceback.print_exc()
+    return None
+
+# 本機預先篩選：空白、表示不會、亂碼、文不對題的答案直接給分，回傳 (分數, 評語) 或 None
+def _prescreen(question, answer, text_reason, answer_vec):
+    if not prescreen.PRESCREEN_ENABLED:
+        return None
+    reason = text_reason or prescreen.screen_relevance(question, answer, answer_vec)
+    prescreen.record(reason, answer)
+    return prescreen.verdict(reason) if reason else None
+
+# 評分一則答案，回傳 (分數, 評語, 是否命中快取)
+def grade_answer(question, answer, qid=None, use_cache=True):
+    use_cache = use_cache and grade_cache_enabled()
+    cache_key = question_cache_key(question, qid)
+    answer_vec = None
+
+    # 答案向量由相關性檢查與語意快取共用；預先篩選的純文字檢查已能直接給分的答案不必編碼
+    text_reason = prescreen.screen_text(answer) if prescreen.PRESCREEN_ENABLED else None
+    if text_reason is None and (use_cache or prescreen.relevance_applies(answer)):
+        answer_vec = _embed_answer(normalize_answer(answer))
+    screened = _prescreen(question, answer, text_reason, answer_vec)
+    if screened is not None:
+        return screened[0], screened[1], False
+
+    use_cache = use_cache and answer_vec is not None
+    if use_cache:
+        cached = lookup_grade(cache_key, answer_vec)
+        if cached is not None:
+            _count("hits")
+            return cached[0], cached[1], True
+        _count("misses")
+
+    graded = _evaluate_with_retry(question, answer)
+    if graded is None:
+        return GRADE_FALLBACK[0], GRADE_FALLBACK[1], False
+    score, feedback = graded
+
+    if use_cache:
+        store_grade(cache_key, answer_vec, answer, score, feedback)
+        _count("stores")
+    return score, feedback, False
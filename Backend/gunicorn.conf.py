@@ -0,0 +1,19 @@
+# gunicorn 設定：多行程 + 每個行程多執行緒（gthread）
+#
+# LLM 請求大部分時間都在等待網路，以執行緒承接即可；多個行程則避開 GIL 並隔離故障。
+# 同時可處理的請求數 = WEB_WORKERS x WEB_THREADS（預設 4 x 50 = 200）。
+# 注意：每個 worker 會各自載入向量模型，記憶體不足時可設定 EMBEDDING_MODEL 只載入一個模型。
+
+import os
+
+bind = os.getenv("BIND", f"0.0.0.0:{os.getenv('PORT', '5000')}")
+workers = int(os.getenv("WEB_WORKERS", "4"))
+worker_class = "gthread"
+threads = int(os.getenv("WEB_THREADS", "50"))
+timeout = int(os.getenv("WEB_TIMEOUT", "120"))  # GPT 評分/出題最長等待
+graceful_timeout = 30
+keepalive = 5
+max_requests = int(os.getenv("WEB_MAX_REQUESTS", "5000"))
+max_requests_jitter = 500
+preload_app = False  # 不在 master 預先 import：MongoClient 與模型不可跨 fork 共用
+accesslog = "-"
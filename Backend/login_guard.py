@@ -0,0 +1,141 @@
+# 登入的密碼比對與嘗試次數限制
+#
+# 上課一開始全班同時 /login 時，bcrypt.checkpw 是 CPU 密集的運算，在請求執行緒上執行會受 GIL 限制而排隊，
+# 拖慢同一個 worker 上的其他路由。這裡：
+#   - 密碼比對交給大小固定的行程池（BCRYPT_WORKERS 個行程），排隊中的比對超過 BCRYPT_MAX_QUEUE 時直接回覆忙碌，
+#     佇列深度以 gauge 輸出到 /metrics（dsbot_bcrypt_queue_depth）
+#   - 以 Redis 計數器限制每個學號與每個 discord_id 在 LOGIN_THROTTLE_WINDOW 秒內的登入嘗試次數
+#   - 比對成功後在 LOGIN_VERIFIED_TTL 秒內記住「這個 discord_id 用這組學號密碼驗證過」，
+#     同一個 discord_id 重複登入時不必再跑一次 bcrypt（只存 HMAC，不存密碼）
+#
+# Key（active_users_db，Redis DB3）:
+#   - login_attempts:student:{學號}（str，TTL）: 嘗試次數
+#   - login_attempts:discord:{discord_id}（str，TTL）: 嘗試次數
+#   - login_verified:{discord_id}（str，TTL）: HMAC(學號 + 密碼雜湊 + 密碼)
+#
+# LOGIN_CACHE_SECRET 未設定時每個 worker 各自產生隨機金鑰，驗證快取只在同一個 worker 內有效。
+# BCRYPT_WORKERS=0 或不支援 fork 的平台（Windows）在請求執行緒上直接比對。
+# 行程池損壞（子行程被 OOM killer 終止等）後不在請求執行緒中重新 fork（此時已有其他執行緒，fork 可能讓子行程卡在繼承的鎖上），
+# 改在請求執行緒上直接比對，直到 worker 重新啟動。
+
+import os
+import hmac
+import hashlib
+import threading
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor, TimeoutError as FutureTimeoutError
+from concurrent.futures.process import BrokenProcessPool
+import bcrypt
+import redis
+
+import tracing
+
+BCRYPT_WORKERS = int(os.getenv("BCRYPT_WORKERS", "2"))
+BCRYPT_MAX_QUEUE = int(os.getenv("BCRYPT_MAX_QUEUE", "64"))
+BCRYPT_TIMEOUT = float(os.getenv("BCRYPT_TIMEOUT", "10"))
+LOGIN_THROTTLE_WINDOW = int(os.getenv("LOGIN_THROTTLE_WINDOW", "300"))
+LOGIN_MAX_ATTEMPTS_STUDENT = int(os.getenv("LOGIN_MAX_ATTEMPTS_STUDENT", "5"))
+LOGIN_MAX_ATTEMPTS_DISCORD = int(os.getenv("LOGIN_MAX_ATTEMPTS_DISCORD", "10"))
+LOGIN_VERIFIED_TTL = int(os.getenv("LOGIN_VERIFIED_TTL", "600"))
+LOGIN_CACHE_SECRET = (os.getenv("LOGIN_CACHE_SECRET") or "").encode("utf-8") or os.urandom(32)
+
+login_db = redis.Redis(host='localhost', port=6379, db=3)
+
+_pool = {"executor": None, "broken": False}
+_pool_lock = threading.Lock()
+_pending = {"count": 0}
+_pending_lock = threading.Lock()
+
+tracing.register_gauge("bcrypt_queue_depth", "排隊中與執行中的 bcrypt 密碼比對數", lambda: _pending["count"])
+
+
+def _attempts_keys(student_id, discord_id):
+    return f"login_attempts:student:{student_id}", f"login_attempts:discord:{discord_id}"
+
+def _verified_key(discord_id):
+    return f"login_verified:{discord_id}"
+
+# 記錄一次登入嘗試；超過次數上限時回傳錯誤訊息，否則回傳 None
+def throttle(student_id, discord_id):
+    student_key, discord_key = _attempts_keys(student_id, discord_id)
+    pipe = login_db.pipeline(transaction=False)
+    pipe.incr(student_key)
+    pipe.expire(student_key, LOGIN_THROTTLE_WINDOW)
+    pipe.incr(discord_key)
+    pipe.expire(discord_key, LOGIN_THROTTLE_WINDOW)
+    student_attempts, _, discord_attempts, _ = pipe.execute()
+    if student_attempts > LOGIN_MAX_ATTEMPTS_STUDENT or discord_attempts > LOGIN_MAX_ATTEMPTS_DISCORD:
+        return f"登入嘗試次數過多，請 {LOGIN_THROTTLE_WINDOW // 60} 分鐘後再試"
+    return None
+
+# 登入成功後清除嘗試次數
+def reset_attempts(student_id, discord_id):
+    login_db.delete(*_attempts_keys(student_id, discord_id))
+
+def _credential_digest(student_id, password, hashed):
+    message = b"\0".join([str(student_id).encode("utf-8"), hashed, password.encode("utf-8")])
+    return hmac.new(LOGIN_CACHE_SECRET, message, hashlib.sha256).hexdigest()
+
+def _checkpw(password, hashed):
+    return bcrypt.checkpw(password, hashed)
+
+def _executor():
+    with _pool_lock:
+        if _pool["executor"] is None:
+            # fork：子行程只執行 bcrypt；spawn 會在子行程重新 import main.py 整個後端
+            _pool["executor"] = ProcessPoolExecutor(max_workers=BCRYPT_WORKERS, mp_context=multiprocessing.get_context("fork"))
+        return _pool["executor"]
+
+# 伺服器開始接受請求前先建立行程池（由 main.prepare_server() 呼叫），避免在處理請求的執行緒中 fork
+def start_pool():
+    if BCRYPT_WORKERS > 0 and hasattr(os, "fork"):
+        _executor().submit(int).result()
+
+def _release(_future):
+    with _pending_lock:
+        _pending["count"] -= 1
+
+# 丟棄已損壞的行程池，之後的比對都在請求執行緒上執行
+def _discard_executor(executor):
+    with _pool_lock:
+        _pool["broken"] = True
+        if _pool["executor"] is executor:
+            _pool["executor"] = None
+    executor.shutdown(wait=False)
+
+# 在行程池中比對密碼，回傳 True / False；佇列已滿或逾時回傳 None
+def _checkpw_in_pool(password, hashed):
+    if BCRYPT_WORKERS <= 0 or not hasattr(os, "fork") or _pool["broken"]:
+        return _checkpw(password, hashed)
+    with _pending_lock:
+        if _pending["count"] >= BCRYPT_MAX_QUEUE:
+            return None
+        _pending["count"] += 1
+    executor = _executor()
+    try:
+        future = executor.submit(_checkpw, password, hashed)
+    except (BrokenProcessPool, RuntimeError):
+        _release(None)
+        _discard_executor(executor)
+        return _checkpw(password, hashed)
+    future.add_done_callback(_release)
+    try:
+        return future.result(timeout=BCRYPT_TIMEOUT)
+    except FutureTimeoutError:
+        return None
+    except (BrokenProcessPool, RuntimeError):
+        _discard_executor(executor)
+        return _checkpw(password, hashed)
+
+# 比對學生密碼，回傳 True / False；伺服器忙碌（佇列已滿或逾時）時回傳 None
+def verify_password(student_id, discord_id, password, hashed):
+    digest = _credential_digest(student_id, password, hashed)
+    cached = login_db.get(_verified_key(discord_id))
+    if cached is not None and hmac.compare_digest(cached.decode("utf-8"), digest):
+        return True
+
+    with tracing.span("bcrypt.checkpw"):
+        ok = _checkpw_in_pool(password.encode("utf-8"), hashed)
+    if ok:
+        login_db.set(_verified_key(discord_id), digest, ex=LOGIN_VERIFIED_TTL)
+    return ok
@@ -1,9 +1,9 @@
-from flask import Flask, request, jsonify
+from flask import Flask, request, jsonify, Response
 import threading
 import json
-import random
 import time
 import sys
+import os
 from prompt_toolkit import PromptSession
 from prompt_toolkit.patch_stdout import patch_stdout
 from prompt_toolkit.formatted_text import HTML
@@ -13,12 +13,27 @@ from prompt_toolkit.application import Application
 from prompt_toolkit.widgets import Label, Frame, TextArea
 from prompt_toolkit.layout import Layout, HSplit
 
-from question_gpt4o import generate_random_questions_gpt4o, evaluate_answer_gpt4o, classify_question_type
-from database import (
-    student_db, unit_vector_db, question_bank_db, ensure_unit_data_loaded,get_active_student_id,
-    add_question, add_response_to_question, unit_order, login, logout, logout_logic,
-    login_logic, add_question_type, app
-)
+import startup
+with startup.step("匯入後端模組"):
+    import vector_store
+    import progress_events
+    import token_usage
+    import quiz_session
+    import course_tree
+    import models
+    import login_guard
+    import analytics
+    import mastery
+    from question_pool import serve_questions, new_qid, resolve_topic, unit_of
+    from grading import grade_answer, grade_cache_stats
+    from prescreen import prescreen_stats
+    from question_jobs import submit_question_job, get_question_job
+    from question_classifier import classify_question
+    from database import (
+        student_db, question_bank_db, ensure_unit_data_loaded,get_active_student_id,
+        add_question, add_response_to_question, get_unit_order, get_unit_topic_list, login, logout, logout_logic,
+        login_logic, add_question_type, get_question_responses, app
+    )
 
 # ensure_unit_data_loaded()
 # app = Flask(__name__)
@@ -68,17 +83,11 @@ def get_units_menu(did):
 # 選擇完主單元後介面: 根據主單元讓使用者選擇子主題(列出所有子主題)根據數字選擇，最後一個選項增加返回上一頁
 @app.route("/api/student/<did>/topics/menu", methods=["GET"])
 def get_topics_menu(did): # 根據unitkey(學生選擇的主單元)獲取對應的子主題列表 
-    # unit_vector_db中unitkey為unit欄位的值，將unit欄內容與unitkey相同的子主題(key)列出
+    # 從 unit_vector_db 的主單元索引列出 unitkey 底下的子主題
     unitkey = request.args.get("unitkey")  # 從請求參數中獲取unitkey
     if not unitkey:
         return jsonify({"error": "unitkey is required"})
-    keys = unit_vector_db.keys(f"subtopic:*")
-    topics = []
-    for key in keys:
-        topic = key.decode("utf-8").replace("subtopic:", "")
-        unit = unit_vector_db.hget(key, "unit").decode("utf-8")
-        if unit == unitkey:
-            topics.append(topic)
+    topics = vector_store.get_unit_topics(unitkey)  # 讀 index:unit:{unitkey}，依課程順序
     if not topics:
         return jsonify({"error": "no topics found for this unit"})
     menu = [f"{i+1}. {topic}" for i, topic in enumerate(topics)]
@@ -86,21 +95,129 @@ def get_topics_menu(did): # 根據unitkey(學生選擇的主單元)獲取對應
 
     return jsonify({"menu": menu})
 
+# 完整課程樹：主單元 -> 依順序排列的子單元（含穩定的 id），以內容雜湊作為 ETag
+# 客戶端帶 If-None-Match 且課程樹未變時回傳 304，不需重傳內容
+@app.route("/api/course/tree", methods=["GET"])
+def api_course_tree():
+    _, body, etag = course_tree.get_course_tree(get_unit_order(), get_unit_topic_list())
+    headers = {"ETag": f'"{etag}"', "Cache-Control": "no-cache"}
+    if request.if_none_match.contains(etag):
+        return Response(status=304, headers=headers)
+    return Response(body, mimetype="application/json", headers=headers)
+
+# 選擇主單元：開始新的作答 session，回傳該主單元的子主題（依課程順序）
+# body: {"unit_id": 課程樹中的主單元 id}、{"unit": 主單元名稱} 或 {"unit_index": 主單元選單的索引(從 0 開始)}
+@app.route("/api/student/<did>/session/unit", methods=["POST"])
+def api_session_unit(did):
+    sid, err = get_active_student_id(did)
+    if err:
+        return jsonify({"error": err}), 401
+    data = request.json or {}
+    unit = data.get("unit")
+    if not unit and data.get("unit_id"):
+        course_tree.get_course_tree(get_unit_order(), get_unit_topic_list())
+        unit = course_tree.unit_name(data["unit_id"])
+    if not unit and data.get("unit_index") is not None:
+        index = int(data["unit_index"])
+        unit = unit_name_list[index] if 0 <= index < len(unit_name_list) else None
+    if not unit:
+        return jsonify({"error": "unit is required"}), 400
+
+    quiz_session.start_unit(did, unit, sid)
+    return jsonify({"unit": unit, "topics": vector_store.get_unit_topics(unit)})
+
+# 下一個建議練習的子單元（由 mastery.py 批次計算）
+@app.route("/api/student/<did>/recommendation", methods=["GET"])
+def api_get_recommendation(did):
+    sid, err = get_active_student_id(did)
+    if err:
+        return jsonify({"error": err}), 401
+    recommendation = mastery.get_recommendation(sid)
+    if not recommendation:
+        return jsonify({"error": "no recommendation"}), 404
+    return jsonify(recommendation)
+
+# 目前的作答 session（bot 重啟後可用來恢復狀態）
+@app.route("/api/student/<did>/session", methods=["GET"])
+def api_get_session(did):
+    session = quiz_session.get_session(did)
+    if not session:
+        return jsonify({"error": "no session"}), 404
+    return jsonify(session)
+
+# 正在作答中（已選題、尚未送出答案）的 Discord ID，bot 啟動時載入
+@app.route("/api/sessions/awaiting", methods=["GET"])
+def api_awaiting_sessions():
+    return jsonify({"discord_ids": quiz_session.awaiting_discord_ids()})
+
+# 出題請求的子主題：body 帶 topic（名稱）、topic_id（課程樹中的子單元 id）或 topic_index（session 中主單元的子主題索引）
+def _requested_topic(did, data):
+    if data.get("topic"):
+        return data["topic"]
+    if data.get("topic_id"):
+        course_tree.get_course_tree(get_unit_order(), get_unit_topic_list())
+        found = course_tree.topic_by_id(data["topic_id"])
+        return found[1] if found else None
+    session = quiz_session.get_session(did)
+    if data.get("topic_index") is None or not session or not session.get("unit"):
+        return None
+    topics = vector_store.get_unit_topics(session["unit"])
+    index = int(data["topic_index"])
+    return topics[index] if 0 <= index < len(topics) else None
+
 #【注意：按鈕面對過長的題目會用．．．省略，需修改】
 @app.route("/api/student/<did>/questions", methods=["POST"]) # 根據學生選擇的topic生成問題
 def api_generate_questions(did):
+    sid, err = get_active_student_id(did)
+    if err:
+        return jsonify({"error": err}), 401
     # 跟前端請求獲得topic
-    topic = request.json.get("topic") # 從請求參數中獲取topic
+    topic = _requested_topic(did, request.json or {}) # 從請求參數中獲取topic
     if not topic:
         return jsonify({"error": "topic is required"})
 
-    questions = generate_random_questions_gpt4o(topic, 3)
-    if not questions:
+    served = serve_questions(topic, 3, sid)  # 優先從預先出題池取題，避免等待 GPT
+    if not served:
         return jsonify({"error": "no questions generated"})
     # 輸出question的格式
     # [{"question": "問題內容", "options": ["選項1", "選項2", ...], "type": "問題類型"}, ...]
-    
-    return jsonify({"questions": questions})
+    questions, qids = [q for _, q in served], [qid for qid, _ in served]
+    resolved = resolve_topic(topic)
+    quiz_session.set_questions(did, unit_of(resolved), resolved, questions, qids)
+    return jsonify({"questions": questions, "qids": qids})
+
+# 非同步出題：送出工作後立即回傳 job_id，由背景執行緒池呼叫 GPT 出題
+@app.route("/api/student/<did>/questions/jobs", methods=["POST"])
+def api_submit_question_job(did):
+    sid, err = get_active_student_id(did)
+    if err:
+        return jsonify({"error": err}), 401
+    topic = _requested_topic(did, request.json or {})
+    if not topic:
+        return jsonify({"error": "topic is required"})
+
+    job_id, err = submit_question_job(topic, 3, did, sid)
+    if err:
+        return jsonify({"error": err}), 503
+    return jsonify({"job_id": job_id, "status": "pending"}), 202
+
+# 查詢出題工作狀態，可帶 ?wait=秒數 long-poll 等待完成（最長 25 秒）
+@app.route("/api/student/<did>/questions/jobs/<job_id>", methods=["GET"])
+def api_get_question_job(did, job_id):
+    wait = request.args.get("wait", 0, type=float)
+    job = get_question_job(job_id, wait)
+    if not job or job.get("discord_id") != did:
+        return jsonify({"error": "job not found"}), 404
+
+    result = {"job_id": job_id, "status": job["status"]}
+    if job.get("stage"):
+        result["stage"] = job["stage"]
+    if job["status"] == "done":
+        result["questions"] = job["questions"]
+        result["qids"] = job["qids"]
+    elif job["status"] == "error":
+        result["error"] = job.get("error", "no questions generated")
+    return jsonify(result)
 
 @app.route("/api/student/<did>/question", methods=["POST"]) # 根據學生選擇的問題選項(問題ID)獲取問題內容
 def api_get_question(did): # question_data是字串
@@ -114,68 +231,139 @@ def api_get_question(did): # question_data是字串
     if question_data.startswith(("1.", "2.", "3.")):
         question_data = question_data.split(".", 1)[1].strip()
 
-       # 包裝問題
+    return jsonify({"question": full_question_text(question_data)})
 
-    full_question = f"請回答 {question_data}。並依題目給出最合適的答案，答案越詳盡越好。"
+# 包裝問題
+def full_question_text(question):
+    return f"請回答 {question}。並依題目給出最合適的答案，答案越詳盡越好。"
 
-    return jsonify({"question": full_question})
+# 選擇要作答的題目（session 中出題結果的索引），開始計時並回傳完整題目
+@app.route("/api/student/<did>/session/question", methods=["POST"])
+def api_session_question(did):
+    index = (request.json or {}).get("index")
+    if index is None:
+        return jsonify({"error": "index is required"}), 400
+    session, err = quiz_session.select_question(did, int(index))
+    if err:
+        return jsonify({"error": err}), 404
+    return jsonify({"question": full_question_text(session["question"]), "index": session["question_index"],
+                    "qid": session["qid"], "unit": session.get("unit"), "topic": session.get("topic")})
                                                               
 
 
 @app.route("/api/student/<did>/answer", methods=["POST"]) # 提交答案
 def api_submit_answer(did):
     sid, err = get_active_student_id(did)
-    data = request.json # 獲取JSON數據(包含answer, question, unit, topic字段與total_start_time, typing_start_time時間
+    if err:  # 未登入時不評分也不記錄（作答紀錄與學習進度都以學號為 key）
+        return jsonify({"error": err}), 401
+    data = request.json # 獲取JSON數據(包含answer，以及舊版 bot 才會帶的 question, unit, topic, total_start_time, typing_start_time)
+    # 作答 session 中有選好的題目時只需要 answer，題目、單元與計時都以 session 為準
     # -answer: 學生的答案
     # -question: 學生回答的問題
     # -unit: 單元名稱
     # -topic: 子主題名稱
     # -total_start_time: 總開始時間
     # -typing_start_time: 輸入開始時間
+    # -qid: 題庫中的題目 ID（選用，從題池取得的題目才有）
     answer = data.get("answer", "")
     question = data.get("question")
     unit = data.get("unit")
     topic = data.get("topic")
+    qid = data.get("qid")
     total_start_time = data.get("total_start_time", time.time()) 
     typing_start_time = data.get("typing_start_time", time.time())
 
+    session = quiz_session.get_session(did) if not question else None
+    if session and session.get("question"):
+        question, qid = session["question"], session["qid"]
+        unit, topic = session.get("unit"), session.get("topic")
+        total_start_time = session["selected_at"]
+        typing_start_time = time.time() - session["selected_at"]
+    elif not question:
+        return jsonify({"error": "no active question, please select a question first"}), 400
+
     is_suspected, cps = detect_ai_like_answer(answer, typing_start_time, total_start_time)
 
     if is_suspected:
         score = 0
         feedback = "⚠️ 可疑複製貼上，該題不予計分。"
     else:
-        result = evaluate_answer_gpt4o(question, answer)
-        score, feedback = 0, ""
-        for line in result.splitlines():
-            if any(k in line for k in ["分數", "score"]):
-                try:
-                    score = int(''.join(filter(str.isdigit, line)))
-                except:
-                    pass
-            elif not feedback:
-                feedback = line.strip()
-        score = max(0, min(score, 10))
-        feedback = feedback or "無評語"
-
-    qid = f"Q{random.randint(1000, 9999)}" # 隨機生成問題ID
-
-    # qid格式：
-    # 【問題類型】問題內容。
-    # 例如：【選擇題】請問堆積的定義是什麼？
-    # 【....】中為問題類型
-    # 將"qa_type"字串從 qid的【】中取出
-    qa_type = question.split("】")[0].replace("【", "") if "】" in question else "未知類型"
-    
-    # 透過add_question_type函數添加到問題庫
-    add_question_type(qid, qa_type) # 將問題類型加入問題庫
-    # question_type = classify_question_type(question) # 判斷問題類型
+        # 先查語意評分快取（相近答案直接沿用分數與評語），未命中才呼叫 GPT 評分
+        with token_usage.attribution(sid, topic):
+            score, feedback, _ = grade_answer(question, answer, qid)
+
+    # 題型由 question_classifier 在本機判斷：
+    # 【問題類型】前綴可辨識時直接採用（例如：【選擇題】請問堆積的定義是什麼？），否則以向量最近質心分類
+    if not qid or not question_bank_db.exists(f"question:{qid}"):
+        qid = new_qid() # 不在題庫中的題目，生成新的問題ID並寫入題庫
+        add_question(qid, question, "GPT API", sid, unit, topic, classify_question(question))
+    elif not question_bank_db.hexists(f"question:{qid}", "qaType"):
+        add_question_type(qid, classify_question(question)) # 將問題類型加入問題庫
     add_response_to_question(qid, sid, answer, time.time() - total_start_time, len(answer), is_suspected, not is_suspected, score, feedback)
+    if session:
+        quiz_session.finish_question(did)
     # 將答案加入學生的問題庫
     # 回傳分數、評語、是否可疑、CPS等信息
     # 【未來加上空白要求前端再次要求學生作答】
     return jsonify({"score": score, "feedback": feedback, "is_suspected": is_suspected, "cps": cps})
 
+# GPT token 用量報表，?top=10 為列出用量最多的學生與子單元數量
+@app.route("/api/usage", methods=["GET"])
+def api_usage_report():
+    top = max(1, min(request.args.get("top", 10, type=int), 100))
+    return jsonify(token_usage.usage_report(top))
+
+# 單一學生的 GPT token 用量（累計與今日）
+@app.route("/api/usage/students/<sid>", methods=["GET"])
+def api_student_usage(sid):
+    return jsonify(token_usage.student_usage(sid))
+
+# 全班分析（預先彙總，不掃描學生資料）；?class=甲 只看該班，不帶時為全校
+# 排行榜：累計得分前幾名，?top=10
+@app.route("/api/analytics/leaderboard", methods=["GET"])
+def api_analytics_leaderboard():
+    top = max(1, min(request.args.get("top", 10, type=int), 100))
+    return jsonify({"class": request.args.get("class"), "leaderboard": analytics.leaderboard(request.args.get("class"), top)})
+
+# 單一學生的名次與累計得分
+@app.route("/api/analytics/students/<sid>/rank", methods=["GET"])
+def api_analytics_student_rank(sid):
+    return jsonify(analytics.student_rank(sid, request.args.get("class")))
+
+# 弱點子單元：平均分數最低的子單元，?top=10
+@app.route("/api/analytics/topics/weak", methods=["GET"])
+def api_analytics_weak_topics():
+    top = max(1, min(request.args.get("top", 10, type=int), 100))
+    return jsonify({"class": request.args.get("class"), "topics": analytics.weak_topics(request.args.get("class"), top)})
+
+# 子單元的分數分布（0~10 分各幾次）
+@app.route("/api/analytics/topics/<topic>/histogram", methods=["GET"])
+def api_analytics_topic_histogram(topic):
+    return jsonify(analytics.topic_histogram(resolve_topic(topic), request.args.get("class")))
+
+# 各題型的作答次數與平均分數
+@app.route("/api/analytics/question_types", methods=["GET"])
+def api_analytics_question_types():
+    return jsonify({"class": request.args.get("class"), "question_types": analytics.question_type_stats(request.args.get("class"))})
+
+# 分頁讀取某題的學生作答紀錄（分析用），?offset=0&limit=50
+@app.route("/api/questions/<qid>/responses", methods=["GET"])
+def api_question_responses(qid):
+    offset = max(0, request.args.get("offset", 0, type=int))
+    limit = max(1, min(request.args.get("limit", 50, type=int), 500))
+    responses, total = get_question_responses(qid, offset, limit)
+    return jsonify({"qid": qid, "offset": offset, "limit": limit, "total": total, "responses": responses})
+
+# 語意評分快取的命中統計
+@app.route("/api/grading/cache", methods=["GET"])
+def api_grade_cache_stats():
+    return jsonify(grade_cache_stats())
+
+# 本機預先篩選的統計：直接給分（省下 GPT 呼叫）的比例與各原因次數
+@app.route("/api/grading/prescreen", methods=["GET"])
+def api_prescreen_stats():
+    return jsonify(prescreen_stats())
+
 # @app.route("/api/student/<sid>/summary", methods=["GET"]) # 獲取學生總結
 # def api_summary(sid):
     # key = f"user:{sid}"
@@ -232,7 +420,7 @@ def api_get_units(did,sid):
     unit_progress = json.loads(student_db.hget(student_key, "unit_progress") or "{}")
 
     units = []
-    for unit in unit_order:
+    for unit in get_unit_order():
         unit_data = {
             "unit": unit,
             # "name": unit_name_map.get(unit, unit),
@@ -252,12 +440,7 @@ def api_student_progress(did,sid):
 
 @app.route("/api/student/<did>/topics", methods=["GET"]) # 取得學生的子主題
 def api_get_topics(did):
-    keys = unit_vector_db.keys("subtopic:*")
-    unit_topic_map = {}
-    for key in keys:
-        topic = key.decode("utf-8").replace("subtopic:", "")
-        unit = unit_vector_db.hget(key, "unit").decode("utf-8")
-        unit_topic_map.setdefault(unit, []).append(topic)
+    _, unit_topic_map, _ = vector_store.read_course_index()  # 一次往返讀出課程索引
     return jsonify(unit_topic_map)
 
 
@@ -278,7 +461,22 @@ def detect_ai_like_answer(answer_text, typing_start_time, total_start_time, min_
 
 # sid = get_student_id("885576463552765984")
 # print(sid)
-app.run(debug=False, host="0.0.0.0", port=5000)
+
+# 伺服器啟動前的準備（開發伺服器與 wsgi.py 共用）
+def prepare_server():
+    if os.getenv("PROGRESS_SPINNER") == "1":  # 選用：在終端機顯示 GPT 呼叫的轉圈動畫（開發用）
+        progress_events.enable_cli_spinner()
+    if os.getenv("MODEL_WARMUP") == "1":  # 選用：啟動時先載入向量模型，避免第一個請求等待
+        models.warm_up()
+    with startup.step("建立 bcrypt 行程池"):
+        login_guard.start_pool()
+    startup.report()
+
+# 開發用：python main.py（Werkzeug 開發伺服器，每個請求一條執行緒）
+# 正式環境請改用多行程的 gunicorn：gunicorn -c gunicorn.conf.py wsgi:app（見 README）
+if __name__ == "__main__":
+    prepare_server()
+    app.run(debug=False, host="0.0.0.0", port=int(os.getenv("PORT", "5000")), threaded=True)
 
 """
 # 原本 CLI 主程式入口
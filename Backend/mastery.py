@@ -0,0 +1,186 @@
+# 全體學生的掌握度估計與下一個子單元推薦（批次、向量化）
+#
+# add_response_to_question 的完成規則（作答 >= 3 次且平均 >= 7 分）一次只看一位學生、一個子單元，
+# 也不會利用子單元之間的相關性。這裡把所有學生的 progress 讀成 學生 × 子單元 的稠密矩陣，一次算完：
+#
+#   1. 直接證據：A[i, j] = 作答次數，P[i, j] = 作答次數 × 平均分數 / 10
+#   2. 證據擴散：以 unit_vector_db 的子單元向量 cosine 相似度建立權重 W（低於 MASTERY_SIMILARITY_MIN 視為 0、對角線為 0），
+#      A_eff = A + λ·A·W，P_eff = P + λ·P·W（λ = MASTERY_SPREAD），相關子單元的作答也算部分證據
+#   3. 掌握度：mastery = (P_eff + k·prior) / (A_eff + k)，沒有證據時為先驗值 prior（MASTERY_PRIOR、k = MASTERY_PRIOR_WEIGHT）
+#   4. 已掌握：mastery >= MASTERY_TARGET 且 A_eff >= MASTERY_MIN_EVIDENCE
+#   5. 推薦：依課程順序第一個尚未掌握的子單元（reason=next）；全部掌握時推薦掌握度最低的子單元複習（reason=review）
+#
+# 結果寫入 student_db（Redis DB0）user:{學號} 的 recommendation 欄位（json）：
+#   {"topic", "unit", "mastery", "reason", "weak_topics", "updated_at"}
+#
+# 用法：python mastery.py run [--dry-run]（可排程定期執行，例如每 10 分鐘）
+# 完成規則本身仍由 progress_store 的 Lua 腳本即時套用，這裡只產生推薦。
+
+import os
+import sys
+import json
+import time
+import argparse
+import numpy as np
+import redis
+
+import vector_store
+
+MASTERY_PRIOR = float(os.getenv("MASTERY_PRIOR", "0.5"))
+MASTERY_PRIOR_WEIGHT = float(os.getenv("MASTERY_PRIOR_WEIGHT", "1"))
+MASTERY_SPREAD = float(os.getenv("MASTERY_SPREAD", "0.5"))
+MASTERY_SIMILARITY_MIN = float(os.getenv("MASTERY_SIMILARITY_MIN", "0.5"))
+MASTERY_TARGET = float(os.getenv("MASTERY_TARGET", "0.7"))
+MASTERY_MIN_EVIDENCE = float(os.getenv("MASTERY_MIN_EVIDENCE", "3"))
+MASTERY_BATCH_SIZE = 1000
+WEAK_TOPICS = 3  # recommendation 中附帶的弱點子單元數
+
+student_db = redis.Redis(host='localhost', port=6379, db=0)
+
+
+# 子單元相似度權重矩陣（m × m），topics 中沒有向量的子單元整列為 0
+def similarity_weights(topics, subtopics=None, embeddings=None):
+    if subtopics is None:
+        subtopics, embeddings = vector_store.get_subtopic_matrix()
+    m = len(topics)
+    weights = np.zeros((m, m), dtype=np.float32)
+    row_of = {topic: i for i, topic in enumerate(subtopics)}
+    present = [j for j, topic in enumerate(topics) if topic in row_of]
+    if len(present) < 2:
+        return weights
+
+    vectors = embeddings[[row_of[topics[j]] for j in present]]
+    sim = vectors @ vectors.T
+    sim[sim < MASTERY_SIMILARITY_MIN] = 0.0
+    np.fill_diagonal(sim, 0.0)
+    weights[np.ix_(present, present)] = sim
+    return weights
+
+# progress json（每位學生一筆）轉成 (作答次數 A, 加權得分 P) 兩個 n × m 矩陣
+def matrices_from_progress(raw_progress, topic_index):
+    n, m = len(raw_progress), len(topic_index)
+    attempts = np.zeros((n, m), dtype=np.float32)
+    points = np.zeros((n, m), dtype=np.float32)
+    rows, cols, counts, avgs = [], [], [], []
+    for i, raw in enumerate(raw_progress):
+        if not raw:
+            continue
+        try:
+            progress = json.loads(raw)
+        except ValueError:
+            continue
+        for topic, value in progress.items():
+            j = topic_index.get(topic)
+            if j is None or not isinstance(value, list) or len(value) < 2:
+                continue
+            rows.append(i)
+            cols.append(j)
+            counts.append(value[0] or 0)
+            avgs.append(value[1] or 0)
+    if rows:
+        counts = np.asarray(counts, dtype=np.float32)
+        attempts[rows, cols] = counts
+        points[rows, cols] = counts * np.asarray(avgs, dtype=np.float32) / 10
+    return attempts, points
+
+# 掌握度估計，回傳 (mastery, 有效證據量 A_eff)，皆為 n × m
+def estimate_mastery(attempts, points, weights):
+    effective_attempts = attempts + MASTERY_SPREAD * (attempts @ weights)
+    effective_points = points + MASTERY_SPREAD * (points @ weights)
+    mastery = (effective_points + MASTERY_PRIOR_WEIGHT * MASTERY_PRIOR) / (effective_attempts + MASTERY_PRIOR_WEIGHT)
+    return np.clip(mastery, 0.0, 1.0), effective_attempts
+
+# 推薦子單元，回傳 (子單元索引, 是否為複習)，皆為長度 n 的陣列；子單元依課程順序排列
+def recommend(mastery, evidence):
+    not_mastered = (mastery < MASTERY_TARGET) | (evidence < MASTERY_MIN_EVIDENCE)
+    review = ~not_mastered.any(axis=1)
+    next_index = np.argmax(not_mastered, axis=1)  # 第一個 True（課程順序最前面的未掌握子單元）
+    weakest = np.argmin(mastery, axis=1)
+    return np.where(review, weakest, next_index), review
+
+# 每位學生作答過的子單元中掌握度最低的 k 個（沒作答過的子單元排除）
+def weak_topics(mastery, attempts, k=WEAK_TOPICS):
+    if mastery.shape[1] == 0:
+        return np.zeros((mastery.shape[0], 0), dtype=np.int64)
+    k = min(k, mastery.shape[1])
+    masked = np.where(attempts > 0, mastery, np.inf)
+    candidates = np.argpartition(masked, k - 1, axis=1)[:, :k]
+    order = np.argsort(np.take_along_axis(masked, candidates, axis=1), axis=1)
+    return np.take_along_axis(candidates, order, axis=1)
+
+def _course_topics():
+    unit_order, unit_topic_list, topic_unit_map = vector_store.read_course_index()
+    return [topic for unit in unit_order for topic in unit_topic_list[unit]], topic_unit_map
+
+def _load_progress(student_ids, batch_size):
+    raw = []
+    for start in range(0, len(student_ids), batch_size):
+        pipe = student_db.pipeline(transaction=False)
+        for sid in student_ids[start:start + batch_size]:
+            pipe.hget(f"user:{sid}", "progress")
+        raw.extend(pipe.execute())
+    return raw
+
+# 重新計算所有學生的推薦並寫入 recommendation 欄位
+# 回傳 {"students", "topics", "next", "review", "seconds"}
+def refresh_recommendations(dry_run=False, batch_size=MASTERY_BATCH_SIZE):
+    # 學生索引 key 沿用 database.py 的定義；在這裡才 import，benchmarks.py 只用矩陣運算時不必載入整個後端
+    from database import STUDENT_INDEX
+
+    started = time.time()
+    topics, topic_unit_map = _course_topics()
+    student_ids = sorted(sid.decode("utf-8") for sid in student_db.smembers(STUDENT_INDEX))
+    stats = {"students": len(student_ids), "topics": len(topics), "next": 0, "review": 0}
+    if not topics or not student_ids:
+        stats["seconds"] = round(time.time() - started, 3)
+        return stats
+
+    attempts, points = matrices_from_progress(_load_progress(student_ids, batch_size), {t: j for j, t in enumerate(topics)})
+    mastery, evidence = estimate_mastery(attempts, points, similarity_weights(topics))
+    chosen, review = recommend(mastery, evidence)
+    weak = weak_topics(mastery, attempts)
+    stats["review"] = int(review.sum())
+    stats["next"] = stats["students"] - stats["review"]
+
+    if not dry_run:
+        now = time.time()
+        attempted = attempts > 0
+        for start in range(0, len(student_ids), batch_size):
+            pipe = student_db.pipeline(transaction=False)
+            for i in range(start, min(start + batch_size, len(student_ids))):
+                topic = topics[chosen[i]]
+                pipe.hset(f"user:{student_ids[i]}", "recommendation", json.dumps({
+                    "topic": topic,
+                    "unit": topic_unit_map.get(topic),
+                    "mastery": round(float(mastery[i, chosen[i]]), 3),
+                    "reason": "review" if review[i] else "next",
+                    "weak_topics": [topics[j] for j in weak[i] if attempted[i, j]],
+                    "updated_at": now
+                }, ensure_ascii=False))
+            pipe.execute()
+
+    stats["seconds"] = round(time.time() - started, 3)
+    return stats
+
+# 讀取單一學生的推薦（尚未計算時為 None）
+def get_recommendation(student_id):
+    raw = student_db.hget(f"user:{student_id}", "recommendation")
+    return json.loads(raw) if raw else None
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="掌握度估計與子單元推薦")
+    sub = parser.add_subparsers(dest="command", required=True)
+    p = sub.add_parser("run", help="重新計算所有學生的推薦")
+    p.add_argument("--dry-run", action="store_true", help="只計算不寫入")
+
+    args = parser.parse_args(argv)
+    if args.command == "run":
+        stats = refresh_recommendations(dry_run=args.dry_run)
+        rate = stats["students"] / stats["seconds"] if stats["seconds"] else stats["students"]
+        print(f"✅ {stats['students']} 位學生 × {stats['topics']} 個子單元：推薦下一個 {stats['next']}、複習 {stats['review']}，"
+              f"耗時 {stats['seconds']:.2f}s（{rate:.0f} 位/秒）{'（dry-run 未寫入）' if args.dry_run else ''}")
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,54 @@
+# 向量模型註冊表（第一次使用時才載入）
+#
+# 原本 database.py 與 question_gpt4o.py 在 import 時各自載入一個 SentenceTransformer，
+# 啟動要數十秒、每個 worker 佔用超過 1 GB。這裡改成由同一個註冊表在第一次 encode 時才載入，
+# 同一個模型在同一個行程中只會載入一次。
+#
+# 環境變數：
+#   - UNIT_EMBEDDING_MODEL: 子單元向量（DB1）使用的模型，預設 paraphrase-MiniLM-L6-v2
+#   - QUERY_EMBEDDING_MODEL: 評分快取等語意比對使用的模型，預設 paraphrase-multilingual-mpnet-base-v2
+#   - EMBEDDING_MODEL: 設定後上面兩者都改用這個模型（一個行程只載入一個模型）
+#   - MODEL_WARMUP=1: 啟動時先載入模型（warm_up），避免第一個請求等待
+
+import os
+import threading
+
+import startup
+import tracing
+
+UNIT_MODEL_NAME = os.getenv("UNIT_EMBEDDING_MODEL", "paraphrase-MiniLM-L6-v2")
+QUERY_MODEL_NAME = os.getenv("QUERY_EMBEDDING_MODEL", "sentence-transformers/paraphrase-multilingual-mpnet-base-v2")
+SHARED_MODEL_NAME = os.getenv("EMBEDDING_MODEL")
+
+_models = {}
+_models_lock = threading.Lock()
+
+
+def resolve_model_name(name):
+    return SHARED_MODEL_NAME or name
+
+def get_model(name):
+    name = resolve_model_name(name)
+    model = _models.get(name)
+    if model is None:
+        with _models_lock:
+            model = _models.get(name)
+            if model is None:
+                with startup.step(f"載入模型 {name}"):
+                    from sentence_transformers import SentenceTransformer  # 匯入 torch 很慢，延後到第一次使用
+                    model = SentenceTransformer(name)
+                _models[name] = model
+    return model
+
+def encode(texts, name, **kwargs):
+    model = get_model(name)
+    with tracing.span("embedding.encode"):
+        return model.encode(texts, **kwargs)
+
+def loaded_models():
+    return list(_models.keys())
+
+# 預先載入模型（預設載入子單元與語意比對兩個模型）
+def warm_up(names=None):
+    for name in names or [UNIT_MODEL_NAME, QUERY_MODEL_NAME]:
+        get_model(name)
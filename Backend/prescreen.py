@@ -0,0 +1,119 @@
+# 作答的本機預先篩選（在呼叫 GPT 評分之前）
+#
+# 評分標準中有幾條規則不需要 GPT 就能判斷，過去這些答案仍要花一次完整的 GPT 往返：
+#   - 空白或只有標點符號、表情符號 -> 0 分
+#   - 明確表示不會（「不知道」、「不會」、「idk」…）-> 0 分
+#   - 不是中英文的亂碼、重複字元灌水 -> 0 分
+#   - 與題目無關（題目與答案向量的 cosine 相似度低於 PRESCREEN_RELEVANCE_MIN）-> 0 分（規則 1：文不對題）
+#     預設關閉：「B」、「O(n log n)」這類簡短的正確答案向量常與題目相距很遠，因此只檢查至少
+#     PRESCREEN_RELEVANCE_MIN_CHARS 字的答案，且需自行設定 PRESCREEN_RELEVANCE_MIN > 0 才會啟用
+# 只有判斷明確的答案會直接給分並套用固定評語，其餘一律交給 GPT。
+# 少於 20 字的答案在評分標準中是「扣三分」而不是零分，仍需 GPT 判斷內容，因此只記錄不攔截。
+#
+# 統計（question_bank_db，Redis DB2）:
+#   - prescreen:stats（hash）: checked（檢查次數）、saved（直接給分、省下的 GPT 呼叫）、short（少於 20 字）、
+#     以及各原因的次數（empty / refusal / gibberish / off_topic）
+
+import os
+import re
+import unicodedata
+from functools import lru_cache
+import numpy as np
+import redis
+
+import models
+import vector_store
+
+PRESCREEN_ENABLED = os.getenv("PRESCREEN_ENABLED", "1") != "0"
+PRESCREEN_RELEVANCE_MIN = float(os.getenv("PRESCREEN_RELEVANCE_MIN", "0"))  # 0 表示不檢查相關性（預設）
+PRESCREEN_RELEVANCE_MIN_CHARS = int(os.getenv("PRESCREEN_RELEVANCE_MIN_CHARS", "20"))  # 較短的答案不檢查相關性
+PRESCREEN_STATS_KEY = "prescreen:stats"
+SHORT_ANSWER_CHARS = 20  # 評分標準第 6 條
+MIN_LETTER_RATIO = 0.3  # 中英文字元與數字占比低於此值視為亂碼
+MIN_DISTINCT_RATIO = 0.15  # 不同字元數占比低於此值視為灌水（僅檢查 20 字以上的答案）
+
+REFUSAL_PATTERN = re.compile(r"^(我?不(知道|會|懂|清楚|確定)|沒有?概念|忘了|跳過|pass|idk|i don'?t know|no idea|\?+)$", re.IGNORECASE)
+
+FEEDBACK = {
+    "empty": "評語: 未作答或答案只有符號，無法評分。\n扣分原因: 沒有作答內容。",
+    "refusal": "評語: 這題還不熟悉沒關係，建議先複習這個子單元的課程內容再試一次。\n扣分原因: 沒有作答內容。",
+    "gibberish": "評語: 答案無法辨識為有意義的中文或英文內容。\n扣分原因: 答案內容無法辨識。",
+    "off_topic": "評語: 回答與題目無關，請先確認題目問的是什麼再作答。\n扣分原因: 文不對題，依評分標準總分零分。"
+}
+
+question_bank_db = redis.Redis(host='localhost', port=6379, db=2)
+
+
+def _letters(text):
+    return [ch for ch in text if unicodedata.category(ch).startswith("L")]
+
+def _is_cjk_or_latin(ch):
+    name = unicodedata.name(ch, "")
+    return name.startswith(("CJK", "LATIN")) or ch.isascii()
+
+# 只看文字本身的檢查，回傳原因（str）或 None
+def screen_text(answer):
+    text = unicodedata.normalize("NFKC", answer or "").strip()
+    letters = _letters(text)
+    if not letters and not any(ch.isdigit() for ch in text):
+        return "empty"
+    if REFUSAL_PATTERN.match(re.sub(r"[\s。.!！~～]+$", "", text)):
+        return "refusal"
+    visible = [ch for ch in text if not ch.isspace()]
+    meaningful = sum(1 for ch in letters if _is_cjk_or_latin(ch)) + sum(1 for ch in visible if ch.isdigit())
+    if meaningful / len(visible) < MIN_LETTER_RATIO:
+        return "gibberish"
+    if len(visible) >= SHORT_ANSWER_CHARS and len(set(visible)) / len(visible) < MIN_DISTINCT_RATIO:
+        return "gibberish"
+    return None
+
+# 題目向量（去掉【問題類型】前綴），同一題只編碼一次
+@lru_cache(maxsize=1024)
+def _question_vec(question):
+    text = re.sub(r"^【[^】]*】", "", question or "").strip()
+    vec = models.encode([text], models.QUERY_MODEL_NAME, convert_to_numpy=True)
+    return vector_store.normalize_rows(vec).reshape(-1)
+
+# 題目與答案的相關性檢查（answer_vec 為已正規化的答案向量），回傳原因或 None
+def screen_relevance(question, answer, answer_vec):
+    if not relevance_applies(answer) or answer_vec is None or not question:
+        return None
+    question_vec = _question_vec(question)
+    if question_vec.shape != answer_vec.shape:
+        return None
+    if float(np.dot(question_vec, answer_vec)) < PRESCREEN_RELEVANCE_MIN:
+        return "off_topic"
+    return None
+
+def relevance_enabled():
+    return PRESCREEN_ENABLED and PRESCREEN_RELEVANCE_MIN > 0
+
+# 相關性檢查只用在夠長的答案上
+def relevance_applies(answer):
+    visible = [ch for ch in unicodedata.normalize("NFKC", answer or "") if not ch.isspace()]
+    return relevance_enabled() and len(visible) >= PRESCREEN_RELEVANCE_MIN_CHARS
+
+# 記錄一次檢查結果；reason 為 None 表示交給 GPT
+def record(reason, answer):
+    pipe = question_bank_db.pipeline(transaction=False)
+    pipe.hincrby(PRESCREEN_STATS_KEY, "checked", 1)
+    if reason:
+        pipe.hincrby(PRESCREEN_STATS_KEY, "saved", 1)
+        pipe.hincrby(PRESCREEN_STATS_KEY, reason, 1)
+    elif len((answer or "").strip()) < SHORT_ANSWER_CHARS:
+        pipe.hincrby(PRESCREEN_STATS_KEY, "short", 1)
+    pipe.execute()
+
+# 直接給分的結果：(分數, 評語)
+def verdict(reason):
+    return 0, FEEDBACK[reason]
+
+# 省下的 GPT 呼叫比例
+def prescreen_stats():
+    stats = {k.decode("utf-8"): int(v) for k, v in question_bank_db.hgetall(PRESCREEN_STATS_KEY).items()}
+    checked, saved = stats.get("checked", 0), stats.get("saved", 0)
+    stats["saved_ratio"] = round(saved / checked, 4) if checked else 0.0
+    stats["enabled"] = PRESCREEN_ENABLED
+    stats["relevance_min"] = PRESCREEN_RELEVANCE_MIN
+    stats["relevance_min_chars"] = PRESCREEN_RELEVANCE_MIN_CHARS
+    return stats
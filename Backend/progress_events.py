@@ -0,0 +1,130 @@
+# 進度事件（取代原本 question_gpt4o 的全域 _loading 旗標與轉圈動畫執行緒）
+#
+# 原本每次呼叫 GPT 都會把模組層級的 _loading 設為 True、另開一條執行緒在終端機印轉圈動畫，
+# 兩個請求同時進行時，先結束的那個會把另一個的動畫一起關掉，而且 t.join() 讓請求多等最多 0.5 秒。
+# 現在耗時步驟只發出進度事件，誰需要就自己訂閱：
+#   - 終端機轉圈動畫：enable_cli_spinner()（僅開發時使用，PROGRESS_SPINNER=1）
+#   - 非同步出題工作：question_jobs 把目前步驟寫進 job:{job_id} 的 stage 欄位
+#
+# 事件格式（dict）:
+#   - task_id: 這一次步驟的 id（str）
+#   - scope: 所屬範圍（str|None），例如 "job:{job_id}"，以 scope() 設定，同一執行緒內的步驟共用
+#   - name: 步驟名稱（generate / evaluate / evaluate_batch ...）
+#   - message: 顯示文字
+#   - status: start / done / error
+#   - elapsed: 耗時秒數（done / error 才有）
+
+import sys
+import time
+import uuid
+import itertools
+import threading
+import traceback
+import contextvars
+from contextlib import contextmanager
+
+_subscribers = []
+_subscribers_lock = threading.Lock()
+_scope = contextvars.ContextVar("progress_scope", default=None)
+
+
+# 訂閱進度事件，callback(event) 會在發出事件的執行緒中被呼叫，請勿在裡面做耗時操作
+def subscribe(callback):
+    with _subscribers_lock:
+        if callback not in _subscribers:
+            _subscribers.append(callback)
+    return callback
+
+def unsubscribe(callback):
+    with _subscribers_lock:
+        if callback in _subscribers:
+            _subscribers.remove(callback)
+
+def emit(event):
+    with _subscribers_lock:
+        subscribers = list(_subscribers)
+    for callback in subscribers:
+        try:
+            callback(event)
+        except Exception:
+            traceback.print_exc()  # 訂閱者出錯不影響主流程
+
+def current_scope():
+    return _scope.get()
+
+# 設定目前執行緒（context）的進度範圍，區塊內發出的事件都帶有這個 scope
+@contextmanager
+def scope(scope_id=None):
+    scope_id = scope_id or uuid.uuid4().hex[:12]
+    token = _scope.set(scope_id)
+    try:
+        yield scope_id
+    finally:
+        _scope.reset(token)
+
+# 包住一個耗時步驟，開始與結束時各發出一個事件
+@contextmanager
+def task(name, message):
+    base = {"task_id": uuid.uuid4().hex[:8], "scope": _scope.get(), "name": name, "message": message}
+    if not _subscribers:  # 沒有訂閱者時不做任何事
+        yield
+        return
+    start = time.perf_counter()
+    emit({**base, "status": "start"})
+    try:
+        yield
+    except BaseException:
+        emit({**base, "status": "error", "elapsed": time.perf_counter() - start})
+        raise
+    emit({**base, "status": "done", "elapsed": time.perf_counter() - start})
+
+
+# 終端機轉圈動畫：同時有多個步驟進行時顯示最新的一個，全部結束才清除
+class CliSpinner:
+    def __init__(self, stream=None, interval=0.5):
+        self.stream = stream or sys.stdout
+        self.interval = interval
+        self._active = {}  # task_id -> message
+        self._lock = threading.Lock()
+        self._wake = threading.Event()
+        self._width = 0
+        threading.Thread(target=self._run, name="progress-spinner", daemon=True).start()
+
+    def __call__(self, event):
+        with self._lock:
+            if event["status"] == "start":
+                self._active[event["task_id"]] = event["message"]
+            else:
+                self._active.pop(event["task_id"], None)
+        self._wake.set()
+
+    def _run(self):
+        dots = itertools.cycle(["", ".", "..", "..."])
+        while True:
+            with self._lock:
+                message = next(reversed(self._active.values()), None)
+            if message is None:
+                if self._width:
+                    self.stream.write("\r" + " " * self._width + "\r")  # 清空動畫行
+                    self.stream.flush()
+                    self._width = 0
+                self._wake.wait()
+            else:
+                line = f"{message}{next(dots)}   "
+                self.stream.write("\r" + line.ljust(self._width))
+                self.stream.flush()
+                self._width = max(self._width, len(line))
+                self._wake.wait(self.interval)
+            self._wake.clear()
+
+_spinner = {"instance": None}
+
+def enable_cli_spinner():
+    if _spinner["instance"] is None:
+        _spinner["instance"] = subscribe(CliSpinner())
+    return _spinner["instance"]
+
+def disable_cli_spinner():
+    if _spinner["instance"] is not None:
+        unsubscribe(_spinner["instance"])
+        _spinner["instance"] = None
@@ -0,0 +1,145 @@
+# 作答紀錄與學習進度的原子更新（Redis 伺服器端 Lua 腳本）
+#
+# add_response_to_question() 原本一次作答要對 DB0/DB1/DB2 發出約 15 次循序呼叫
+# （HGETALL、HINCRBY、HGET、HSET 與多次 progress/completed_topics/unit_progress/completed_units 的
+# json 讀改寫），全部沒有保護；學生同時從兩個裝置作答時，後寫入的會蓋掉先寫入的。
+# 這裡把每個資料庫的讀改寫都搬進一支 Lua 腳本，每個資料庫只需一次往返，且在 Redis 端原子執行。
+#
+#   1️⃣ question_bank_db（DB2）：追加作答紀錄、answered_count + 1、更新 accuracy，回傳 topic/unit/qaType
+#   2️⃣ unit_vector_db（DB1）：子單元 answered_count + 1、更新 accuracy，回傳該主單元的子單元順序
+#   3️⃣ student_db（DB0）：更新 progress、completed_topics、unit_progress、completed_units，
+#                        並在子單元達標時把同一主單元的下一個子單元加入 progress，回傳班級
+#
+# 這支模組只依賴 redis，方便 benchmarks.py 在獨立的 DB 上量測往返次數。
+
+# KEYS: question:{qid}, question:{qid}:responses
+# ARGV: 作答紀錄(json), 是否正確(1/0), 分數(可為空字串)
+RECORD_QUESTION_LUA = """
+local topic = redis.call('HGET', KEYS[1], 'topic')
+if not topic then
+  return redis.error_reply('question not found')
+end
+local unit = redis.call('HGET', KEYS[1], 'unit')
+redis.call('RPUSH', KEYS[2], ARGV[1])
+local count = redis.call('HINCRBY', KEYS[1], 'answered_count', 1)
+if ARGV[2] == '1' and ARGV[3] ~= '' then
+  local avg = tonumber(redis.call('HGET', KEYS[1], 'accuracy') or '0') or 0
+  local new = (avg * (count - 1) + tonumber(ARGV[3]) / 10 * 100) / count
+  redis.call('HSET', KEYS[1], 'accuracy', tostring(math.floor(new * 100 + 0.5) / 100))
+end
+return {topic, unit, redis.call('HEXISTS', KEYS[1], 'responses'), redis.call('HGET', KEYS[1], 'qaType') or ''}
+"""
+
+# KEYS: subtopic:{topic}, index:unit:{unit}
+# ARGV: 分數
+RECORD_SUBTOPIC_LUA = """
+local count = redis.call('HINCRBY', KEYS[1], 'answered_count', 1)
+local prev = tonumber(redis.call('HGET', KEYS[1], 'accuracy') or '0') or 0
+local new = (prev * (count - 1) + (tonumber(ARGV[1]) or 0) / 10 * 100) / count
+redis.call('HSET', KEYS[1], 'accuracy', tostring(math.floor(new * 100 + 0.5) / 100))
+return redis.call('ZRANGE', KEYS[2], 0, -1)
+"""
+
+# KEYS: user:{student_id}
+# ARGV: 子單元, 主單元, 分數, 該主單元的子單元(依課程順序)...
+RECORD_STUDENT_LUA = """
+local function round2(x) return math.floor(x * 100 + 0.5) / 100 end
+local function decode(raw)
+  if not raw or raw == '' then return {} end
+  local ok, value = pcall(cjson.decode, raw)
+  if ok and type(value) == 'table' then return value end
+  return {}
+end
+local function contains(list, item)
+  for _, v in ipairs(list) do
+    if v == item then return true end
+  end
+  return false
+end
+-- cjson 會把空 table 編成 {}，清單欄位要自行輸出 []
+local function encode_list(list)
+  if #list == 0 then return '[]' end
+  return cjson.encode(list)
+end
+
+local topic, unit, score = ARGV[1], ARGV[2], tonumber(ARGV[3]) or 0
+local unit_topics = {}
+for i = 4, #ARGV do unit_topics[#unit_topics + 1] = ARGV[i] end
+
+local fields = redis.call('HMGET', KEYS[1], 'progress', 'completed_topics', 'unit_progress', 'completed_units', 'class')
+local progress = decode(fields[1])
+local completed_topics = decode(fields[2])
+local unit_progress = decode(fields[3])
+local completed_units = decode(fields[4])
+
+local topic_progress = progress[topic] or {0, 0}
+local attempts = topic_progress[1] + 1
+local avg = round2((topic_progress[2] * (attempts - 1) + score) / attempts)
+progress[topic] = {attempts, avg}
+
+if attempts >= 3 and avg >= 7 then
+  if not contains(completed_topics, topic) then
+    table.insert(completed_topics, topic)
+  end
+  -- 達標時自動把下一個子單元加入 progress
+  for i, t in ipairs(unit_topics) do
+    local next_topic = unit_topics[i + 1]
+    if t == topic and next_topic and progress[next_topic] == nil then
+      progress[next_topic] = {0, 0}
+    end
+  end
+end
+
+if #unit_topics > 0 then
+  local done = 0
+  for _, t in ipairs(unit_topics) do
+    if contains(completed_topics, t) then done = done + 1 end
+  end
+  unit_progress[unit] = round2(done / #unit_topics * 100)
+  if unit_progress[unit] == 100 and not contains(completed_units, unit) then
+    table.insert(completed_units, unit)
+  end
+end
+
+redis.call('HSET', KEYS[1],
+  'progress', cjson.encode(progress),
+  'completed_topics', encode_list(completed_topics),
+  'unit_progress', cjson.encode(unit_progress),
+  'completed_units', encode_list(completed_units))
+return {attempts, tostring(avg), fields[5] or ''}
+"""
+
+_scripts = {}
+
+
+def _script(client, name, source):
+    key = (id(client), name)
+    if key not in _scripts:
+        _scripts[key] = client.register_script(source)
+    return _scripts[key]
+
+# 一次作答的所有紀錄更新：每個資料庫一次往返（EVALSHA）
+# 回傳 {"topic", "unit", "qa_type", "class", "attempts", "avg", "legacy_responses"}
+def record_response(question_db, subtopic_db, student_db, qid, student_id, record_json, correct, score):
+    topic, unit, legacy, qa_type = _script(question_db, "question", RECORD_QUESTION_LUA)(
+        keys=[f"question:{qid}", f"question:{qid}:responses"],
+        args=[record_json, 1 if correct else 0, "" if score is None else score])
+    topic, unit = topic.decode("utf-8"), unit.decode("utf-8")
+
+    unit_topics = _script(subtopic_db, "subtopic", RECORD_SUBTOPIC_LUA)(
+        keys=[f"subtopic:{topic}", f"index:unit:{unit}"],
+        args=[score or 0])
+
+    attempts, avg, student_class = _script(student_db, "student", RECORD_STUDENT_LUA)(
+        keys=[f"user:{student_id}"],
+        args=[topic, unit, score or 0, *unit_topics])
+
+    return {
+        "topic": topic,
+        "unit": unit,
+        "qa_type": qa_type.decode("utf-8") or None,
+        "class": student_class.decode("utf-8") or None,
+        "attempts": int(attempts),
+        "avg": float(avg),
+        "legacy_responses": bool(legacy)
+    }
@@ -0,0 +1,192 @@
+# 題型分類（本機，不呼叫 GPT）
+#
+# 原本 classify_question_type 每次都要花一次 GPT 呼叫，把題目對應到 QuestionType 七種題型之一；
+# api_submit_answer 則把【】前綴的字串直接傳給 add_question_type，因為不是 QuestionType 而永遠被拒絕。
+# 這裡改成本機分類，毫秒級完成：
+#   1. 題目有【問題類型】前綴時直接採用（parse_question_type）
+#   2. 否則以向量做最近質心（nearest centroid）分類：每個題型的質心為範例題目向量的平均，
+#      範例包含下方的 SEED_EXAMPLES，批次回填時再加入題庫中已由前綴標記的題目
+#
+# 批次回填：python question_classifier.py backfill [--dry-run] [--overwrite]
+# 掃描 question_bank_db（Redis DB2）所有 question:{qid}，替沒有（或不是合法值的）qaType 的題目補上題型。
+
+import sys
+import argparse
+import threading
+import numpy as np
+
+import models
+import vector_store
+from database import QuestionType, parse_question_type, question_bank_db
+
+BACKFILL_BATCH_SIZE = 256
+MAX_BANK_EXAMPLES = 200  # 每個題型最多取多少題題庫中的題目加入質心
+
+SEED_EXAMPLES = {
+    QuestionType.CHOICE: [
+        "下列何者是 min-max heap 的特性？(A) 每層交替為最小層與最大層 (B) 只有最小層 (C) 沒有層次之分，請選擇並說明理由。",
+        "以下哪一種資料結構最適合實作優先佇列？請選擇並解釋理由。",
+        "下列哪個操作在 Fibonacci heap 中的攤銷時間為 O(1)？(A) insert (B) delete-min (C) delete，請說明。",
+        "雜湊表使用鏈結法時，下列敘述何者正確？請說明選擇的理由。",
+    ],
+    QuestionType.DEFINITION: [
+        "請定義什麼是 AVL 樹，並舉一個例子說明。",
+        "何謂雜湊碰撞（collision）？請寫出定義並舉例。",
+        "請寫出 binomial tree 的定義，並舉例。",
+        "什麼是 leftist heap？請寫出其定義並舉例。",
+    ],
+    QuestionType.CALCULATION: [
+        "給定 n 個節點的 AVL 樹，最大樹高是多少？請推導。",
+        "令 m = 雜湊表大小、n = 資料筆數，請從 m 和 n 推導發生碰撞的機率。",
+        "建立 binomial heap 的時間複雜度如何決定？請計算。",
+        "給定 m 種相異鍵值，如何推算 2-3 樹高的上限？",
+    ],
+    QuestionType.SHORT_ANSWER: [
+        "pairing heap 和 Fibonacci heap 有何異同？",
+        "DEAP 和 min-max heap 的想法有何共通點？",
+        "請簡述線性探測與二次探測的差異。",
+        "比較 B 樹與 B+ 樹在搜尋上的不同。",
+    ],
+    QuestionType.SITUATIONAL: [
+        "假設雜湊表的負載因子接近 1，插入新資料時會發生什麼情況？請說明原因。",
+        "若在 AVL 樹中連續插入遞增的鍵值，樹的結構會如何變化？為什麼？",
+        "如果一個系統需要頻繁執行 decrease-key，使用 binary heap 會遇到什麼問題？",
+        "假設你要設計一個即時排行榜，每秒有大量分數更新，會選擇哪種資料結構？",
+    ],
+    QuestionType.OPEN_ENDED: [
+        "你認為在實務上何時不應該使用平衡樹？請提出你的看法。",
+        "如果可以改良雜湊表的設計，你會怎麼做？",
+        "你會如何向初學者解釋 heap 的用途？",
+        "請提出一種你認為更好的碰撞處理方式並說明想法。",
+    ],
+    QuestionType.COMPREHENSIVE: [
+        "請結合 heap 與雜湊表的概念，說明如何設計支援快速刪除任意元素的優先佇列。",
+        "AVL 樹刪除葉節點後的檢查可否改從樹根開始由上而下？有何優缺點？",
+        "結合 2-3 樹與紅黑樹的關係，說明兩者插入操作的對應。",
+        "如何同時利用 min-max heap 與 DEAP 的想法設計雙端優先佇列？",
+    ],
+}
+
+_centroids = {"types": None, "matrix": None}
+_centroids_lock = threading.Lock()
+
+
+def _embed(texts):
+    vecs = models.encode(list(texts), models.QUERY_MODEL_NAME, convert_to_numpy=True, batch_size=64)
+    return vector_store.normalize_rows(vecs)
+
+# 以範例建立各題型的質心；extra 為 {QuestionType: [題目, ...]}（例如題庫中已由前綴標記的題目）
+def build_centroids(extra=None):
+    types, rows = [], []
+    for qa_type in QuestionType:
+        examples = SEED_EXAMPLES[qa_type] + list((extra or {}).get(qa_type, []))
+        rows.append(_embed(examples).mean(axis=0))
+        types.append(qa_type)
+    matrix = vector_store.normalize_rows(np.vstack(rows))
+    with _centroids_lock:
+        _centroids["types"], _centroids["matrix"] = types, matrix
+    return types, matrix
+
+def _get_centroids():
+    with _centroids_lock:
+        if _centroids["matrix"] is not None:
+            return _centroids["types"], _centroids["matrix"]
+    return build_centroids()
+
+# 批次分類，回傳與 questions 順序相同的 [(QuestionType, 來源 "prefix"/"embedding"), ...]
+def classify_questions(questions):
+    results = [None] * len(questions)
+    pending = []
+    for i, question in enumerate(questions):
+        qa_type = parse_question_type(question)
+        if qa_type is not None:
+            results[i] = (qa_type, "prefix")
+        else:
+            pending.append(i)
+
+    if pending:
+        types, matrix = _get_centroids()
+        scores = _embed(questions[i] or "" for i in pending) @ matrix.T
+        for i, best in zip(pending, np.argmax(scores, axis=1)):
+            results[i] = (types[int(best)], "embedding")
+    return results
+
+# 分類單一題目，回傳 QuestionType
+def classify_question(question):
+    return classify_questions([question])[0][0]
+
+
+def _valid_type(value):
+    return value is not None and value.decode("utf-8") in {t.value for t in QuestionType}
+
+# 替題庫中所有題目補上 qaType；overwrite=True 時全部重新分類
+# 回傳 {"scanned", "already", "prefix", "embedding", "updated"}
+def backfill_question_types(dry_run=False, overwrite=False, batch_size=BACKFILL_BATCH_SIZE):
+    stats = {"scanned": 0, "already": 0, "prefix": 0, "embedding": 0, "updated": 0}
+    labelled = {t: [] for t in QuestionType}
+    unlabelled = []  # [(qid key, 題目)]
+
+    # 第一輪：讀取題目，前綴可判斷的直接標記，並收集題庫中的範例
+    keys = []
+    def flush_keys():
+        pipe = question_bank_db.pipeline(transaction=False)
+        for key in keys:
+            pipe.hmget(key, "question", "qaType")
+        updates = question_bank_db.pipeline(transaction=False)
+        for key, (question, qa_type) in zip(keys, pipe.execute()):
+            if question is None:
+                continue
+            stats["scanned"] += 1
+            text = question.decode("utf-8")
+            prefix_type = parse_question_type(text)
+            if prefix_type is not None and len(labelled[prefix_type]) < MAX_BANK_EXAMPLES:
+                labelled[prefix_type].append(text)
+            if _valid_type(qa_type) and not overwrite:
+                stats["already"] += 1
+            elif prefix_type is not None:
+                stats["prefix"] += 1
+                updates.hset(key, "qaType", prefix_type.value)
+            else:
+                unlabelled.append((key, text))
+        if not dry_run:
+            stats["updated"] += len(updates.execute())
+        keys.clear()
+
+    for key in question_bank_db.scan_iter(match="question:*", count=1000, _type="HASH"):
+        keys.append(key)
+        if len(keys) >= batch_size:
+            flush_keys()
+    if keys:
+        flush_keys()
+
+    # 第二輪：其餘題目以最近質心分類（質心加入題庫中的範例）
+    if unlabelled:
+        build_centroids(labelled)
+        for start in range(0, len(unlabelled), batch_size):
+            chunk = unlabelled[start:start + batch_size]
+            results = classify_questions([text for _, text in chunk])
+            pipe = question_bank_db.pipeline(transaction=False)
+            for (key, _), (qa_type, _) in zip(chunk, results):
+                pipe.hset(key, "qaType", qa_type.value)
+            stats["embedding"] += len(chunk)
+            if not dry_run:
+                stats["updated"] += len(pipe.execute())
+    return stats
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="題型分類")
+    sub = parser.add_subparsers(dest="command", required=True)
+    p = sub.add_parser("backfill", help="替題庫中所有題目補上 qaType")
+    p.add_argument("--dry-run", action="store_true", help="只統計不寫入")
+    p.add_argument("--overwrite", action="store_true", help="已有 qaType 的題目也重新分類")
+
+    args = parser.parse_args(argv)
+    if args.command == "backfill":
+        stats = backfill_question_types(dry_run=args.dry_run, overwrite=args.overwrite)
+        print(f"✅ 掃描 {stats['scanned']} 題：已有題型 {stats['already']}、依前綴 {stats['prefix']}、"
+              f"依向量 {stats['embedding']}，寫入 {stats['updated']} 題{'（dry-run 未寫入）' if args.dry_run else ''}")
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,151 @@
+# 非同步出題工作（question_bank_db，Redis DB2）
+#
+# api_generate_questions 直接呼叫 generate_random_questions_gpt4o，一次 LLM 往返常要 5~15 秒，
+# 全班同時出題時 Flask 執行緒會被占滿。這裡改成：
+#   1. 送出工作立即回傳 job_id
+#   2. 由固定大小的執行緒池（QUESTION_JOB_WORKERS）取題（優先從 question_pool 題池取），排隊上限為 QUESTION_JOB_QUEUE_MAX
+#   3. 結果寫入 Redis 並設定 TTL，任何一個 worker 都能回應查詢（可 long-poll 等待完成）
+#
+# Key: job:{job_id}（hash，TTL 為 QUESTION_JOB_TTL 秒）
+# 欄位:
+#   - status: pending / running / done / error
+#   - topic: 子單元名稱（str）
+#   - num_questions: 題數（int）
+#   - discord_id: 送出工作的 Discord ID（str）
+#   - student_id: 學號（str），用來避免重複出題
+#   - questions: 生成的題目（list[str]，經 json.dumps），完成後才有
+#   - qids: 題目在題庫中的 qid（list[str|None]，經 json.dumps），完成後才有
+#   - stage: 目前進行中的步驟（str，例如「自動出題中」），由 progress_events 事件更新
+#   - error: 錯誤訊息（str），失敗時才有
+#   - created_at / finished_at: 時間戳記（float）
+
+import os
+import json
+import time
+import uuid
+import threading
+import traceback
+from concurrent.futures import ThreadPoolExecutor
+import redis
+
+import progress_events
+import quiz_session
+from question_pool import serve_questions, resolve_topic, unit_of
+
+JOB_WORKERS = int(os.getenv("QUESTION_JOB_WORKERS", "4"))
+JOB_QUEUE_MAX = int(os.getenv("QUESTION_JOB_QUEUE_MAX", "32"))
+JOB_TTL = int(os.getenv("QUESTION_JOB_TTL", "600"))
+JOB_MAX_WAIT = 25  # long-poll 最長等待秒數
+JOB_POLL_INTERVAL = 0.25  # 非本 worker 的工作，輪詢 Redis 的間隔
+
+question_bank_db = redis.Redis(host='localhost', port=6379, db=2)
+
+_executor = ThreadPoolExecutor(max_workers=JOB_WORKERS, thread_name_prefix="question-job")
+_pending = {"count": 0}  # 執行中 + 排隊中的工作數，上限為 JOB_QUEUE_MAX
+_pending_lock = threading.Lock()
+_done_events = {}  # 本 worker 送出的工作 job_id -> threading.Event，long-poll 不必輪詢 Redis
+_done_events_lock = threading.Lock()
+
+
+def job_key(job_id):
+    return f"job:{job_id}"
+
+def _save(job_id, mapping):
+    pipe = question_bank_db.pipeline(transaction=True)
+    pipe.hset(job_key(job_id), mapping=mapping)
+    pipe.expire(job_key(job_id), JOB_TTL)
+    pipe.execute()
+
+# 送出出題工作，回傳 (job_id, None)；佇列已滿時回傳 (None, 錯誤訊息)
+def submit_question_job(topic, num_questions=3, discord_id=None, student_id=None):
+    with _pending_lock:
+        if _pending["count"] >= JOB_QUEUE_MAX:
+            return None, "出題佇列已滿，請稍後再試"
+        _pending["count"] += 1
+
+    job_id = uuid.uuid4().hex
+    try:
+        _save(job_id, {
+            "status": "pending",
+            "topic": topic,
+            "num_questions": num_questions,
+            "discord_id": discord_id or "",
+            "student_id": student_id or "",
+            "created_at": time.time()
+        })
+        with _done_events_lock:
+            _done_events[job_id] = threading.Event()
+        _executor.submit(_run_job, job_id, topic, num_questions, student_id, discord_id)
+    except Exception:
+        with _done_events_lock:
+            _done_events.pop(job_id, None)
+        _release_slot()
+        raise
+    return job_id, None
+
+def _release_slot():
+    with _pending_lock:
+        _pending["count"] -= 1
+
+# 工作執行中發出的進度事件（scope 為 job:{job_id}）寫入 stage 欄位，供查詢工作狀態時顯示
+def _record_stage(event):
+    scope_id = event["scope"]
+    if scope_id and scope_id.startswith("job:") and event["status"] == "start":
+        question_bank_db.hset(scope_id, "stage", event["message"])
+
+progress_events.subscribe(_record_stage)
+
+def _run_job(job_id, topic, num_questions, student_id=None, discord_id=None):
+    try:
+        question_bank_db.hset(job_key(job_id), "status", "running")
+        with progress_events.scope(job_key(job_id)):
+            served = serve_questions(topic, num_questions, student_id)
+        if not served:
+            raise RuntimeError("no questions generated")
+        _save(job_id, {
+            "status": "done",
+            "questions": json.dumps([q for _, q in served]),
+            "qids": json.dumps([qid for qid, _ in served]),
+            "finished_at": time.time()
+        })
+        if discord_id:  # 出題結果記入作答 session，選題與作答時不必再由 bot 傳回
+            resolved = resolve_topic(topic)
+            quiz_session.set_questions(discord_id, unit_of(resolved), resolved,
+                                       [q for _, q in served], [qid for qid, _ in served])
+    except Exception as e:
+        traceback.print_exc()
+        _save(job_id, {"status": "error", "error": str(e), "finished_at": time.time()})
+    finally:
+        _release_slot()
+        with _done_events_lock:
+            event = _done_events.pop(job_id, None)
+        if event:
+            event.set()
+
+def _read_job(job_id):
+    data = question_bank_db.hgetall(job_key(job_id))
+    if not data:
+        return None
+    job = {k.decode("utf-8"): v.decode("utf-8") for k, v in data.items()}
+    job["job_id"] = job_id
+    job["questions"] = json.loads(job["questions"]) if "questions" in job else None
+    job["qids"] = json.loads(job["qids"]) if "qids" in job else None
+    return job
+
+# 查詢工作狀態；wait > 0 時最多等待 wait 秒直到工作完成（long-poll）
+def get_question_job(job_id, wait=0):
+    deadline = time.time() + max(0.0, min(float(wait), JOB_MAX_WAIT))
+    with _done_events_lock:
+        event = _done_events.get(job_id)
+    if event is not None:
+        event.wait(max(0.0, deadline - time.time()))
+
+    while True:
+        job = _read_job(job_id)
+        if job is None or job["status"] in ("done", "error") or time.time() >= deadline:
+            return job
+        time.sleep(JOB_POLL_INTERVAL)
+
+# 目前執行中 + 排隊中的工作數
+def pending_job_count():
+    return _pending["count"]
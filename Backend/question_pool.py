@@ -0,0 +1,218 @@
+# 子單元預先出題池（question_bank_db，Redis DB2）
+#
+# 學生每次選子單元都要等 GPT 重新出三題，這裡改為在背景預先生成題目：
+#   - 每個子單元保留 QUESTION_POOL_SIZE 題尚未使用的題目（已用 add_question 寫入題庫並標記單元/子單元/題型）
+#   - 取題時以 LPOP 直接取出（O(1)），剩餘題數低於 QUESTION_POOL_LOW_WATER 時在背景補題
+#   - 記錄每位學生拿過的題目，避免重複出題
+#
+# Key:
+#   - pool:{子單元名稱}（list）: 尚未使用的題目 qid
+#   - pool_refill:{子單元名稱}（str，TTL）: 補題中的鎖，避免多個 worker 同時補同一個子單元；
+#     值為持有者的隨機 token，釋放時以 Lua 腳本比對 token 後才刪除（補題超過 TTL 時不會刪掉其他 worker 的鎖）
+#   - served:{學號}（set）: 該學生拿過的題目 qid
+#   - bank:{子單元名稱}（list）: 該子單元最近生成的 BANK_RECENT_SIZE 題 qid（超過 token 預算時重複使用）
+
+import os
+import re
+import uuid
+import random
+import traceback
+from concurrent.futures import ThreadPoolExecutor
+import redis
+
+import vector_store
+import token_usage
+from question_gpt4o import generate_random_questions_gpt4o
+from database import add_question
+from question_classifier import classify_questions
+
+POOL_SIZE = int(os.getenv("QUESTION_POOL_SIZE", "9"))
+POOL_LOW_WATER = int(os.getenv("QUESTION_POOL_LOW_WATER", "3"))
+POOL_REFILL_WORKERS = int(os.getenv("QUESTION_POOL_REFILL_WORKERS", "2"))
+POOL_REFILL_LOCK_TTL = 120  # 補題鎖的秒數（補題失敗時鎖會自動過期）
+SERVED_TTL = 60 * 60 * 24 * 180  # 學生拿過的題目紀錄保留一學期
+BANK_RECENT_SIZE = 200
+
+question_bank_db = redis.Redis(host='localhost', port=6379, db=2)
+
+_refill_executor = ThreadPoolExecutor(max_workers=POOL_REFILL_WORKERS, thread_name_prefix="question-pool")
+
+# KEYS: pool_refill:{子單元名稱}
+# ARGV: 取得鎖時寫入的 token
+RELEASE_LOCK_LUA = """
+if redis.call('GET', KEYS[1]) == ARGV[1] then
+  return redis.call('DEL', KEYS[1])
+end
+return 0
+"""
+
+_scripts = {}
+
+
+def pool_key(topic):
+    return f"pool:{topic}"
+
+def served_key(student_id):
+    return f"served:{student_id}"
+
+def bank_key(topic):
+    return f"bank:{topic}"
+
+def new_qid():
+    return f"Q{uuid.uuid4().hex[:12]}"
+
+# 將前端傳來的子單元名稱還原成索引中的名稱（bot 的選單文字可能帶有「1. 」題號）
+def resolve_topic(topic):
+    unit = unit_of(topic)
+    if unit is None:
+        stripped = re.sub(r"^\d+\.\s*", "", topic or "")
+        if unit_of(stripped) is not None:
+            return stripped
+    return topic
+
+def unit_of(topic):
+    unit = vector_store.unit_vector_db.hget(vector_store.INDEX_SUBTOPIC_UNIT, topic)
+    return unit.decode("utf-8") if unit else None
+
+# 生成題目並寫入題庫，回傳 [(qid, 題目), ...]
+def _generate_and_store(topic, unit, num_questions, source, student_id=None):
+    with token_usage.attribution(student_id, topic):
+        questions = generate_random_questions_gpt4o(topic, num_questions)
+    stored = []
+    for question, (qa_type, _) in zip(questions, classify_questions(questions)):
+        qid = new_qid()
+        add_question(qid, question, source, student_id, unit, topic, qa_type)
+        stored.append((qid, question))
+    if stored:
+        pipe = question_bank_db.pipeline(transaction=False)
+        pipe.lpush(bank_key(topic), *[qid for qid, _ in stored])
+        pipe.ltrim(bank_key(topic), 0, BANK_RECENT_SIZE - 1)
+        pipe.execute()
+    return stored
+
+def refill_lock_key(topic):
+    return f"pool_refill:{topic}"
+
+# 只在鎖仍由自己持有（token 相同）時才刪除
+def release_refill_lock(topic, token):
+    if "release_lock" not in _scripts:
+        _scripts["release_lock"] = question_bank_db.register_script(RELEASE_LOCK_LUA)
+    return bool(_scripts["release_lock"](keys=[refill_lock_key(topic)], args=[token]))
+
+# 補題直到題池達到 POOL_SIZE（同一子單元同時間只會有一個 worker 在補）
+def refill_pool(topic):
+    unit = unit_of(topic)
+    if unit is None:
+        return 0
+    token = uuid.uuid4().hex
+    if not question_bank_db.set(refill_lock_key(topic), token, nx=True, ex=POOL_REFILL_LOCK_TTL):
+        return 0
+
+    added = 0
+    try:
+        while question_bank_db.llen(pool_key(topic)) < POOL_SIZE and not token_usage.over_budget():
+            stored = _generate_and_store(topic, unit, 3, "GPT API (pool)")
+            if not stored:
+                break
+            question_bank_db.rpush(pool_key(topic), *[qid for qid, _ in stored])
+            added += len(stored)
+    except Exception:
+        traceback.print_exc()
+    finally:
+        release_refill_lock(topic, token)
+    if added:
+        print(f"✅ 子單元「{topic}」題池已補入 {added} 題")
+    return added
+
+def schedule_refill(topic):
+    return _refill_executor.submit(refill_pool, topic)
+
+# 學期初或重建 DB1 後，預先為所有子單元補題
+def warm_all_pools():
+    topics = [t.decode("utf-8") for t in vector_store.unit_vector_db.zrange(vector_store.INDEX_SUBTOPICS, 0, -1)]
+    for topic in topics:
+        schedule_refill(topic)
+
+# 從題池取出最多 num_questions 題該學生沒拿過的題目，回傳 [(qid, 題目), ...]
+def take_from_pool(topic, num_questions, student_id=None):
+    key = pool_key(topic)
+    candidates = question_bank_db.lpop(key, num_questions * 2) or []
+    if not candidates:
+        return []
+
+    pipe = question_bank_db.pipeline(transaction=False)
+    if student_id:
+        pipe.smismember(served_key(student_id), candidates)
+    for qid in candidates:
+        pipe.hget(f"question:{qid.decode('utf-8')}", "question")
+    results = pipe.execute()
+    already_served = results.pop(0) if student_id else [False] * len(candidates)
+
+    taken, put_back = [], []
+    for qid, served, question in zip(candidates, already_served, results):
+        if question is None:
+            continue  # 題目已被刪除
+        if served or len(taken) >= num_questions:
+            put_back.append(qid)  # 留給其他學生
+        else:
+            taken.append((qid.decode("utf-8"), question.decode("utf-8")))
+
+    if put_back:
+        question_bank_db.rpush(key, *put_back)
+    return taken
+
+# 超過 token 預算時改用已生成過的題目（優先挑該學生沒拿過的），回傳 [(qid, 題目), ...]
+def reuse_from_bank(topic, num_questions, student_id=None, exclude=()):
+    qids = [q for q in dict.fromkeys(question_bank_db.lrange(bank_key(topic), 0, -1)) if q.decode("utf-8") not in exclude]
+    if not qids:
+        return []
+    random.shuffle(qids)
+
+    pipe = question_bank_db.pipeline(transaction=False)
+    if student_id:
+        pipe.smismember(served_key(student_id), qids)
+    for qid in qids:
+        pipe.hget(f"question:{qid.decode('utf-8')}", "question")
+    results = pipe.execute()
+    already_served = results.pop(0) if student_id else [False] * len(qids)
+
+    candidates = [(served, qid.decode("utf-8"), question.decode("utf-8"))
+                  for qid, served, question in zip(qids, already_served, results) if question is not None]
+    candidates.sort(key=lambda c: bool(c[0]))  # 沒拿過的排前面
+    return [(qid, question) for _, qid, question in candidates[:num_questions]]
+
+# 記錄學生已拿過的題目
+def mark_served(student_id, qids):
+    if not student_id or not qids:
+        return
+    pipe = question_bank_db.pipeline(transaction=False)
+    pipe.sadd(served_key(student_id), *qids)
+    pipe.expire(served_key(student_id), SERVED_TTL)
+    pipe.execute()
+
+# 取得 num_questions 題：優先從題池取，不足時當場出題補足；題池低於低水位時在背景補題
+# 回傳 [(qid, 題目), ...]
+def serve_questions(topic, num_questions=3, student_id=None):
+    topic = resolve_topic(topic)
+    unit = unit_of(topic)
+    if unit is None:  # 不在課程索引中的子單元不進題池，直接出題
+        if token_usage.over_budget(student_id):
+            return []
+        with token_usage.attribution(student_id, topic):
+            return [(None, q) for q in generate_random_questions_gpt4o(topic, num_questions)]
+
+    taken = take_from_pool(topic, num_questions, student_id)
+    if len(taken) < num_questions and token_usage.over_budget(student_id):
+        # 超過 token 預算：不呼叫 GPT，改用已生成過的題目
+        taken += reuse_from_bank(topic, num_questions - len(taken), student_id, {qid for qid, _ in taken})
+    elif len(taken) < num_questions:
+        need = num_questions - len(taken)
+        fresh = _generate_and_store(topic, unit, need, "GPT API", student_id)
+        taken += fresh[:need]
+        if fresh[need:]:  # GPT 多出的題目放進題池
+            question_bank_db.rpush(pool_key(topic), *[qid for qid, _ in fresh[need:]])
+
+    mark_served(student_id, [qid for qid, _ in taken])
+    if question_bank_db.llen(pool_key(topic)) < POOL_LOW_WATER:
+        schedule_refill(topic)
+    return taken
@@ -0,0 +1,113 @@
+# 作答流程的伺服器端 session（question_bank_db，Redis DB2）
+#
+# 原本作答流程的狀態（主單元、子單元、題目、total_start_time、typing_start_time）只存在 bot 記憶體中的 userState，
+# 後端每一步都要 bot 把上下文再傳回來，bot 或後端重啟後學生正在作答的題目就遺失了。
+# 現在由後端以 Discord ID 記錄 session：選主單元、出題、選題時更新，作答時只需要送出答案文字。
+# session 存在 Redis 並設定 TTL，bot 與後端重啟都不影響。
+#
+# Key:
+#   - session:{discord_id}（hash，TTL 為 QUIZ_SESSION_TTL 秒，每次更新時重設）
+#       - student_id: 學號
+#       - unit / topic: 目前的主單元 / 子單元
+#       - questions / qids: 出題結果（list，經 json.dumps）
+#       - question_index / question / qid: 目前作答中的題目（選題後才有，作答完成後清除）
+#       - selected_at: 選題的時間戳記（取代 bot 傳來的 total_start_time / typing_start_time）
+#       - updated_at: 最後更新時間
+#   - session:awaiting（zset）: 正在作答中的 discord_id，score 為過期時間；bot 重啟後用來恢復「等待答案」狀態
+
+import os
+import json
+import time
+import redis
+
+SESSION_TTL = int(os.getenv("QUIZ_SESSION_TTL", "1800"))
+AWAITING_KEY = "session:awaiting"
+QUESTION_FIELDS = ("question_index", "question", "qid", "selected_at")
+
+session_db = redis.Redis(host='localhost', port=6379, db=2)
+
+
+def session_key(discord_id):
+    return f"session:{discord_id}"
+
+def get_session(discord_id):
+    data = session_db.hgetall(session_key(discord_id))
+    if not data:
+        return None
+    session = {k.decode("utf-8"): v.decode("utf-8") for k, v in data.items()}
+    for field in ("questions", "qids"):
+        session[field] = json.loads(session[field]) if field in session else []
+    for field in ("selected_at", "updated_at"):
+        if field in session:
+            session[field] = float(session[field])
+    if "question_index" in session:
+        session["question_index"] = int(session["question_index"])
+    session["qid"] = session.get("qid") or None
+    return session
+
+def _update(discord_id, mapping, clear=(), reset=False, awaiting=False):
+    key = session_key(discord_id)
+    pipe = session_db.pipeline(transaction=True)
+    if reset:
+        pipe.delete(key)
+    elif clear:
+        pipe.hdel(key, *clear)
+    pipe.hset(key, mapping={**mapping, "updated_at": time.time()})
+    pipe.expire(key, SESSION_TTL)
+    if awaiting:
+        pipe.zadd(AWAITING_KEY, {discord_id: time.time() + SESSION_TTL})
+    else:
+        pipe.zrem(AWAITING_KEY, discord_id)
+    pipe.execute()
+
+# 選擇主單元：開始新的 session
+def start_unit(discord_id, unit, student_id=None):
+    _update(discord_id, {"unit": unit, "student_id": student_id or ""}, reset=True)
+
+# 記錄出題結果（同步出題與非同步出題工作完成時呼叫）
+def set_questions(discord_id, unit, topic, questions, qids):
+    mapping = {"topic": topic, "questions": json.dumps(questions, ensure_ascii=False), "qids": json.dumps(qids)}
+    if unit:
+        mapping["unit"] = unit
+    _update(discord_id, mapping, clear=QUESTION_FIELDS)
+
+# 選擇要作答的題目，回傳 (session, None) 或 (None, 錯誤訊息)
+def select_question(discord_id, index):
+    session = get_session(discord_id)
+    if not session or not session["questions"]:
+        return None, "找不到出題紀錄，請重新選擇子主題"
+    if not 0 <= index < len(session["questions"]):
+        return None, "題號超出範圍"
+
+    qids = session["qids"]
+    mapping = {
+        "question_index": index,
+        "question": session["questions"][index],
+        "qid": (qids[index] if index < len(qids) else None) or "",
+        "selected_at": time.time()
+    }
+    _update(discord_id, mapping, awaiting=True)
+    session.update(mapping)
+    session["qid"] = session["qid"] or None
+    return session, None
+
+# 作答完成：清除目前題目，保留主單元與子單元讓學生繼續下一題
+def finish_question(discord_id):
+    pipe = session_db.pipeline(transaction=True)
+    pipe.hdel(session_key(discord_id), *QUESTION_FIELDS)
+    pipe.zrem(AWAITING_KEY, discord_id)
+    pipe.execute()
+
+def clear_session(discord_id):
+    pipe = session_db.pipeline(transaction=True)
+    pipe.delete(session_key(discord_id))
+    pipe.zrem(AWAITING_KEY, discord_id)
+    pipe.execute()
+
+# 正在作答中（已選題、尚未送出答案）的 discord_id
+def awaiting_discord_ids():
+    now = time.time()
+    pipe = session_db.pipeline(transaction=True)
+    pipe.zremrangebyscore(AWAITING_KEY, "-inf", now)
+    pipe.zrange(AWAITING_KEY, 0, -1)
+    return [did.decode("utf-8") for did in pipe.execute()[1]]
@@ -0,0 +1,30 @@
+# 啟動時間分析
+#
+# 記錄後端啟動各步驟（匯入模組、讀取課程 JSON、連線、載入模型…）的耗時，
+# 啟動完成時以 report() 印出明細，方便發現啟動時間的退步。
+
+import time
+from contextlib import contextmanager
+
+_process_start = time.perf_counter()
+_steps = []  # [(步驟名稱, 秒數), ...]
+
+
+@contextmanager
+def step(name):
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        _steps.append((name, time.perf_counter() - start))
+
+def steps():
+    return list(_steps)
+
+# 印出啟動時間明細
+def report():
+    total = time.perf_counter() - _process_start
+    print(f"⏱️ 後端啟動耗時 {total:.2f}s")
+    for name, seconds in _steps:
+        print(f"   - {name}: {seconds:.2f}s")
+    return total
@@ -0,0 +1,68 @@
+# 測試共用設定
+#
+# - 所有 redis.Redis(...) 連線都改成連到同一個 fakeredis 伺服器（各 db 編號照舊），每個測試前清空；
+#   progress_store / analytics / 登入的 Lua 腳本需要 fakeredis[lua]
+# - 向量模型改用 FakeEncoder（以字元雜湊產生向量），不需要下載 SentenceTransformer 模型
+# - 課程結構使用 tests/data/course_tree.json
+#
+# 執行：pip install -r requirements-dev.txt && python -m pytest（在 Backend 目錄下）
+
+import os
+import sys
+import hashlib
+import numpy as np
+import pytest
+import fakeredis
+import redis
+
+TESTS_DIR = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.dirname(TESTS_DIR))
+
+os.environ.setdefault("OPENAI_API_KEY", "test")
+os.environ["TRACING_ENABLED"] = "0"
+os.environ["GRADE_BATCH_WINDOW_MS"] = "0"
+os.environ["COURSE_TREE_PATH"] = os.path.join(TESTS_DIR, "data", "course_tree.json")
+
+_server = fakeredis.FakeServer()
+
+
+class FakeRedis(fakeredis.FakeRedis):
+    def __init__(self, host="localhost", port=6379, db=0, **kwargs):
+        super().__init__(server=_server, db=db, **kwargs)
+
+
+# 必須在 import 任何後端模組之前替換，模組層級的 redis.Redis(...) 才會連到 fakeredis
+redis.Redis = FakeRedis
+
+
+# 以字元雜湊產生的詞袋向量：相同字元組成的文字向量相同，字元差異越大相似度越低
+class FakeEncoder:
+    dim = 64
+
+    def encode(self, texts, **kwargs):
+        vectors = np.zeros((len(texts), self.dim), dtype=np.float32)
+        for i, text in enumerate(texts):
+            for ch in text:
+                vectors[i, int(hashlib.md5(ch.encode("utf-8")).hexdigest(), 16) % self.dim] += 1
+        return vectors
+
+
+@pytest.fixture(autouse=True)
+def fake_redis():
+    client = FakeRedis()
+    client.flushall()
+    yield client
+    client.flushall()
+
+
+@pytest.fixture(autouse=True)
+def fake_models(monkeypatch):
+    import models
+    for name in (models.UNIT_MODEL_NAME, models.QUERY_MODEL_NAME):
+        monkeypatch.setitem(models._models, models.resolve_model_name(name), FakeEncoder())
+    yield
+
+
+@pytest.fixture
+def db():
+    return lambda n: FakeRedis(db=n)
@@ -0,0 +1,89 @@
+# analytics.py：RECORD_ANSWER_LUA 的遞增彙總與 backfill_analytics 回填
+
+import json
+
+import pytest
+
+import analytics
+
+ANSWERS = [  # (學號, 班級, 題號, 子單元, 題型, 分數)
+    ("s1", "A", "Q1", "二元樹", "選擇題", 8),
+    ("s1", "A", "Q2", "堆積", "簡答題", 4.5),
+    ("s2", "A", "Q1", "二元樹", "選擇題", 10),
+    ("s2", "A", "Q2", "堆積", "簡答題", 3),
+    ("s3", "B", "Q2", "堆積", "簡答題", 9),
+    ("s3", "B", "Q3", "雜湊函數", "", 6.4),
+    ("s4", None, "Q3", "雜湊函數", "", 2),
+]
+
+
+@pytest.fixture
+def answers(db):
+    question_db, student_db = db(2), db(0)
+    for sid, student_class, qid, topic, qa_type, score in ANSWERS:
+        if student_class:
+            student_db.hset(f"user:{sid}", "class", student_class)
+        question_db.hset(f"question:{qid}", mapping={"topic": topic, "qaType": qa_type})
+        question_db.rpush(f"question:{qid}:responses", json.dumps({"student_id": sid, "score": score}))
+        analytics.record_answer(sid, student_class, topic, qa_type, score)
+    return question_db
+
+
+def _snapshot():
+    scopes = [None, "A", "B"]
+    return {
+        "leaderboard": [analytics.leaderboard(c) for c in scopes],
+        "rank": [analytics.student_rank(sid, c) for sid in ("s1", "s2", "s3", "s4") for c in scopes],
+        "weak": [analytics.weak_topics(c) for c in scopes],
+        "hist": [analytics.topic_histogram(t, c) for t in ("二元樹", "堆積", "雜湊函數") for c in scopes],
+        "types": [analytics.question_type_stats(c) for c in scopes],
+    }
+
+
+def test_leaderboard_and_rank(answers):
+    assert [(r["student_id"], r["score"]) for r in analytics.leaderboard()] == [
+        ("s3", 15.4), ("s2", 13.0), ("s1", 12.5), ("s4", 2.0)]
+    assert [r["student_id"] for r in analytics.leaderboard("A", top=1)] == ["s2"]
+    assert analytics.student_rank("s1", "A") == {"student_id": "s1", "rank": 2, "score": 12.5, "students": 2}
+    assert analytics.student_rank("s1", "B")["rank"] is None
+
+
+def test_weak_topics(answers):
+    assert [(t["topic"], t["avg"], t["answers"]) for t in analytics.weak_topics()] == [
+        ("雜湊函數", 4.2, 2), ("堆積", 5.5, 3), ("二元樹", 9.0, 2)]
+    assert [(t["topic"], t["avg"]) for t in analytics.weak_topics("A", top=1)] == [("堆積", 3.75)]
+
+
+def test_histogram_buckets(answers):
+    hist = analytics.topic_histogram("堆積")
+    assert hist["answers"] == 3
+    assert (hist["histogram"]["5"], hist["histogram"]["3"], hist["histogram"]["9"]) == (1, 1, 1)
+    assert analytics.topic_histogram("雜湊函數", "B")["histogram"]["6"] == 1
+    assert analytics.topic_histogram("沒有的子單元")["answers"] == 0
+
+
+def test_question_type_stats_skip_blank_type(answers):
+    assert analytics.question_type_stats() == {
+        "選擇題": {"count": 2, "avg": 9.0},
+        "簡答題": {"count": 3, "avg": 5.5},
+    }
+    assert analytics.question_type_stats("B") == {"簡答題": {"count": 1, "avg": 9.0}}
+
+
+def test_backfill_matches_incremental(answers):
+    incremental = _snapshot()
+    assert analytics.backfill_analytics(dry_run=True) == {
+        "questions": 3, "responses": len(ANSWERS), "students": 4, "scopes": ["all", "class:A", "class:B"]}
+    assert _snapshot() == incremental  # dry-run 不寫入
+
+    analytics.analytics_db.delete("analytics:all:score")
+    analytics.backfill_analytics()
+    assert _snapshot() == incremental
+
+
+def test_backfill_reads_legacy_blob(answers):
+    answers.hset("question:Q9", mapping={"topic": "碰撞處理", "qaType": "選擇題",
+                                         "responses": json.dumps([{"student_id": "s1", "score": 7}])})
+    analytics.backfill_analytics()
+    assert analytics.topic_histogram("碰撞處理")["histogram"]["7"] == 1
+    assert analytics.student_rank("s1")["score"] == 19.5
@@ -0,0 +1,127 @@
+# grading.py：語意評分快取的命中、未命中與 LRU 淘汰
+
+import types
+import pytest
+
+import grading
+import prescreen
+
+QUESTION = "請說明 heap 的特性。"
+
+
+@pytest.fixture
+def llm(monkeypatch):
+    calls = []
+
+    def fake_evaluate(question, answer):
+        calls.append(answer)
+        return 7, f"評語: {answer}"
+
+    monkeypatch.setattr(grading, "evaluate", fake_evaluate)
+    monkeypatch.setattr(prescreen, "PRESCREEN_RELEVANCE_MIN", 0.0)
+    grading.set_grade_cache_enabled(True)
+    yield calls
+    grading.set_grade_cache_enabled(True)
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    now = {"t": 1000.0}
+
+    def tick():
+        now["t"] += 1
+        return now["t"]
+
+    monkeypatch.setattr(grading, "time", types.SimpleNamespace(time=tick))
+    return now
+
+
+def test_miss_then_hit(llm):
+    assert grading.grade_answer(QUESTION, "heap 是完全二元樹", qid="Q1") == (7, "評語: heap 是完全二元樹", False)
+    assert grading.grade_answer(QUESTION, "heap 是完全二元樹", qid="Q1") == (7, "評語: heap 是完全二元樹", True)
+    assert llm == ["heap 是完全二元樹"]
+
+    stats = grading.grade_cache_stats()
+    assert (stats["hits"], stats["misses"], stats["stores"]) == (1, 1, 1)
+    assert stats["hit_rate"] == 0.5
+
+
+def test_normalized_answer_hits_cache(llm):
+    grading.grade_answer(QUESTION, "Heap 是完全二元樹。", qid="Q1")
+    score, _, cached = grading.grade_answer(QUESTION, "  heap 是完全二元樹 ", qid="Q1")
+    assert cached and score == 7
+    assert len(llm) == 1
+
+
+def test_cache_is_per_question(llm):
+    grading.grade_answer(QUESTION, "heap 是完全二元樹", qid="Q1")
+    _, _, cached = grading.grade_answer(QUESTION, "heap 是完全二元樹", qid="Q2")
+    assert not cached
+    assert len(llm) == 2
+
+
+def test_dissimilar_answer_misses(llm):
+    grading.grade_answer(QUESTION, "heap 是完全二元樹", qid="Q1")
+    _, _, cached = grading.grade_answer(QUESTION, "用陣列實作 priority queue", qid="Q1")
+    assert not cached
+    assert len(llm) == 2
+
+
+def test_lru_eviction_keeps_recently_used(llm, clock, monkeypatch, fake_redis):
+    monkeypatch.setattr(grading, "GRADE_CACHE_MAX_PER_QUESTION", 2)
+    a, b, c = "aaaa bbbb", "cccc dddd", "eeee ffff"
+    grading.grade_answer(QUESTION, a, qid="Q1")
+    grading.grade_answer(QUESTION, b, qid="Q1")
+    assert grading.grade_answer(QUESTION, a, qid="Q1")[2]  # 命中後 a 成為最近使用
+    grading.grade_answer(QUESTION, c, qid="Q1")  # 超過上限，淘汰最久未使用的 b
+
+    assert grading.question_bank_db.hlen("grade_cache:Q1") == 2
+    assert grading.question_bank_db.zcard("grade_cache:Q1:lru") == 2
+    assert grading.grade_answer(QUESTION, a, qid="Q1")[2]
+    assert not grading.grade_answer(QUESTION, b, qid="Q1")[2]
+    assert llm == [a, b, c, b]
+
+
+def test_cache_disabled_always_calls_llm(llm):
+    grading.set_grade_cache_enabled(False)
+    grading.grade_answer(QUESTION, "heap 是完全二元樹", qid="Q1")
+    _, _, cached = grading.grade_answer(QUESTION, "heap 是完全二元樹", qid="Q1")
+    assert not cached
+    assert len(llm) == 2
+    assert grading.question_bank_db.exists("grade_cache:Q1") == 0
+
+
+def test_question_text_key_without_qid(llm):
+    grading.grade_answer(QUESTION, "heap 是完全二元樹")
+    _, _, cached = grading.grade_answer(QUESTION + "  ", "heap 是完全二元樹")
+    assert cached
+
+
+def test_parse_failure_retries_then_falls_back(llm, monkeypatch):
+    calls = []
+
+    def unparsable(question, answer):
+        calls.append(answer)
+        return None
+
+    monkeypatch.setattr(grading, "evaluate", grading._evaluate_single)
+    monkeypatch.setattr(grading, "evaluate_answer_gpt4o", unparsable)
+    assert grading.grade_answer(QUESTION, "heap 是完全二元樹", qid="Q1") == (0, "無評語", False)
+    assert len(calls) == grading.GRADE_RETRIES + 1
+    # 失敗的結果不寫入快取，下次仍會重新評分
+    assert grading.grade_answer(QUESTION, "heap 是完全二元樹", qid="Q1") == (0, "無評語", False)
+    assert grading.grade_cache_stats().get("stores", 0) == 0
+
+
+def test_timeout_is_retried(llm, monkeypatch):
+    outcomes = [TimeoutError(), (6, "評語: ok")]
+
+    def flaky(question, answer):
+        outcome = outcomes.pop(0)
+        if isinstance(outcome, Exception):
+            raise outcome
+        return outcome
+
+    monkeypatch.setattr(grading, "evaluate", flaky)
+    assert grading.grade_answer(QUESTION, "heap 是完全二元樹", qid="Q1") == (6, "評語: ok", False)
+    assert grading.grade_answer(QUESTION, "heap 是完全二元樹", qid="Q1")[2]
@@ -0,0 +1,68 @@
+# login_guard.py：行程池損壞時的密碼比對
+
+from concurrent.futures import Future
+from concurrent.futures.process import BrokenProcessPool
+
+import bcrypt
+import pytest
+
+import login_guard
+
+HASHED = bcrypt.hashpw(b"secret", bcrypt.gensalt(rounds=4))
+
+
+class BrokenExecutor:
+    def __init__(self, fail_on_submit):
+        self.fail_on_submit = fail_on_submit
+        self.shut_down = False
+
+    def submit(self, fn, *args):
+        if self.fail_on_submit:
+            raise BrokenProcessPool("A child process terminated abruptly")
+        future = Future()
+        future.set_exception(BrokenProcessPool("A child process terminated abruptly"))
+        return future
+
+    def shutdown(self, wait=True):
+        self.shut_down = True
+
+
+@pytest.fixture
+def pool(monkeypatch):
+    monkeypatch.setattr(login_guard, "BCRYPT_WORKERS", 2)
+    monkeypatch.setitem(login_guard._pool, "executor", None)
+    monkeypatch.setitem(login_guard._pool, "broken", False)
+    monkeypatch.setitem(login_guard._pending, "count", 0)
+    return login_guard._pool
+
+
+def _no_fork():
+    raise AssertionError("行程池損壞後不應重新建立")
+
+
+@pytest.mark.parametrize("fail_on_submit", [True, False])
+def test_broken_pool_falls_back_to_inline(pool, monkeypatch, fail_on_submit):
+    broken = BrokenExecutor(fail_on_submit)
+    pool["executor"] = broken
+
+    assert login_guard._checkpw_in_pool(b"secret", HASHED) is True
+    assert broken.shut_down and pool["executor"] is None and pool["broken"]
+    assert login_guard._pending["count"] == 0
+
+    # 之後的比對都在請求執行緒上執行，不在已有多個執行緒的行程中重新 fork
+    monkeypatch.setattr(login_guard, "_executor", _no_fork)
+    assert login_guard._checkpw_in_pool(b"wrong", HASHED) is False
+    assert login_guard._checkpw_in_pool(b"secret", HASHED) is True
+    assert login_guard._pending["count"] == 0
+
+
+def test_verify_password_survives_broken_pool(pool):
+    pool["executor"] = BrokenExecutor(fail_on_submit=True)
+    assert login_guard.verify_password("s1", "d1", "secret", HASHED) is True
+    assert login_guard.verify_password("s2", "d2", "wrong", HASHED) is False
+
+
+def test_full_queue_reports_busy(pool, monkeypatch):
+    monkeypatch.setattr(login_guard, "BCRYPT_MAX_QUEUE", 1)
+    login_guard._pending["count"] = 1
+    assert login_guard._checkpw_in_pool(b"secret", HASHED) is None
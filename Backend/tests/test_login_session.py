@@ -0,0 +1,102 @@
+# database.py：登入 / 登出 / 延長登入 session 的 Lua 腳本
+
+import bcrypt
+import pytest
+
+import database
+import login_guard
+
+
+@pytest.fixture(autouse=True)
+def students(monkeypatch):
+    monkeypatch.setattr(login_guard, "BCRYPT_WORKERS", 0)
+    hashed = bcrypt.hashpw(b"pw", bcrypt.gensalt(rounds=4))
+    for sid in ("s1", "s2"):
+        database.student_db.hset(f"user:{sid}", mapping={"hash_password": hashed, "name": sid, "class": "A"})
+    with database.app.app_context():
+        yield
+
+
+def _session(discord_id):
+    return database.active_users_db.hget(discord_id, "std_id")
+
+
+def _owner(student_id):
+    return database.active_users_db.get(database.login_student_key(student_id))
+
+
+def test_login_creates_session_with_ttl():
+    ok, message, info = database.login_logic("s1", "pw", "d1")
+    assert ok and info["student_id"] == "s1" and info["class"] == "A"
+    assert _session("d1") == b"s1" and _owner("s1") == b"d1"
+    assert 0 < database.active_users_db.ttl("d1") <= database.LOGIN_SESSION_TTL
+    assert 0 < database.active_users_db.ttl(database.login_student_key("s1")) <= database.LOGIN_SESSION_TTL
+    assert database.student_db.hget("user:s1", "discord_id") == b"d1"
+
+
+def test_wrong_password_does_not_log_in():
+    assert database.login_logic("s1", "nope", "d1")[:2] == (False, "密碼錯誤")
+    assert _session("d1") is None
+
+
+def test_second_discord_account_is_rejected():
+    assert database.login_logic("s1", "pw", "d1")[0]
+    assert database.login_logic("s1", "pw", "d2")[:2] == (False, "帳號已登入中，請先登出")
+    assert _session("d2") is None and _owner("s1") == b"d1"
+
+
+def test_switching_student_releases_previous_one():
+    database.login_logic("s1", "pw", "d1")
+    assert database.login_logic("s2", "pw", "d1")[0]
+    assert _session("d1") == b"s2"
+    assert _owner("s1") is None and _owner("s2") == b"d1"
+
+
+def test_switching_keeps_other_accounts_claim():
+    # d1 的舊 session 指向 s1，但 s1 已由 d2 登入：切換時不能刪掉 d2 的反查 key
+    database.active_users_db.hset("d1", "std_id", "s1")
+    database.active_users_db.set(database.login_student_key("s1"), "d2")
+    assert database.login_logic("s2", "pw", "d1")[0]
+    assert _owner("s1") == b"d2"
+
+
+def test_logout_clears_both_keys():
+    database.login_logic("s1", "pw", "d1")
+    assert database.logout_logic("d1") == (True, "登出成功")
+    assert _session("d1") is None and _owner("s1") is None
+    assert database.logout_logic("d1")[0] is False
+    assert database.login_logic("s1", "pw", "d2")[0]
+
+
+def test_touch_slides_ttl():
+    database.login_logic("s1", "pw", "d1")
+    database.active_users_db.expire("d1", 5)
+    database.active_users_db.expire(database.login_student_key("s1"), 5)
+    assert database.get_active_student_id("d1") == ("s1", None)
+    assert database.active_users_db.ttl("d1") > 5
+    assert database.active_users_db.ttl(database.login_student_key("s1")) > 5
+
+
+def test_touch_backfills_legacy_session():
+    database.active_users_db.hset("d1", "std_id", "s1")  # 舊版沒有 TTL 與反查 key
+    assert database.get_active_student_id("d1") == ("s1", None)
+    assert database.active_users_db.ttl("d1") > 0
+    assert _owner("s1") == b"d1"
+    assert database.get_active_student_id("nobody") == (None, "該 discord_id 未登入")
+
+
+def test_session_changed_between_read_and_script_is_retried(monkeypatch):
+    database.login_logic("s1", "pw", "d1")
+    real_hget = database.active_users_db.hget
+    calls = []
+
+    def racing_hget(key, field):
+        value = real_hget(key, field)
+        if not calls:
+            database.active_users_db.hset("d1", "std_id", "s2")  # 讀取之後、腳本執行之前被改掉
+        calls.append(value)
+        return value
+
+    monkeypatch.setattr(database.active_users_db, "hget", racing_hget)
+    assert database.get_active_student_id("d1") == ("s2", None)
+    assert calls == [b"s1", b"s2"]
@@ -0,0 +1,93 @@
+# mastery.py：以小型手算的 progress 矩陣驗證掌握度估計與推薦
+
+import json
+
+import numpy as np
+import pytest
+
+import database
+import mastery
+
+TOPICS = ["A", "B", "C"]
+TOPIC_INDEX = {t: j for j, t in enumerate(TOPICS)}
+NO_SPREAD = np.zeros((3, 3), dtype=np.float32)
+
+
+def test_empty_progress():
+    attempts, points = mastery.matrices_from_progress([], TOPIC_INDEX)
+    assert attempts.shape == points.shape == (0, 3)
+    estimate, evidence = mastery.estimate_mastery(attempts, points, NO_SPREAD)
+    chosen, review = mastery.recommend(estimate, evidence)
+    assert chosen.shape == review.shape == (0,)
+    assert mastery.weak_topics(estimate, attempts).shape == (0, 3)
+
+
+def test_matrices_skip_missing_invalid_and_unknown_entries():
+    raw = [json.dumps({"A": [3, 8.0], "X": [1, 5]}), None, "not json", json.dumps({"B": [2, 5.5], "C": "bad"})]
+    attempts, points = mastery.matrices_from_progress(raw, TOPIC_INDEX)
+    np.testing.assert_array_equal(attempts, [[3, 0, 0], [0, 0, 0], [0, 0, 0], [0, 2, 0]])
+    np.testing.assert_allclose(points, [[2.4, 0, 0], [0, 0, 0], [0, 0, 0], [0, 1.1, 0]], rtol=1e-6)
+
+
+def test_single_student_moves_to_next_topic():
+    attempts, points = mastery.matrices_from_progress([json.dumps({"A": [3, 8]})], TOPIC_INDEX)
+    estimate, evidence = mastery.estimate_mastery(attempts, points, NO_SPREAD)
+    # (2.4 + 1 × 0.5) / (3 + 1)；沒有證據的子單元為先驗值
+    np.testing.assert_allclose(estimate, [[0.725, 0.5, 0.5]], rtol=1e-6)
+    np.testing.assert_array_equal(evidence, [[3, 0, 0]])
+    chosen, review = mastery.recommend(estimate, evidence)
+    assert chosen.tolist() == [1] and review.tolist() == [False]
+
+
+def test_all_mastered_reviews_weakest():
+    attempts = np.array([[3, 3, 3]], dtype=np.float32)
+    points = np.array([[3, 2.7, 2.9]], dtype=np.float32)
+    estimate, evidence = mastery.estimate_mastery(attempts, points, NO_SPREAD)
+    chosen, review = mastery.recommend(estimate, evidence)
+    assert chosen.tolist() == [1] and review.tolist() == [True]
+
+
+def test_topic_nobody_answered():
+    progress = [json.dumps({"A": [4, 10], "C": [1, 2]}), json.dumps({"A": [1, 6]})]
+    attempts, points = mastery.matrices_from_progress(progress, TOPIC_INDEX)
+    estimate, evidence = mastery.estimate_mastery(attempts, points, NO_SPREAD)
+    assert (estimate[:, 1] == mastery.MASTERY_PRIOR).all() and (evidence[:, 1] == 0).all()
+    # 沒作答過的子單元不列為弱點
+    weak = mastery.weak_topics(estimate, attempts, k=3)
+    assert weak[0, :2].tolist() == [2, 0]
+    assert mastery.recommend(estimate, evidence)[0].tolist() == [1, 0]
+
+
+def test_similar_topic_counts_as_partial_evidence():
+    weights = np.array([[0, 0.8], [0.8, 0]], dtype=np.float32)
+    attempts = np.array([[4, 0]], dtype=np.float32)
+    points = np.array([[4, 0]], dtype=np.float32)
+    estimate, evidence = mastery.estimate_mastery(attempts, points, weights)
+    np.testing.assert_allclose(evidence, [[4, 1.6]], rtol=1e-6)
+    np.testing.assert_allclose(estimate, [[0.9, 2.1 / 2.6]], rtol=1e-6)
+    # 相似子單元的證據不足 MASTERY_MIN_EVIDENCE，仍推薦練習
+    assert mastery.recommend(estimate, evidence)[0].tolist() == [1]
+
+
+def test_similarity_weights():
+    embeddings = np.array([[1, 0], [0.8, 0.6], [0, 1]], dtype=np.float32)
+    weights = mastery.similarity_weights(["A", "B", "C", "D"], ["A", "B", "D"], embeddings)
+    np.testing.assert_allclose(weights, [[0, 0.8, 0, 0], [0.8, 0, 0, 0.6], [0, 0, 0, 0], [0, 0.6, 0, 0]], rtol=1e-6)
+
+
+def test_refresh_recommendations_writes_each_student(monkeypatch):
+    monkeypatch.setattr(mastery, "_course_topics", lambda: (TOPICS, {t: "U" for t in TOPICS}))
+    monkeypatch.setattr(mastery, "similarity_weights", lambda topics: NO_SPREAD)
+    database.student_db.sadd(database.STUDENT_INDEX, "s1", "s2")
+    database.student_db.hset("user:s1", "progress", json.dumps({"A": [3, 8], "C": [1, 3]}))
+
+    assert mastery.refresh_recommendations(dry_run=True)["students"] == 2
+    assert mastery.get_recommendation("s1") is None
+
+    stats = mastery.refresh_recommendations()
+    assert (stats["next"], stats["review"]) == (2, 0)
+    s1 = mastery.get_recommendation("s1")
+    assert (s1["topic"], s1["unit"], s1["reason"], s1["weak_topics"]) == ("B", "U", "next", ["C", "A"])
+    assert s1["mastery"] == pytest.approx(0.5)
+    s2 = mastery.get_recommendation("s2")
+    assert (s2["topic"], s2["weak_topics"]) == ("A", [])
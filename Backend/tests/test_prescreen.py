@@ -0,0 +1,91 @@
+# prescreen.py：本機預先篩選的判斷，以及與 grading.grade_answer 的整合
+
+import pytest
+
+import grading
+import prescreen
+
+QUESTION = "請說明 heap 的特性，並比較 min heap 與 max heap 的差異。"
+
+
+@pytest.fixture
+def llm(monkeypatch):
+    calls = []
+
+    def fake_evaluate(question, answer):
+        calls.append(answer)
+        return 8, "評語: ok"
+
+    monkeypatch.setattr(grading, "evaluate", fake_evaluate)
+    grading.set_grade_cache_enabled(True)
+    return calls
+
+
+@pytest.mark.parametrize("answer, reason", [
+    ("", "empty"),
+    ("   ", "empty"),
+    ("？！。…", "empty"),
+    ("不知道", "refusal"),
+    ("我不會。", "refusal"),
+    ("idk", "refusal"),
+    ("???", "empty"),
+    ("ㅋㅋㅋㅋㅋㅋ", "gibberish"),
+    ("哈" * 30, "gibberish"),
+])
+def test_screen_text_rejects(answer, reason):
+    assert prescreen.screen_text(answer) == reason
+
+
+@pytest.mark.parametrize("answer", ["B", "3", "O(n log n)", "min heap 的根節點是最小值", "heap 是完全二元樹"])
+def test_screen_text_passes_real_answers(answer):
+    assert prescreen.screen_text(answer) is None
+
+
+def test_verdict_is_zero_with_fixed_feedback():
+    score, feedback = prescreen.verdict("refusal")
+    assert score == 0 and "扣分原因" in feedback
+
+
+def test_relevance_is_off_by_default():
+    assert prescreen.PRESCREEN_RELEVANCE_MIN == 0
+    assert not prescreen.relevance_enabled()
+
+
+def test_short_correct_answer_reaches_llm_even_with_relevance_on(llm, monkeypatch):
+    monkeypatch.setattr(prescreen, "PRESCREEN_RELEVANCE_MIN", 0.99)
+    assert grading.grade_answer("下列何者的時間複雜度最低？(A) O(n^2) (B) O(n log n)", "B", qid="Q1") == (8, "評語: ok", False)
+    assert grading.grade_answer(QUESTION, "O(n log n)", qid="Q2")[0] == 8
+    assert llm == ["B", "O(n log n)"]
+
+
+def test_long_off_topic_answer_is_screened_when_enabled(llm, monkeypatch):
+    monkeypatch.setattr(prescreen, "PRESCREEN_RELEVANCE_MIN", 0.99)
+    score, feedback, cached = grading.grade_answer(QUESTION, "今天天氣很好我們去公園散步然後吃冰淇淋吧好不好呢", qid="Q1")
+    assert (score, cached) == (0, False)
+    assert feedback == prescreen.FEEDBACK["off_topic"]
+    assert llm == []
+
+
+def test_refusal_is_screened_without_llm(llm):
+    assert grading.grade_answer(QUESTION, "不知道", qid="Q1")[0] == 0
+    assert llm == []
+    stats = prescreen.prescreen_stats()
+    assert (stats["checked"], stats["saved"], stats["refusal"]) == (1, 1, 1)
+
+
+# 回歸測試：關閉預先篩選時，純文字檢查會攔下的答案仍要能正常查詢與寫入評分快取
+@pytest.mark.parametrize("answer", ["不知道", "???", ""])
+def test_prescreen_disabled_still_uses_cache(llm, monkeypatch, answer):
+    monkeypatch.setattr(prescreen, "PRESCREEN_ENABLED", False)
+    grading.grade_answer(QUESTION, "heap 是完全二元樹", qid="Q1")  # 快取中已有一筆
+
+    assert grading.grade_answer(QUESTION, answer, qid="Q1") == (8, "評語: ok", False)
+    grading.grade_answer(QUESTION, answer, qid="Q1")
+    assert grading.grade_answer(QUESTION, "heap 是完全二元樹", qid="Q1")[2]  # 後續答案不受影響
+
+
+def test_prescreen_disabled_with_empty_cache(llm, monkeypatch):
+    monkeypatch.setattr(prescreen, "PRESCREEN_ENABLED", False)
+    grading.grade_answer(QUESTION, "不知道", qid="Q1")
+    grading.grade_answer(QUESTION, "heap 是完全二元樹", qid="Q1")
+    assert grading.grade_answer(QUESTION, "heap 是完全二元樹", qid="Q1")[2]
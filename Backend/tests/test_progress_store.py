@@ -0,0 +1,105 @@
+# progress_store.py：一次作答在 DB0 / DB1 / DB2 的 Lua 腳本更新
+
+import json
+
+import pytest
+import redis
+
+import progress_store
+
+UNIT = "第一單元 樹"
+TOPICS = ["二元樹", "堆積", "二元搜尋樹"]
+
+
+@pytest.fixture
+def dbs(db):
+    question_db, subtopic_db, student_db = db(2), db(1), db(0)
+    question_db.hset("question:Q1", mapping={"topic": "二元樹", "unit": UNIT, "qaType": "選擇題", "accuracy": 0})
+    question_db.hset("question:Q2", mapping={"topic": "堆積", "unit": UNIT})
+    for i, topic in enumerate(TOPICS):
+        subtopic_db.hset(f"subtopic:{topic}", mapping={"unit": UNIT, "answered_count": 0, "accuracy": 0})
+        subtopic_db.zadd(f"index:unit:{UNIT}", {topic: i})
+    student_db.hset("user:s1", mapping={"class": "A", "progress": json.dumps({"二元樹": [0, 0.0]}),
+                                        "completed_topics": "[]", "unit_progress": "{}", "completed_units": "[]"})
+    return question_db, subtopic_db, student_db
+
+
+def _record(dbs, qid, score, student_id="s1"):
+    record = json.dumps({"student_id": student_id, "score": score})
+    return progress_store.record_response(*dbs, qid, student_id, record, score >= 6, score)
+
+
+def _student(student_db, field):
+    return json.loads(student_db.hget("user:s1", field))
+
+
+def test_first_answer_updates_every_db(dbs):
+    question_db, subtopic_db, student_db = dbs
+    result = _record(dbs, "Q1", 8)
+    assert result == {"topic": "二元樹", "unit": UNIT, "qa_type": "選擇題", "class": "A",
+                      "attempts": 1, "avg": 8.0, "legacy_responses": False}
+
+    assert question_db.lrange("question:Q1:responses", 0, -1) == [json.dumps({"student_id": "s1", "score": 8}).encode()]
+    assert question_db.hget("question:Q1", "answered_count") == b"1"
+    assert float(question_db.hget("question:Q1", "accuracy")) == 80.0
+    assert subtopic_db.hget("subtopic:二元樹", "answered_count") == b"1"
+    assert float(subtopic_db.hget("subtopic:二元樹", "accuracy")) == 80.0
+    assert _student(student_db, "progress")["二元樹"] == [1, 8]
+    assert _student(student_db, "completed_topics") == []
+
+
+def test_running_averages(dbs):
+    question_db, subtopic_db, student_db = dbs
+    _record(dbs, "Q1", 8)
+    result = _record(dbs, "Q1", 5)
+    assert (result["attempts"], result["avg"]) == (2, 6.5)
+    # 答錯時題目正確率不變（與原本 add_response_to_question 相同）；子單元正確率計入每一次分數
+    assert float(question_db.hget("question:Q1", "accuracy")) == 80.0
+    assert question_db.hget("question:Q1", "answered_count") == b"2"
+    assert float(subtopic_db.hget("subtopic:二元樹", "accuracy")) == 65.0
+
+
+def test_completion_advances_to_next_topic(dbs):
+    _, _, student_db = dbs
+    for score in (8, 7, 9):
+        result = _record(dbs, "Q1", score)
+    assert (result["attempts"], result["avg"]) == (3, 8.0)
+    assert _student(student_db, "completed_topics") == ["二元樹"]
+    assert _student(student_db, "progress")["堆積"] == [0, 0]
+    assert _student(student_db, "unit_progress")[UNIT] == pytest.approx(33.33)
+    assert _student(student_db, "completed_units") == []
+
+
+def test_low_average_does_not_complete(dbs):
+    _, _, student_db = dbs
+    for score in (8, 4, 6):
+        _record(dbs, "Q1", score)
+    assert _student(student_db, "completed_topics") == []
+    assert "堆積" not in _student(student_db, "progress")
+    assert _student(student_db, "unit_progress")[UNIT] == 0
+
+
+def test_completing_every_topic_completes_unit(dbs):
+    question_db, _, student_db = dbs
+    question_db.hset("question:Q3", mapping={"topic": "二元搜尋樹", "unit": UNIT})
+    for qid in ("Q1", "Q2", "Q3"):
+        for _ in range(3):
+            _record(dbs, qid, 10)
+    assert _student(student_db, "completed_topics") == TOPICS
+    assert _student(student_db, "unit_progress")[UNIT] == 100
+    assert _student(student_db, "completed_units") == [UNIT]
+
+
+def test_missing_fields_and_legacy_flag(dbs):
+    question_db, _, student_db = dbs
+    question_db.hset("question:Q2", "responses", "[]")
+    student_db.hset("user:s2", "name", "新同學")
+    result = _record(dbs, "Q2", 3, student_id="s2")
+    assert result["legacy_responses"] is True
+    assert result["qa_type"] is None and result["class"] is None
+    assert json.loads(student_db.hget("user:s2", "progress")) == {"堆積": [1, 3]}
+
+
+def test_unknown_question_is_an_error(dbs):
+    with pytest.raises(redis.ResponseError, match="question not found"):
+        _record(dbs, "nope", 5)
@@ -0,0 +1,46 @@
+# question_pool.py：補題鎖只由持有者釋放
+
+import question_pool
+import vector_store
+
+TOPIC = "堆積"
+
+
+def _with_topic(db):
+    db(1).hset(vector_store.INDEX_SUBTOPIC_UNIT, TOPIC, "第一單元 樹")
+
+
+def test_release_only_deletes_own_lock():
+    key = question_pool.refill_lock_key(TOPIC)
+    question_pool.question_bank_db.set(key, "other-worker")
+    assert not question_pool.release_refill_lock(TOPIC, "mine")
+    assert question_pool.question_bank_db.get(key) == b"other-worker"
+    assert question_pool.release_refill_lock(TOPIC, "other-worker")
+    assert question_pool.question_bank_db.get(key) is None
+
+
+def test_slow_refill_keeps_lock_taken_over_by_another_worker(db, monkeypatch):
+    _with_topic(db)
+    key = question_pool.refill_lock_key(TOPIC)
+
+    def slow_generate(topic, unit, num_questions, source, student_id=None):
+        # 補題超過 TTL：鎖已過期並被另一個 worker 取得
+        question_pool.question_bank_db.set(key, "other-worker")
+        return []
+
+    monkeypatch.setattr(question_pool, "_generate_and_store", slow_generate)
+    assert question_pool.refill_pool(TOPIC) == 0
+    assert question_pool.question_bank_db.get(key) == b"other-worker"
+
+
+def test_refill_releases_its_own_lock(db, monkeypatch):
+    _with_topic(db)
+    monkeypatch.setattr(question_pool, "POOL_SIZE", 3)
+    monkeypatch.setattr(question_pool, "_generate_and_store",
+                        lambda topic, unit, n, source, student_id=None: [(f"Q{i}", "q") for i in range(n)])
+    assert question_pool.refill_pool(TOPIC) == 3
+    assert question_pool.question_bank_db.get(question_pool.refill_lock_key(TOPIC)) is None
+    # 鎖被其他 worker 持有時不補題
+    question_pool.question_bank_db.set(question_pool.refill_lock_key(TOPIC), "other-worker")
+    question_pool.question_bank_db.delete(question_pool.pool_key(TOPIC))
+    assert question_pool.refill_pool(TOPIC) == 0
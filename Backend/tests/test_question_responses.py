@@ -0,0 +1,38 @@
+# database.py：作答紀錄清單與舊格式 responses 欄位
+
+import json
+
+import database
+
+
+def _seed_legacy(qid, legacy, new):
+    database.question_bank_db.hset(f"question:{qid}", mapping={"question": "q", "responses": json.dumps(legacy)})
+    for record in new:
+        database.question_bank_db.rpush(database.responses_key(qid), database._encode_response(record))
+
+
+def test_list_only():
+    _seed_legacy("Q1", [], [])
+    database.question_bank_db.hdel("question:Q1", "responses")
+    database.question_bank_db.rpush(database.responses_key("Q1"), *[json.dumps({"n": i}) for i in range(3)])
+    assert database.get_question_responses("Q1", 1, 5) == ([{"n": 1}, {"n": 2}], 3)
+
+
+def test_legacy_blob_is_merged_with_new_responses():
+    _seed_legacy("Q1", [{"n": 0}, {"n": 1}], [{"n": 2}, {"n": 3}])
+    records, total = database.get_question_responses("Q1")
+    assert total == 4
+    assert records == [{"n": 0}, {"n": 1}, {"n": 2}, {"n": 3}]
+
+
+def test_pagination_across_legacy_boundary():
+    _seed_legacy("Q1", [{"n": 0}, {"n": 1}], [{"n": 2}, {"n": 3}, {"n": 4}])
+    assert database.get_question_responses("Q1", 1, 2) == ([{"n": 1}, {"n": 2}], 5)
+    assert database.get_question_responses("Q1", 3, 10) == ([{"n": 3}, {"n": 4}], 5)
+
+
+def test_migration_keeps_order():
+    _seed_legacy("Q1", [{"n": 0}, {"n": 1}], [{"n": 2}])
+    assert database.migrate_response_blob("Q1") == 2
+    assert database.question_bank_db.hget("question:Q1", "responses") is None
+    assert database.get_question_responses("Q1") == ([{"n": 0}, {"n": 1}, {"n": 2}], 3)
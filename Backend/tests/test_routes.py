@@ -0,0 +1,31 @@
+# main.py：需要登入的 API 在未登入時回傳 401
+
+import pytest
+
+import main
+
+
+@pytest.fixture
+def client():
+    return main.app.test_client()
+
+
+def test_answer_requires_login(client, monkeypatch):
+    graded = []
+    monkeypatch.setattr(main, "grade_answer", lambda *args, **kwargs: graded.append(args))
+    response = client.post("/api/student/d1/answer", json={"answer": "heap 是完全二元樹", "question": "請說明 heap。"})
+    assert response.status_code == 401
+    assert response.get_json() == {"error": "該 discord_id 未登入"}
+    assert graded == []
+    assert main.question_bank_db.keys("question:*") == []
+
+
+@pytest.mark.parametrize("path, body", [
+    ("/api/student/d1/session/unit", {"unit": "第一單元 樹"}),
+    ("/api/student/d1/questions", {"topic": "堆積"}),
+    ("/api/student/d1/questions/jobs", {"topic": "堆積"}),
+])
+def test_quiz_routes_require_login(client, path, body):
+    response = client.post(path, json=body)
+    assert response.status_code == 401
+    assert main.quiz_session.get_session("d1") is None
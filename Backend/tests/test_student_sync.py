@@ -0,0 +1,48 @@
+# database.py：MongoDB -> Redis 學生資料同步
+
+import bcrypt
+import pytest
+from bson.binary import Binary
+
+import database
+import login_guard
+
+
+class StudentList:
+    def __init__(self, students):
+        self.students = students
+
+    def find(self, query, projection, batch_size=None):
+        return iter([{k: v for k, v in s.items() if k in projection} for s in self.students])
+
+
+@pytest.fixture(autouse=True)
+def app_context(monkeypatch):
+    monkeypatch.setattr(login_guard, "BCRYPT_WORKERS", 0)
+    with database.app.app_context():
+        yield
+
+
+@pytest.mark.parametrize("wrap", [bytes, Binary, lambda h: h.decode("utf-8")])
+def test_synced_password_hash_can_log_in(monkeypatch, wrap):
+    hashed = bcrypt.hashpw(b"pw", bcrypt.gensalt(rounds=4))
+    monkeypatch.setattr(database, "student_list", StudentList([
+        {"student_id": 1001, "name": "王小明", "email": "a@example.com", "class": "A", "hashed_password": wrap(hashed)}]))
+
+    assert database.sync_mongo_to_redis()["created"] == 1
+    assert database.student_db.hget("user:1001", "hash_password") == hashed
+    ok, _, info = database.login_logic("1001", "pw", "d1")
+    assert ok and info["name"] == "王小明"
+
+
+def test_resync_keeps_state_and_skips_unchanged(monkeypatch):
+    students = [{"student_id": "s1", "name": "甲", "email": None, "class": 3, "hashed_password": b"$2b$04$x"}]
+    monkeypatch.setattr(database, "student_list", StudentList(students))
+    database.sync_mongo_to_redis()
+    assert database.student_db.hmget("user:s1", "email", "class") == [b"", b"3"]
+    database.student_db.hset("user:s1", "progress", '{"二元樹": [1, 8]}')
+
+    assert database.sync_mongo_to_redis()["unchanged"] == 1
+    students[0]["name"] = "乙"
+    assert database.sync_mongo_to_redis()["updated"] == 1
+    assert database.student_db.hmget("user:s1", "name", "progress") == ["乙".encode(), '{"二元樹": [1, 8]}'.encode()]
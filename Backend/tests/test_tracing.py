@@ -0,0 +1,39 @@
+# tracing.py：背景寫入 metrics 的執行緒不會因例外而停止
+
+import json
+import time
+import types
+
+import pytest
+
+import tracing
+
+
+class StopLoop(Exception):
+    pass
+
+
+def test_flush_loop_survives_failing_gauge(monkeypatch):
+    reads = []
+
+    def flaky_gauge():
+        reads.append(1)
+        if len(reads) == 1:
+            raise ZeroDivisionError("gauge 讀值失敗")
+        return 3
+
+    monkeypatch.setitem(tracing._gauges, "flaky", ("測試用", flaky_gauge))
+    sleeps = []
+
+    def sleep(seconds):
+        sleeps.append(seconds)
+        if len(sleeps) > 2:
+            raise StopLoop()
+
+    monkeypatch.setattr(tracing, "time", types.SimpleNamespace(sleep=sleep, time=time.time))
+    with pytest.raises(StopLoop):
+        tracing._flush_loop()
+
+    assert len(reads) == 2  # 第一次失敗後仍繼續寫入
+    snapshot = json.loads(tracing.metrics_db.get(tracing._instance_key()))
+    assert snapshot["gauges"]["flaky"] == 3
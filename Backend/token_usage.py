@@ -0,0 +1,152 @@
+# GPT token 用量與費用統計（question_bank_db，Redis DB2）
+#
+# 每一次 GPT 呼叫（question_gpt4o._chat_completion）都會記錄 prompt / completion token 數：
+# 優先使用 API 回傳的 usage 欄位，缺少時以 tiktoken 估算（estimated_calls 會加一）。
+# 用量依「呼叫類型」、「學生」、「子單元」與「日期」累計；學生與子單元由呼叫端以 attributed_to() 指定，
+# 一次呼叫屬於多位學生時（微批次評分）平均分攤。
+#
+# Key（hash 欄位皆為 prompt_tokens / completion_tokens / tokens / calls / cost_usd）:
+#   - usage:total: 全部累計（另有 estimated_calls）
+#   - usage:type:{呼叫類型}: generate / evaluate / evaluate_batch
+#   - usage:student:{學號}、usage:topic:{子單元名稱}: 依學生、子單元累計
+#   - usage:day:{YYYYMMDD}、usage:student:{學號}:day:{YYYYMMDD}: 每日累計（預算用，保留 USAGE_DAY_TTL 秒）
+#   - usage:types（set）、usage:students / usage:topics（zset，score 為累計 token）: 報表索引
+#
+# 預算（0 表示不限制）：
+#   - TOKEN_BUDGET_DAILY: 全系統每日 token 上限
+#   - TOKEN_BUDGET_STUDENT_DAILY: 每位學生每日 token 上限
+# 超過預算時 question_pool 不再呼叫 GPT 出題，改從題池與已生成的題目中取題。
+
+import os
+import time
+import traceback
+import contextvars
+from contextlib import contextmanager
+import redis
+
+# gpt-4o-mini 每百萬 token 的美元價格
+PROMPT_PRICE_PER_M = float(os.getenv("OPENAI_PROMPT_PRICE", "0.15"))
+COMPLETION_PRICE_PER_M = float(os.getenv("OPENAI_COMPLETION_PRICE", "0.60"))
+TOKEN_BUDGET_DAILY = int(os.getenv("TOKEN_BUDGET_DAILY", "0"))
+TOKEN_BUDGET_STUDENT_DAILY = int(os.getenv("TOKEN_BUDGET_STUDENT_DAILY", "0"))
+USAGE_DAY_TTL = 60 * 60 * 24 * 40
+
+usage_db = redis.Redis(host='localhost', port=6379, db=2)
+
+_owners = contextvars.ContextVar("usage_owners", default=None)  # [{"student_id", "topic"}, ...]
+
+
+def _today():
+    return time.strftime("%Y%m%d")
+
+def student_day_key(student_id, day=None):
+    return f"usage:student:{student_id}:day:{day or _today()}"
+
+# 指定區塊內 GPT 呼叫的歸屬（學生、子單元），多位時平均分攤
+@contextmanager
+def attributed_to(owners):
+    token = _owners.set([o for o in owners if o] or None)
+    try:
+        yield
+    finally:
+        _owners.reset(token)
+
+def attribution(student_id=None, topic=None):
+    return attributed_to([{"student_id": student_id, "topic": topic}])
+
+def current_owners():
+    return _owners.get()
+
+def cost_usd(prompt_tokens, completion_tokens):
+    return (prompt_tokens * PROMPT_PRICE_PER_M + completion_tokens * COMPLETION_PRICE_PER_M) / 1_000_000
+
+def _add(pipe, key, prompt_tokens, completion_tokens, calls, ttl=None):
+    pipe.hincrby(key, "prompt_tokens", prompt_tokens)
+    pipe.hincrby(key, "completion_tokens", completion_tokens)
+    pipe.hincrby(key, "tokens", prompt_tokens + completion_tokens)
+    pipe.hincrbyfloat(key, "calls", calls)
+    pipe.hincrbyfloat(key, "cost_usd", cost_usd(prompt_tokens, completion_tokens))
+    if ttl:
+        pipe.expire(key, ttl)
+
+# 記錄一次 GPT 呼叫的用量（一次往返）；統計失敗不影響主流程
+def record(call_type, prompt_tokens, completion_tokens, estimated=False):
+    owners = _owners.get() or []
+    day = _today()
+    try:
+        pipe = usage_db.pipeline(transaction=False)
+        _add(pipe, "usage:total", prompt_tokens, completion_tokens, 1)
+        if estimated:
+            pipe.hincrby("usage:total", "estimated_calls", 1)
+        _add(pipe, f"usage:type:{call_type}", prompt_tokens, completion_tokens, 1)
+        pipe.sadd("usage:types", call_type)
+        _add(pipe, f"usage:day:{day}", prompt_tokens, completion_tokens, 1, USAGE_DAY_TTL)
+
+        share = 1 / len(owners) if owners else 0
+        prompt_share = round(prompt_tokens * share)
+        completion_share = round(completion_tokens * share)
+        for owner in owners:
+            student_id, topic = owner.get("student_id"), owner.get("topic")
+            if student_id:
+                _add(pipe, f"usage:student:{student_id}", prompt_share, completion_share, share)
+                _add(pipe, student_day_key(student_id, day), prompt_share, completion_share, share, USAGE_DAY_TTL)
+                pipe.zincrby("usage:students", prompt_share + completion_share, student_id)
+            if topic:
+                _add(pipe, f"usage:topic:{topic}", prompt_share, completion_share, share)
+                pipe.zincrby("usage:topics", prompt_share + completion_share, topic)
+        pipe.execute()
+    except redis.RedisError:
+        traceback.print_exc()
+
+# 是否已超過每日預算（全系統或該學生）
+def over_budget(student_id=None):
+    check_student = bool(TOKEN_BUDGET_STUDENT_DAILY and student_id)
+    if not TOKEN_BUDGET_DAILY and not check_student:
+        return False
+    pipe = usage_db.pipeline(transaction=False)
+    pipe.hget(f"usage:day:{_today()}", "tokens")
+    pipe.hget(student_day_key(student_id), "tokens")
+    total, student = [int(v or 0) for v in pipe.execute()]
+    if TOKEN_BUDGET_DAILY and total >= TOKEN_BUDGET_DAILY:
+        return True
+    return check_student and student >= TOKEN_BUDGET_STUDENT_DAILY
+
+def _decode(data):
+    result = {}
+    for k, v in data.items():
+        value = float(v)
+        result[k.decode("utf-8")] = int(value) if k in (b"prompt_tokens", b"completion_tokens", b"tokens", b"estimated_calls") else round(value, 6)
+    return result
+
+def _ranking(items):
+    return [{"name": name.decode("utf-8"), "tokens": int(score)} for name, score in items]
+
+# 用量報表：總計、今日、各呼叫類型、用量最多的學生與子單元
+def usage_report(top=10):
+    call_types = sorted(t.decode("utf-8") for t in usage_db.smembers("usage:types"))
+    pipe = usage_db.pipeline(transaction=False)
+    pipe.hgetall("usage:total")
+    pipe.hgetall(f"usage:day:{_today()}")
+    for call_type in call_types:
+        pipe.hgetall(f"usage:type:{call_type}")
+    pipe.zrevrange("usage:students", 0, top - 1, withscores=True)
+    pipe.zrevrange("usage:topics", 0, top - 1, withscores=True)
+    results = pipe.execute()
+
+    return {
+        "total": _decode(results[0]),
+        "today": _decode(results[1]),
+        "by_type": {t: _decode(r) for t, r in zip(call_types, results[2:2 + len(call_types)])},
+        "top_students": _ranking(results[-2]),
+        "top_topics": _ranking(results[-1]),
+        "budget": {"daily": TOKEN_BUDGET_DAILY, "student_daily": TOKEN_BUDGET_STUDENT_DAILY}
+    }
+
+# 單一學生的用量：累計與今日
+def student_usage(student_id):
+    pipe = usage_db.pipeline(transaction=False)
+    pipe.hgetall(f"usage:student:{student_id}")
+    pipe.hgetall(student_day_key(student_id))
+    total, today = pipe.execute()
+    return {"student_id": student_id, "total": _decode(total), "today": _decode(today),
+            "over_budget": over_budget(student_id)}
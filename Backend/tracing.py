@@ -0,0 +1,270 @@
+# 請求延遲追蹤與 /metrics
+#
+# /api/student/<did>/answer 變慢時，過去無法判斷時間花在 GPT 評分、作答紀錄的 Redis 指令，還是登入時的 bcrypt。
+# 這裡在 Flask app 上加計時 middleware，並在下列位置記錄區段（span）耗時：
+#   - redis.{指令}：每一個 Redis 指令（redis.Redis.execute_command），pipeline 整批記為 redis.pipeline
+#   - openai.{呼叫類型}：每一次 GPT 呼叫（question_gpt4o）
+#   - embedding.encode：每一次 SentenceTransformer.encode（models.encode）
+#   - bcrypt.checkpw：登入時的密碼比對
+#
+# 輸出：
+#   - GET /metrics：Prometheus 文字格式，每個路由與每種區段的延遲 histogram，以及 p50/p95/p99
+#   - 回應標頭 Server-Timing：該次請求各區段的耗時（瀏覽器開發者工具可直接顯示）
+#   - 慢請求紀錄：超過 SLOW_REQUEST_MS 毫秒的請求印出各區段耗時
+#   - 其他模組以 register_gauge() 登記的即時數值（如 bcrypt 佇列深度），各 worker 的值相加後輸出
+#
+# gunicorn 多個 worker 各自累計，每 METRICS_FLUSH_INTERVAL 秒把累計值寫入 Redis（DB2），
+# /metrics 會合併所有仍在執行中的 worker；worker 重啟後其累計值會歸零（Prometheus 視為 counter reset）。
+#
+# Key（question_bank_db，Redis DB2）:
+#   - metrics:{主機}:{pid}（str，TTL 為 METRICS_TTL 秒）: 該 worker 的累計值與 gauge（json）
+#   - metrics:instances（zset）: worker key，score 為最後寫入時間
+
+import os
+import json
+import time
+import bisect
+import socket
+import threading
+import traceback
+import contextvars
+from contextlib import contextmanager
+import redis
+from flask import g, request, Response
+
+TRACING_ENABLED = os.getenv("TRACING_ENABLED", "1") != "0"
+SLOW_REQUEST_MS = float(os.getenv("SLOW_REQUEST_MS", "2000"))
+METRICS_FLUSH_INTERVAL = float(os.getenv("METRICS_FLUSH_INTERVAL", "10"))
+METRICS_TTL = 120
+METRICS_INSTANCES_KEY = "metrics:instances"
+METRIC_PREFIX = "dsbot"
+QUANTILES = (0.5, 0.95, 0.99)
+# histogram 的上界（秒），最後一格為 +Inf
+BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 20, 30, 60)
+
+metrics_db = redis.Redis(host='localhost', port=6379, db=2)
+
+_series = {}  # (metric, labels) -> [各 bucket 次數(非累計), 總秒數, 次數]
+_series_lock = threading.Lock()
+_request_spans = contextvars.ContextVar("request_spans", default=None)  # 目前請求的 span 名稱 -> [總秒數, 次數]
+_suppressed = contextvars.ContextVar("tracing_suppressed", default=False)  # 寫入 metrics 本身的 Redis 指令不列入
+_gauges = {}  # gauge 名稱 -> (說明, 回傳目前數值的函式)
+_flusher = {"thread": None}
+
+
+def observe(metric, labels, seconds):
+    key = (metric, tuple(sorted(labels.items())))
+    index = bisect.bisect_left(BUCKETS, seconds)
+    with _series_lock:
+        series = _series.get(key)
+        if series is None:
+            series = _series[key] = [[0] * (len(BUCKETS) + 1), 0.0, 0]
+        series[0][index] += 1
+        series[1] += seconds
+        series[2] += 1
+
+def record_span(name, seconds):
+    if not TRACING_ENABLED or _suppressed.get():
+        return
+    observe("span", {"span": name}, seconds)
+    spans = _request_spans.get()
+    if spans is not None:
+        total = spans.setdefault(name, [0.0, 0])
+        total[0] += seconds
+        total[1] += 1
+
+# 記錄一段程式的耗時
+@contextmanager
+def span(name):
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        record_span(name, time.perf_counter() - start)
+
+# 登記一個 gauge，/metrics 輸出為 {METRIC_PREFIX}_{name}
+def register_gauge(name, help_text, read):
+    _gauges[name] = (help_text, read)
+
+@contextmanager
+def suppressed():
+    token = _suppressed.set(True)
+    try:
+        yield
+    finally:
+        _suppressed.reset(token)
+
+# 替所有 Redis client 的指令加上計時（類別層級，只需呼叫一次）
+def instrument_redis():
+    if getattr(redis.Redis.execute_command, "_traced", False):
+        return
+    execute_command = redis.Redis.execute_command
+    pipeline_execute = redis.client.Pipeline.execute
+
+    def traced_execute_command(self, *args, **options):
+        start = time.perf_counter()
+        try:
+            return execute_command(self, *args, **options)
+        finally:
+            record_span(f"redis.{str(args[0]).split(' ')[0].upper()}", time.perf_counter() - start)
+
+    def traced_pipeline_execute(self, *args, **kwargs):
+        start = time.perf_counter()
+        try:
+            return pipeline_execute(self, *args, **kwargs)
+        finally:
+            record_span("redis.pipeline", time.perf_counter() - start)
+
+    traced_execute_command._traced = True
+    redis.Redis.execute_command = traced_execute_command
+    redis.client.Pipeline.execute = traced_pipeline_execute
+
+
+def _route_label():
+    return request.url_rule.rule if request.url_rule else "unmatched"
+
+def _before_request():
+    g.trace_start = time.perf_counter()
+    g.trace_token = _request_spans.set({})
+
+def _after_request(response):
+    start = g.pop("trace_start", None)
+    if start is None:
+        return response
+    elapsed = time.perf_counter() - start
+    route = _route_label()
+    observe("request", {"route": route, "method": request.method}, elapsed)
+
+    spans = sorted((_request_spans.get() or {}).items(), key=lambda item: -item[1][0])
+    timing = [f"{name};dur={total * 1000:.1f}" for name, (total, _) in spans[:10]]
+    response.headers["Server-Timing"] = ", ".join(timing + [f"total;dur={elapsed * 1000:.1f}"])
+
+    if elapsed * 1000 >= SLOW_REQUEST_MS:
+        breakdown = "、".join(f"{name} {total * 1000:.0f} ms x{count}" for name, (total, count) in spans[:8])
+        print(f"🐢 慢請求 {request.method} {route} {elapsed * 1000:.0f} ms（{breakdown or '無區段紀錄'}）")
+    return response
+
+def _teardown_request(exc):
+    token = g.pop("trace_token", None)
+    if token is not None:
+        _request_spans.reset(token)
+
+# 在 Flask app 上註冊計時 middleware 與 /metrics
+def init_app(app):
+    if not TRACING_ENABLED:
+        return
+    instrument_redis()
+    app.before_request(_before_request)
+    app.after_request(_after_request)
+    app.teardown_request(_teardown_request)
+    app.add_url_rule("/metrics", "metrics", metrics_view, methods=["GET"])
+    start_flusher()
+
+
+def _instance_key():
+    return f"metrics:{socket.gethostname()}:{os.getpid()}"
+
+def _snapshot():
+    with _series_lock:
+        series = [[metric, list(labels), buckets[:], total, count]
+                  for (metric, labels), (buckets, total, count) in _series.items()]
+    return {"series": series, "gauges": {name: read() for name, (_, read) in _gauges.items()}}
+
+# 把本 worker 的累計值寫入 Redis
+def flush():
+    key = _instance_key()
+    with suppressed():
+        pipe = metrics_db.pipeline(transaction=False)
+        pipe.set(key, json.dumps(_snapshot()), ex=METRICS_TTL)
+        pipe.zadd(METRICS_INSTANCES_KEY, {key: time.time()})
+        pipe.zremrangebyscore(METRICS_INSTANCES_KEY, "-inf", time.time() - METRICS_TTL)
+        pipe.execute()
+
+# 背景定期寫入；任何例外（包含 gauge 的讀值函式出錯）都不能讓這個執行緒結束，否則 /metrics 會停在舊值
+def _flush_loop():
+    while True:
+        time.sleep(METRICS_FLUSH_INTERVAL)
+        try:
+            flush()
+        except redis.RedisError:
+            pass  # Redis 暫時無法連線時下次再寫
+        except Exception:
+            traceback.print_exc()
+
+def start_flusher():
+    if _flusher["thread"] is None:
+        _flusher["thread"] = threading.Thread(target=_flush_loop, name="metrics-flush", daemon=True)
+        _flusher["thread"].start()
+
+# 合併所有 worker 的累計值，回傳 ({(metric, labels): [buckets, 總秒數, 次數]}, {gauge 名稱: 各 worker 加總})
+def collect():
+    flush()
+    with suppressed():
+        keys = metrics_db.zrangebyscore(METRICS_INSTANCES_KEY, time.time() - METRICS_TTL, "+inf")
+        snapshots = metrics_db.mget(keys) if keys else []
+
+    merged, gauges = {}, {}
+    for raw in snapshots:
+        if not raw:
+            continue
+        snapshot = json.loads(raw)
+        for name, value in snapshot.get("gauges", {}).items():
+            gauges[name] = gauges.get(name, 0) + value
+        for metric, labels, buckets, total, count in snapshot.get("series", []):
+            key = (metric, tuple(tuple(pair) for pair in labels))
+            series = merged.setdefault(key, [[0] * (len(BUCKETS) + 1), 0.0, 0])
+            for i, n in enumerate(buckets):
+                series[0][i] += n
+            series[1] += total
+            series[2] += count
+    return merged, gauges
+
+# 由 histogram 估計分位數（bucket 內線性內插，與 Prometheus histogram_quantile 相同）
+def estimate_quantile(buckets, q):
+    count = sum(buckets)
+    if not count:
+        return 0.0
+    rank = q * count
+    cumulative = 0
+    for i, n in enumerate(buckets):
+        if cumulative + n >= rank and n:
+            lower = BUCKETS[i - 1] if i > 0 else 0.0
+            if i == len(BUCKETS):  # 落在 +Inf，只能回報最大的有限上界
+                return BUCKETS[-1]
+            return lower + (BUCKETS[i] - lower) * (rank - cumulative) / n
+        cumulative += n
+    return BUCKETS[-1]
+
+def _format_labels(labels, **extra):
+    pairs = list(labels) + list(extra.items())
+    escaped = [(k, str(v).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")) for k, v in pairs]
+    return "{" + ",".join(f'{k}="{v}"' for k, v in escaped) + "}"
+
+def render_metrics(merged, gauges=None):
+    lines = []
+    for metric, help_text in (("request", "HTTP 請求延遲（依路由）"), ("span", "區段延遲（Redis / OpenAI / embedding / bcrypt）")):
+        name = f"{METRIC_PREFIX}_{metric}_duration_seconds"
+        items = sorted((labels, series) for (m, labels), series in merged.items() if m == metric)
+
+        lines += [f"# HELP {name} {help_text}", f"# TYPE {name} histogram"]
+        for labels, (buckets, total, count) in items:
+            cumulative = 0
+            for bound, n in zip(list(BUCKETS) + ["+Inf"], buckets):
+                cumulative += n
+                lines.append(f"{name}_bucket{_format_labels(labels, le=bound)} {cumulative}")
+            lines.append(f"{name}_sum{_format_labels(labels)} {total:.6f}")
+            lines.append(f"{name}_count{_format_labels(labels)} {count}")
+
+        lines += [f"# HELP {name}_quantile {help_text}的 p50/p95/p99 估計值", f"# TYPE {name}_quantile gauge"]
+        for labels, (buckets, _, _) in items:
+            for q in QUANTILES:
+                lines.append(f"{name}_quantile{_format_labels(labels, quantile=q)} {estimate_quantile(buckets, q):.6f}")
+
+    for gauge, value in sorted((gauges or {}).items()):
+        name = f"{METRIC_PREFIX}_{gauge}"
+        help_text = _gauges[gauge][0] if gauge in _gauges else gauge
+        lines += [f"# HELP {name} {help_text}", f"# TYPE {name} gauge", f"{name} {value}"]
+    return "\n".join(lines) + "\n"
+
+def metrics_view():
+    return Response(render_metrics(*collect()), mimetype="text/plain; version=0.0.4")
@@ -0,0 +1,296 @@
+# 子單元向量快取（unit_vector_db，Redis DB1）
+#
+# search_similar_subtopics() 原本每次查詢都要 KEYS subtopic:*、逐筆 HGET、json.loads 再 np.vstack，
+# 這裡改成把所有子單元向量整理成「已正規化的 float32 矩陣」常駐在記憶體中，
+# 只有 rebuild_unit_vector_db() 改動 DB1 後（版本號變動）才重新載入，
+# 每次相似度查詢只剩一次矩陣與向量的乘法。
+#
+# 版本通知（DB1）：
+#   - Key: subtopic_version（str），每次重建 DB1 後寫入新的版本號
+#   - Pub/Sub 頻道: subtopic_version_changed，重建後 PUBLISH 新版本號
+#   - 沒有啟動監聽執行緒時，每次查詢只多一次 GET subtopic_version 比對版本
+#
+# 向量儲存格式（subtopic:{子單元名稱} 的 embedding 欄位）：
+#   - binary（預設）：8 bytes 標頭（magic b"f4le" + uint32 維度）後接 little-endian float32 原始位元組，
+#                    以 np.frombuffer 直接讀取、不需複製
+#   - json（舊格式）：json.dumps(list[float])，遷移期間仍可讀取
+#   由環境變數 EMBEDDING_STORAGE=binary|json 決定寫入格式
+#
+# 課程索引（取代 KEYS subtopic:* 掃描，由 rebuild_unit_vector_db() 以 MULTI 交易一併寫入）：
+#   - index:units（zset）: 主單元名稱，score 為課程順序
+#   - index:subtopics（zset）: 所有子單元名稱，score 為全課程順序
+#   - index:subtopic_unit（hash）: 子單元名稱 -> 主單元名稱
+#   - index:unit:{主單元名稱}（zset）: 該主單元的子單元，score 為課程順序
+#
+# 磁碟快照（選用）：設定 SUBTOPIC_SNAPSHOT=/path/subtopics.npy 後，重建 DB1 時會另存
+#   已正規化矩陣（.npy）與子單元名稱/版本號（.json），各 Flask worker 以 mmap 共用同一份矩陣
+
+import os
+import struct
+import threading
+import time
+import json
+import numpy as np
+import redis
+
+VERSION_KEY = "subtopic_version"
+MODEL_KEY = "subtopic_model"  # 建立 DB1 向量所用的模型名稱，查詢向量須用同一個模型
+VERSION_CHANNEL = "subtopic_version_changed"
+
+EMBEDDING_STORAGE = os.getenv("EMBEDDING_STORAGE", "binary")
+SNAPSHOT_PATH = os.getenv("SUBTOPIC_SNAPSHOT")
+
+_EMBEDDING_MAGIC = b"f4le"
+_EMBEDDING_HEADER = struct.Struct("<4sI")  # magic, 維度
+
+unit_vector_db = redis.Redis(host='localhost', port=6379, db=1)
+
+# 記憶體中的向量矩陣快取
+_cache = {"version": None, "model": None, "subtopics": [], "matrix": np.zeros((0, 0), dtype=np.float32)}
+_cache_lock = threading.Lock()
+
+# Pub/Sub 監聽狀態：stale=True 表示需要重新確認版本
+_listener = {"thread": None, "stale": True}
+
+
+# 產生新的版本號並通知其他 worker
+# 使用 time_ns 而非 INCR：rebuild 會 flushdb()，計數器會被歸零而與舊版本號重複
+def new_version():
+    return str(time.time_ns())
+
+def bump_version(version=None):
+    version = version or new_version()
+    unit_vector_db.set(VERSION_KEY, version)
+    unit_vector_db.publish(VERSION_CHANNEL, version)
+    return version
+
+def current_version():
+    version = unit_vector_db.get(VERSION_KEY)
+    return version.decode("utf-8") if version else None
+
+INDEX_UNITS = "index:units"
+INDEX_SUBTOPICS = "index:subtopics"
+INDEX_SUBTOPIC_UNIT = "index:subtopic_unit"
+
+def unit_index_key(unit):
+    return f"index:unit:{unit}"
+
+# 把課程索引寫入指令加到 pipeline（course_units: [(主單元名稱, [子單元名稱, ...]), ...]）
+# old_units 為舊索引中的主單元，會一併刪除其 index:unit:* 以免殘留
+def write_course_index(pipe, course_units, old_units=()):
+    pipe.delete(INDEX_UNITS, INDEX_SUBTOPICS, INDEX_SUBTOPIC_UNIT,
+                *[unit_index_key(unit) for unit in old_units])
+    order = 0
+    for unit_pos, (unit, topics) in enumerate(course_units):
+        pipe.zadd(INDEX_UNITS, {unit: unit_pos})
+        for topic_pos, topic in enumerate(topics):
+            pipe.zadd(unit_index_key(unit), {topic: topic_pos})
+            pipe.zadd(INDEX_SUBTOPICS, {topic: order})
+            pipe.hset(INDEX_SUBTOPIC_UNIT, topic, unit)
+            order += 1
+
+# 依課程結構補建索引（舊資料沒有索引時使用），只收錄 DB1 中確實存在的子單元
+def rebuild_course_index(course_units):
+    pipe = unit_vector_db.pipeline(transaction=False)
+    for _, topics in course_units:
+        for topic in topics:
+            pipe.exists(f"subtopic:{topic}")
+    exists = iter(pipe.execute())
+    present = [(unit, [t for t in topics if next(exists)]) for unit, topics in course_units]
+    old_units = [u.decode("utf-8") for u in unit_vector_db.zrange(INDEX_UNITS, 0, -1)]
+
+    pipe = unit_vector_db.pipeline(transaction=True)
+    write_course_index(pipe, [(unit, topics) for unit, topics in present if topics], old_units)
+    pipe.execute()
+
+# 一次往返讀出整份課程索引：(主單元順序, {主單元: [子單元...]}, {子單元: 主單元})
+def read_course_index():
+    pipe = unit_vector_db.pipeline(transaction=False)
+    pipe.zrange(INDEX_UNITS, 0, -1)
+    pipe.zrange(INDEX_SUBTOPICS, 0, -1)
+    pipe.hgetall(INDEX_SUBTOPIC_UNIT)
+    raw_units, raw_topics, raw_map = pipe.execute()
+
+    topic_unit_map = {k.decode("utf-8"): v.decode("utf-8") for k, v in raw_map.items()}
+    unit_order = [u.decode("utf-8") for u in raw_units]
+    unit_topic_list = {unit: [] for unit in unit_order}
+    for raw_topic in raw_topics:
+        topic = raw_topic.decode("utf-8")
+        unit = topic_unit_map.get(topic)
+        if unit is not None:
+            unit_topic_list.setdefault(unit, []).append(topic)
+    return unit_order, unit_topic_list, topic_unit_map
+
+# 依課程順序取得某主單元的子單元列表（一次 ZRANGE）
+def get_unit_topics(unit):
+    return [t.decode("utf-8") for t in unit_vector_db.zrange(unit_index_key(unit), 0, -1)]
+
+def subtopic_count():
+    return unit_vector_db.zcard(INDEX_SUBTOPICS)
+
+# 將單一向量編碼成 embedding 欄位內容
+def encode_embedding(vector, storage=None):
+    vector = np.asarray(vector, dtype="<f4").reshape(-1)
+    if (storage or EMBEDDING_STORAGE) == "json":
+        return json.dumps(vector.tolist())
+    return _EMBEDDING_HEADER.pack(_EMBEDDING_MAGIC, vector.shape[0]) + vector.tobytes()
+
+# 解碼 embedding 欄位（binary 或舊的 json 格式），binary 格式回傳唯讀、不複製的 view
+def decode_embedding(data):
+    if isinstance(data, str):
+        data = data.encode("utf-8")
+    if data[:4] == _EMBEDDING_MAGIC:
+        _, dim = _EMBEDDING_HEADER.unpack_from(data)
+        return np.frombuffer(data, dtype="<f4", count=dim, offset=_EMBEDDING_HEADER.size)
+    return np.asarray(json.loads(data), dtype=np.float32)
+
+# 將 DB1 中仍為 json 格式的 embedding 改寫成 binary 格式，回傳改寫數量
+def migrate_embeddings_to_binary():
+    keys = [b"subtopic:" + t for t in unit_vector_db.zrange(INDEX_SUBTOPICS, 0, -1)]
+    pipe = unit_vector_db.pipeline(transaction=False)
+    for key in keys:
+        pipe.hget(key, "embedding")
+    raw_embeddings = pipe.execute()
+
+    pipe = unit_vector_db.pipeline(transaction=False)
+    migrated = 0
+    for key, data in zip(keys, raw_embeddings):
+        if data and data[:4] != _EMBEDDING_MAGIC:
+            pipe.hset(key, "embedding", encode_embedding(decode_embedding(data), "binary"))
+            migrated += 1
+    pipe.execute()
+    if migrated:
+        bump_version()
+    print(f"✅ 已將 {migrated} 個子單元向量改寫為 binary 格式")
+    return migrated
+
+# 將每列向量正規化為單位長度，之後內積即為 cosine 相似度
+def normalize_rows(matrix):
+    matrix = np.asarray(matrix, dtype=np.float32)
+    if matrix.ndim == 1:
+        matrix = matrix.reshape(1, -1)
+    norms = np.linalg.norm(matrix, axis=1, keepdims=True)
+    norms[norms == 0] = 1.0
+    return matrix / norms
+
+# 從 Redis DB1 讀出所有子單元向量：依 index:subtopics 順序以 SORT ... GET 一次往返取回名稱與向量
+def _load_from_redis():
+    rows = unit_vector_db.sort(INDEX_SUBTOPICS, by="nosort",
+                               get=["#", "subtopic:*->embedding"], groups=True)
+
+    subtopics = []
+    vectors = []
+    for topic, data in rows:
+        if data:
+            subtopics.append(topic.decode("utf-8"))
+            vectors.append(decode_embedding(data))
+    if not vectors:
+        return subtopics, np.zeros((0, 0), dtype=np.float32)
+    return subtopics, normalize_rows(np.vstack(vectors))
+
+def _snapshot_meta_path(path):
+    return os.path.splitext(path)[0] + ".json"
+
+# 將正規化矩陣寫成 .npy 快照（先寫暫存檔再 rename，避免其他 worker 讀到寫一半的檔案）
+def save_snapshot(subtopics, matrix, version, path=None):
+    path = path or SNAPSHOT_PATH
+    if not path:
+        return None
+    tmp_path = path + ".tmp.npy"
+    np.save(tmp_path, np.ascontiguousarray(matrix, dtype="<f4"))
+    os.replace(tmp_path, path)
+    meta_tmp = _snapshot_meta_path(path) + ".tmp"
+    with open(meta_tmp, "w", encoding="utf-8") as f:
+        json.dump({"version": version, "subtopics": list(subtopics)}, f, ensure_ascii=False)
+    os.replace(meta_tmp, _snapshot_meta_path(path))
+    return path
+
+# 讀取版本號相符的 .npy 快照（mmap 唯讀），不存在或版本不符時回傳 None
+def load_snapshot(version, path=None):
+    path = path or SNAPSHOT_PATH
+    if not path or version is None:
+        return None
+    try:
+        with open(_snapshot_meta_path(path), "r", encoding="utf-8") as f:
+            meta = json.load(f)
+        if meta.get("version") != version:
+            return None
+        matrix = np.load(path, mmap_mode="r")
+    except (OSError, ValueError):
+        return None
+    if matrix.shape[0] != len(meta["subtopics"]):
+        return None
+    return meta["subtopics"], matrix
+
+# 重建 DB1 後呼叫：從 Redis 讀出新矩陣並寫入快照（未設定 SUBTOPIC_SNAPSHOT 時不做事）
+def write_snapshot_for_version(version, path=None):
+    if not (path or SNAPSHOT_PATH):
+        return None
+    subtopics, matrix = _load_from_redis()
+    return save_snapshot(subtopics, matrix, version, path)
+
+# 取得（必要時重新載入）子單元名稱與正規化後的向量矩陣
+def get_subtopic_matrix():
+    listener_alive = _listener["thread"] is not None and _listener["thread"].is_alive()
+    if listener_alive and not _listener["stale"] and _cache["version"] is not None:
+        return _cache["subtopics"], _cache["matrix"]
+
+    # 先清掉 stale 再讀版本：讀取期間若又重建，下一次查詢會再檢查一次
+    _listener["stale"] = False
+    version = current_version()
+    if version is not None and version == _cache["version"]:
+        return _cache["subtopics"], _cache["matrix"]
+
+    with _cache_lock:
+        if version is None or version != _cache["version"]:
+            snapshot = load_snapshot(version)
+            subtopics, matrix = snapshot if snapshot else _load_from_redis()
+            _cache["subtopics"] = subtopics
+            _cache["matrix"] = matrix
+            _cache["version"] = version
+            model = unit_vector_db.get(MODEL_KEY)
+            _cache["model"] = model.decode("utf-8") if model else None
+            print(f"🔄 已載入子單元向量矩陣 {matrix.shape}（版本 {version}）")
+        return _cache["subtopics"], _cache["matrix"]
+
+# 建立目前 DB1 向量所用的模型名稱（舊資料沒有記錄時為 None）
+def get_subtopic_model():
+    get_subtopic_matrix()
+    return _cache["model"]
+
+# 清除記憶體快取，下次查詢會重新從 Redis 載入
+def invalidate_cache():
+    with _cache_lock:
+        _cache["version"] = None
+    _listener["stale"] = True
+
+# 回傳與 query 向量最相似的 top_k 個子單元 [(子單元名稱, 相似度), ...]
+def search(query_vec, top_k=3):
+    subtopics, matrix = get_subtopic_matrix()
+    if not subtopics:
+        return []
+    query = normalize_rows(query_vec).reshape(-1)
+    if query.shape[0] != matrix.shape[1]:
+        raise ValueError(f"查詢向量維度 {query.shape[0]} 與子單元向量維度 {matrix.shape[1]} 不符")
+    scores = matrix @ query
+    top_k = min(top_k, len(subtopics))
+    top_indices = np.argpartition(scores, -top_k)[-top_k:]
+    top_indices = top_indices[np.argsort(scores[top_indices])[::-1]]
+    return [(subtopics[i], float(scores[i])) for i in top_indices]
+
+def _listen_for_version_changes():
+    pubsub = unit_vector_db.pubsub(ignore_subscribe_messages=True)
+    pubsub.subscribe(VERSION_CHANNEL)
+    for message in pubsub.listen():
+        if message and message.get("type") == "message":
+            _listener["stale"] = True
+
+# 啟動背景執行緒訂閱版本變更；啟動後查詢不必每次 GET 版本號
+def start_version_listener():
+    if _listener["thread"] is not None and _listener["thread"].is_alive():
+        return _listener["thread"]
+    _listener["stale"] = True
+    t = threading.Thread(target=_listen_for_version_changes, name="subtopic-version-listener", daemon=True)
+    t.start()
+    _listener["thread"] = t
+    return t
@@ -0,0 +1,16 @@
+# 正式環境的 WSGI 進入點
+#
+#   gunicorn -c gunicorn.conf.py wsgi:app
+#
+# 每個 worker 行程各自 import 後端；模組層級的 topic_unit_map / unit_topic_list 由
+# database.refresh_unit_data_if_stale() 依 DB1 版本號保持一致，子單元向量矩陣由 vector_store 依版本號重新載入。
+
+# 登入狀態是 DB3 中有 TTL 的 session key，worker 啟動或重啟時不需要重設。
+
+import main
+from database import app, refresh_unit_data_if_stale
+
+__all__ = ["app"]
+
+refresh_unit_data_if_stale(force=True)
+main.prepare_server()
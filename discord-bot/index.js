@@ -17,7 +17,8 @@ const client = new Client({
     GatewayIntentBits.MessageContent
   ]
 });
-const userState = new Map(); // 創建用戶狀態的 Map
+// 作答流程的狀態（主單元、子主題、題目、計時）由後端 session 記錄，bot 只需記得誰正在作答
+const awaitingAnswer = new Set();
 
 // 從commands.json中讀取指令設置，若新增斜線指令，要去json檔新增此指令名稱、內容
 const commands = require('./commands.json'); 
@@ -25,6 +26,12 @@ const commands = require('./commands.json');
 //註冊斜線指令
 client.once('ready', async () => {
   console.log(`Logged in as ${client.user.tag}!`);
+  try { // bot 重啟後，從後端恢復正在作答中的使用者
+    const awaitingRes = await axios.get(`${API_BASE}/api/sessions/awaiting`);
+    (awaitingRes.data.discord_ids || []).forEach(id => awaitingAnswer.add(id));
+  } catch (error) {
+    console.error('恢復作答狀態失敗：', error.message);
+  }
   const rest = new REST({ version: '9' }).setToken(process.env.TOKEN);
   try {
     await rest.put( //上傳斜線指令到 Discord
@@ -106,6 +113,43 @@ const {
   ButtonStyle
 } = require('discord.js');
 
+// 課程樹快取（主單元 -> 子主題，含穩定 id）：帶 If-None-Match 查詢，未變更時後端回 304，直接沿用快取
+let courseTree = { etag: null, tree: null };
+
+async function getCourseTree() {
+  const res = await axios.get(`${API_BASE}/api/course/tree`, {
+    headers: courseTree.etag ? { 'If-None-Match': courseTree.etag } : {},
+    validateStatus: status => status === 200 || status === 304
+  });
+  if (res.status === 200) {
+    courseTree = { etag: res.headers.etag, tree: res.data };
+  }
+  return courseTree.tree;
+}
+
+function findUnit(tree, unitId) {
+  return tree.units.find(unit => unit.id === unitId);
+}
+
+// 以非同步出題工作取得題目（回傳 { questions, qids }）：先送出工作，再以 long-poll 等待完成，避免單一請求卡住整個 GPT 往返
+// body 為 { topic }、{ topic_id }（課程樹中的子主題 id）或 { topic_index }，出題結果會記入後端 session
+async function fetchQuestions(dc_id, body) {
+  const submitRes = await axios.post(`${API_BASE}/api/student/${dc_id}/questions/jobs`, body);
+  const jobId = submitRes.data.job_id;
+  if (!jobId) {
+    throw new Error(submitRes.data.error || '出題工作建立失敗');
+  }
+
+  for (let i = 0; i < 10; i++) {
+    const jobRes = await axios.get(`${API_BASE}/api/student/${dc_id}/questions/jobs/${jobId}`, {
+      params: { wait: 20 }
+    });
+    if (jobRes.data.status === 'done') return jobRes.data;
+    if (jobRes.data.status === 'error') throw new Error(jobRes.data.error || '出題失敗');
+  }
+  throw new Error('出題逾時');
+}
+
 // 斜線指令 menu，包含延遲回復，取得使用者id
 async function showMenu(interaction) {
   try {
@@ -162,9 +206,9 @@ client.on(Events.InteractionCreate, async interaction => {
       await interaction.reply('📊 準備查詢進度...');
     } else if (customId === 'start') { //按下開始答題按鈕後
       await interaction.deferReply();
-      try { //向後端取得該學生的主單元列表
-        const res = await axios.get(`${API_BASE}/api/student/${dc_id}/units/menu`);
-        const units = res.data.menu;
+      try { //從課程樹取得主單元列表（未變更時不需重新下載）
+        const tree = await getCourseTree();
+        const units = tree.units;
 
         const rows = [];
         let currentRow = new ActionRowBuilder();
@@ -176,7 +220,7 @@ client.on(Events.InteractionCreate, async interaction => {
             currentRow = new ActionRowBuilder();
           }
           currentRow.addComponents(
-            new ButtonBuilder().setCustomId(`unit_${idx}`).setLabel(unit).setStyle(ButtonStyle.Primary)
+            new ButtonBuilder().setCustomId(`unit_${unit.id}`).setLabel(`${unit.order}. ${unit.name}`).setStyle(ButtonStyle.Primary)
           );
         });
         if (currentRow.components.length > 0) rows.push(currentRow);
@@ -189,18 +233,19 @@ client.on(Events.InteractionCreate, async interaction => {
       }
     } else if (customId.startsWith('unit_')) { //抓出按下的主單元索引
       await interaction.deferReply();
-      const index = parseInt(customId.split('_')[1]);
-      //向後端再次取得所有單元文字，取出使用者點選的那一項
+      const unitId = customId.slice('unit_'.length);
+      //由後端記錄選到的主單元（開始新的作答 session），子主題直接取自課程樹
       try {
-        const unitMenuRes = await axios.get(`${API_BASE}/api/student/${dc_id}/units/menu`);
-        const unitText = unitMenuRes.data.menu[index];
-        const unitName = unitText.split('. ')[1];
-        userState.set(dc_id, { unit: unitName }); // 將選到的主單元存在記憶體中
-        
-        //接著向後端拿所有子主題資料，從中選出對應這個主單元的項目。
-        const topicRes = await axios.get(`${API_BASE}/api/student/${dc_id}/topics`);
-        const topicMap = topicRes.data;
-        const topics = topicMap[unitName];
+        const tree = await getCourseTree();
+        const unit = findUnit(tree, unitId);
+        if (!unit) {
+          await interaction.editReply("⚠️ 課程已更新，請輸入 `/menu` 重新開始。");
+          return;
+        }
+        await axios.post(`${API_BASE}/api/student/${dc_id}/session/unit`, { unit_id: unitId });
+        const unitName = unit.name;
+        const topics = unit.topics;
+        awaitingAnswer.delete(dc_id);
 
         //跟主單元一樣，把所有子主題依序包成按鈕，並分行顯示。
         if (!topics || topics.length === 0) {
@@ -217,7 +262,7 @@ client.on(Events.InteractionCreate, async interaction => {
             currentRow = new ActionRowBuilder();
           }
           currentRow.addComponents(
-            new ButtonBuilder().setCustomId(`topic_${idx}`).setLabel(topic).setStyle(ButtonStyle.Secondary)
+            new ButtonBuilder().setCustomId(`topic_${topic.id}`).setLabel(`${topic.order}. ${topic.name}`).setStyle(ButtonStyle.Secondary)
           );
         });
         if (currentRow.components.length > 0) rows.push(currentRow);
@@ -234,29 +279,11 @@ client.on(Events.InteractionCreate, async interaction => {
     } //取出使用者選擇的子主題索引，以及之前儲存的 unit 名稱
       else if (customId.startsWith('topic_')) {
       await interaction.deferReply();
-      const index = parseInt(customId.split('_')[1]);
-      const state = userState.get(dc_id);
-
-      //確認是否選過主單元，並向後端取該單元對應的子主題名稱，更新記憶中的使用者狀態
-      if (!state || !state.unit) {
-        await interaction.editReply("⚠️ 請先選擇主單元！");
-        return;
-      }
+      const topicId = customId.slice('topic_'.length);
 
+      //送出出題工作並等待對應主題的題目列表（後端依課程樹 id 找出子主題，並記錄出題結果）
       try {
-        const unitMenuRes = await axios.get(`${API_BASE}/api/student/${dc_id}/topics/menu`, {
-          params: { unitkey: state.unit }
-        });
-        const topicName = unitMenuRes.data.menu[index];
-        state.topic = topicName;
-
-        //送出請求產生對應主題的題目列表，儲存到該用戶的狀態中
-        const res = await axios.post(`${API_BASE}/api/student/${dc_id}/questions`, {
-          topic: topicName
-        });
-        const questions = res.data.questions;
-        state.questions = questions;
-        userState.set(dc_id, state);
+        const { questions } = await fetchQuestions(dc_id, { topic_id: topicId });
 
         //將每一題組成按鈕（顯示題號與簡短描述），顯示給使用者選擇
         const row = new ActionRowBuilder().addComponents(
@@ -280,34 +307,12 @@ client.on(Events.InteractionCreate, async interaction => {
       else if (customId.startsWith('question_')) {
       await interaction.deferReply();
       const index = parseInt(customId.split('_')[1]);
-      const state = userState.get(dc_id);
-      
-      //如果使用者還沒選過主單元或主題或題目資料不存在，代表流程斷裂，提示重新開始
-      if (!state || !state.topic || !state.questions) {
-        await interaction.editReply("⚠️ 找不到上下文資料，請輸入 `/menu` 重新開始。");
-        return;
-      }
-      
-      //將使用者選擇的題目存入狀態中，並記錄目前時間（用於後續計時），最後更新狀態
-      const selectedQuestion = state.questions[index];
-      state.question = selectedQuestion;
-      state.questionIndex = index;
-      state.total_start_time = Date.now();
-      state.currentQuestion = selectedQuestion;
-      userState.set(dc_id, state);
-      
-      //透過 /question API 傳送選定的題目名稱（簡短描述），後端回傳詳細敘述後儲存狀態
-      try {
-        const res = await axios.post(`${API_BASE}/api/student/${dc_id}/question`, null, {
-          params: {
-            question_data: selectedQuestion
-          }
-        });
 
+      //由後端記錄選定的題目並開始計時，回傳詳細敘述
+      try {
+        const res = await axios.post(`${API_BASE}/api/student/${dc_id}/session/question`, { index });
         const fullQuestion = res.data.question;
-        state.awaitingAnswer = true;
-        state.typing_start_time = Date.now();
-        userState.set(dc_id, state);
+        awaitingAnswer.add(dc_id);
 
         //最終顯示詳細題目並清除互動元件（按鈕），提示使用者直接在文字頻道輸入答案
         await interaction.editReply({
@@ -316,6 +321,10 @@ client.on(Events.InteractionCreate, async interaction => {
         });
       } catch (err) {
         console.error("取得完整題目錯誤:", err.message);
+        if (err.response?.status === 404) { //後端找不到出題紀錄，代表流程斷裂，提示重新開始
+          await interaction.editReply("⚠️ 找不到上下文資料，請輸入 `/menu` 重新開始。");
+          return;
+        }
         await interaction.editReply("❌ 題目讀取失敗，請稍後再試。");
       }
     }
@@ -325,27 +334,13 @@ client.on(Events.InteractionCreate, async interaction => {
 //這裡會在使用者輸入文字時觸發，如果他剛才有選擇題目、正在作答，就會進行送出答案、評分、顯示回饋的邏輯
 client.on(Events.MessageCreate, async message => {
   if (message.author.bot) return;
-  //抓出該使用者的狀態，如果不存在或沒有「目前題目」，表示目前不是在作答流程中，直接忽略
+  //如果使用者沒有選好的題目，表示目前不是在作答流程中，直接忽略
   const dc_id = message.author.id;
-  const state = userState.get(dc_id);
+  if (!awaitingAnswer.has(dc_id)) return;
 
-  if (!state || !state.currentQuestion) return;
-
-  //計算答題時間與開始輸入時間
+  //題目、單元與答題計時都記錄在後端 session，只需送出答案文字
   const answer = message.content;
-
-  const total_start_time = state.total_start_time / 1000;//從題目顯示到送出答案的總時間
-  const typing_start_time = (Date.now() - state.typing_start_time) / 1000;//從使用者開始輸入到送出的時間
-
-  //組成送往後端 /answer API 的 payload，包含使用者回答與上下文資訊
-  const payload = {
-    answer,
-    question: state.currentQuestion,
-    unit: state.unit,
-    topic: state.topic,
-    total_start_time,
-    typing_start_time
-  };
+  const payload = { answer };
 
   //呼叫後端評分 API
   try {
@@ -354,7 +349,7 @@ client.on(Events.MessageCreate, async message => {
 
     await message.reply(`✅ 評分完成\n📊 分數：${score}/10\n💬 評語：${feedback}`);
 
-    userState.delete(dc_id); // 清除作答狀態，重新開始新流程
+    awaitingAnswer.delete(dc_id); // 清除作答狀態，重新開始新流程
 
     //系統自動送出主選單，讓使用者可以快速進入下一輪答題或查看進度
     const row = new ActionRowBuilder().addComponents(
@@ -368,6 +363,11 @@ client.on(Events.MessageCreate, async message => {
     });
   } catch (err) {
     console.error("提交答案錯誤：", err.message);
+    if (err.response?.status === 400) { //後端已沒有作答中的題目（session 過期）
+      awaitingAnswer.delete(dc_id);
+      await message.reply("⚠️ 作答時間已過期，請輸入 `/menu` 重新開始。");
+      return;
+    }
     await message.reply("❌ 提交答案失敗，請稍後再試。");
   }
 });